@@ -1,14 +1,74 @@
+import asyncio
+import copy
 import os
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from collections import deque
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from controllers.rag import PDFProcessingController
+from controllers.session_store import create_session_store
+from controllers.prompt_assembler import PromptAssembler, count_tokens
+from controllers.context_cache import create_context_cache
+from controllers.intent_gate import IntentGate, normalize
+from controllers.turn_pipeline import StageTimer, cancel_tasks
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+DOCUMENT_SYSTEM_PROMPT = """You are a helpful and professional AI customer support assistant for this organization. Your role is to assist customers by answering their questions accurately based on the organization's official documentation, policies, and knowledge base.
+
+Relevant information from our knowledge base is included with the customer's latest message.
+
+GUIDELINES:
+1. Greet customers warmly when they say hi, hello, hey, or similar — introduce yourself as the customer support assistant
+2. Respond to farewells (bye, goodbye, thank you, etc.) in a friendly, professional manner
+3. Answer customer questions using ONLY the knowledge base information provided — do not make up or assume details
+4. Be empathetic, clear, concise, and professional in every response
+5. If a customer sounds frustrated or upset, acknowledge their concern before answering
+6. NEVER include source citations like "Document 1", "Based on the documents", chunk numbers, scores, or PDF filenames in your response
+7. If the provided information does not fully answer the customer's question, politely let them know and suggest they contact the support team directly for further assistance
+8. Never speculate or provide information outside of what is in the knowledge base"""
+
+GENERAL_SYSTEM_PROMPT = """You are a helpful and professional AI customer support assistant for this organization. Your role is to assist customers with their questions and concerns about the organization's products, services, and policies.
+
+GUIDELINES:
+1. Greet customers warmly and introduce yourself as the customer support assistant
+2. Respond to farewells professionally and warmly
+3. For general questions (greetings, small talk, courtesies), respond naturally and helpfully
+4. If a customer asks a specific question about policies, products, pricing, or services and you do not have the relevant documentation loaded, politely inform them that you currently don't have enough information to answer accurately and suggest they contact the support team or try again once documents have been uploaded
+5. Be empathetic, clear, and professional at all times
+6. Never speculate or fabricate answers"""
+
+# Volatile parts of the prompt travel with the latest message so the system prefix stays cacheable
+FAQ_PROMPT_SECTION = """
+
+Frequently requested information from our knowledge base:
+{faq}"""
+
+CONTEXT_SECTION = """Relevant information from our knowledge base:
+{context}"""
+
+SUMMARY_SECTION = """Summary of the earlier conversation:
+{summary}"""
+
+# Stand-in retrieval result for turns the intent gate answers without the knowledge base
+NO_RETRIEVAL = {"documents": [], "total_results": 0}
+
+REWRITE_SYSTEM_PROMPT = """Rewrite the customer's latest message as a standalone search query for the support knowledge base, resolving references to earlier messages. If it is already standalone, repeat it unchanged. Reply with the query only."""
+
+# Pronouns that point back at earlier turns, so the message alone retrieves poorly
+REFERENTIAL_WORDS = {"it", "that", "those", "they", "them"}
+REFERENTIAL_PHRASES = ("the other one",)
+# Elliptical follow-ups ("and for returns?", "what about Canada?") lean on the previous turn without a pronoun
+ELLIPSIS_OPENERS = ("and", "or", "but", "then", "what about", "how about", "same for")
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a customer support conversation. Merge the new messages into the existing summary. Keep customer details, order numbers, the issues raised and what has already been answered or promised. Reply with the updated summary only, in under 150 words."""
+
+
 class ChatSession:
     """Represents a chat session with message history"""
     
@@ -17,18 +77,162 @@ class ChatSession:
         self.organization_id = organization_id
         self.max_history = max_history
         self.messages = deque(maxlen=max_history)  
+        # Running summary of turns folded out of `messages`
+        self.summary = ""
+        self.summary_in_progress = False
+        # Every message gets a sequence number so a summary removes exactly the turns it covered
+        self.next_seq = 0
+        self.history_start = 0
+        self.summarized_through = -1
+        # next_seq when this copy was last read from or written to a shared store
+        self.synced_seq = 0
+        # Guards messages and summary between request handlers and the summary thread
+        self.lock = threading.RLock()
     
     def add_message(self, role: str, content: str):
         """Add a message to history"""
-        self.messages.append({"role": role, "content": content})
+        with self.lock:
+            self.messages.append({"role": role, "content": content, "seq": self.next_seq})
+            self.next_seq += 1
     
     def get_history(self) -> List[Dict]:
         """Get conversation history"""
-        return list(self.messages)
+        with self.lock:
+            return list(self.messages)
     
     def clear_history(self):
         """Clear conversation history"""
-        self.messages.clear()
+        with self.lock:
+            self.messages.clear()
+            self.summary = ""
+            self.history_start = self.next_seq
+    
+    def apply_summary(self, summary: str, through_seq: int) -> bool:
+        """
+        Replace messages up to and including through_seq with an updated running summary
+        
+        Skipped (returns False) if the history was cleared after the summarized
+        messages were taken.
+        """
+        with self.lock:
+            if through_seq < self.history_start:
+                return False
+            self.summary = summary
+            self.summarized_through = through_seq
+            self.messages = deque(
+                (message for message in self.messages if message["seq"] > through_seq), maxlen=self.max_history
+            )
+            return True
+    
+    def mark_synced(self):
+        with self.lock:
+            self.synced_seq = self.next_seq
+    
+    def rebase(self, stored: "ChatSession"):
+        """
+        Re-apply this copy's unsynced changes on top of a newer stored copy
+        
+        Used when another worker saved the session first: messages added here
+        since the last sync are appended after the stored ones, and a clear or
+        a newer summary made here replaces the stored history it covers.
+        """
+        with self.lock:
+            new_messages = [message for message in self.messages if message["seq"] >= self.synced_seq]
+            messages = list(stored.messages)
+            summary = stored.summary
+            summarized_through = stored.summarized_through
+            history_start = stored.history_start
+            if self.history_start > stored.history_start:
+                messages = []
+                summary = self.summary
+                summarized_through = self.summarized_through
+                history_start = stored.next_seq
+            elif self.summarized_through > stored.summarized_through:
+                # Only messages both copies already shared can have been folded into this summary
+                messages = [
+                    message for message in messages
+                    if message["seq"] > self.summarized_through or message["seq"] >= self.synced_seq
+                ]
+                summary = self.summary
+                summarized_through = self.summarized_through
+            
+            self.messages = deque(messages, maxlen=self.max_history)
+            self.next_seq = stored.next_seq
+            self.summary = summary
+            self.summarized_through = summarized_through
+            self.history_start = history_start
+            for message in new_messages:
+                self.add_message(message["role"], message["content"])
+    
+    def to_dict(self) -> Dict:
+        """Compact serialisable form used by external session stores"""
+        with self.lock:
+            return {
+                "org": self.organization_id,
+                "max": self.max_history,
+                "msgs": [[message["role"], message["content"], message["seq"]] for message in self.messages],
+                "sum": self.summary,
+                "seq": self.next_seq,
+                "start": self.history_start,
+                "thru": self.summarized_through
+            }
+    
+    @classmethod
+    def from_dict(cls, session_id: str, data: Dict) -> "ChatSession":
+        session = cls(session_id, data["org"], data["max"])
+        session.messages.extend({"role": role, "content": content, "seq": seq} for role, content, seq in data["msgs"])
+        session.next_seq = data["seq"]
+        session.history_start = data["start"]
+        session.summarized_through = data["thru"]
+        session.summary = data["sum"]
+        session.synced_seq = session.next_seq
+        return session
+
+
+class CitationLineFilter:
+    """
+    Incremental citation stripper for streamed responses
+    
+    Text is buffered until each line is complete, then lines mentioning
+    sources, PDFs or chunks are dropped (and everything after a "source:"
+    line). Leading and trailing whitespace of the whole response is withheld,
+    so the concatenated output equals the non-streaming cleaned response.
+    """
+    
+    def __init__(self):
+        self._buffer = ""
+        self._pending = ""
+        self._started = False
+        self._skip_rest = False
+    
+    def feed(self, text: str) -> str:
+        """Add streamed text; return whatever is now safe to emit"""
+        self._buffer += text
+        output = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            output.append(self._accept(line))
+        return "".join(output)
+    
+    def finish(self) -> str:
+        """Flush the final (unterminated) line"""
+        line, self._buffer = self._buffer, ""
+        return self._accept(line)
+    
+    def _accept(self, line: str) -> str:
+        lowered = line.lower()
+        if 'sources:' in lowered or 'source:' in lowered:
+            self._skip_rest = True
+        if self._skip_rest or '.pdf' in lowered or 'chunk' in lowered:
+            return ""
+        
+        text = self._pending + ("\n" + line if self._started else line.lstrip())
+        content = text.rstrip()
+        self._pending = text[len(content):]
+        if not content:
+            return ""
+        self._started = True
+        return content
 
 
 class RAGChatController:
@@ -36,169 +240,488 @@ class RAGChatController:
     Controller for RAG-based chatbot with conversation memory
     """
     
-    def __init__(self):
+    def __init__(self, pdf_processor: PDFProcessingController = None, embedder=None):
         self.google_api_key = os.getenv("GOOGLE_API_KEY")
         os.environ["GOOGLE_API_KEY"] = self.google_api_key
         
         # Initialize Gemini LLM
+        self.llm_model = "gemini-2.5-flash-lite"
         self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite",
+            model=self.llm_model,
             temperature=0.7,
             convert_system_message_to_human=True
         )
         
-        # Initialize PDF processor for retrieval
-        self.pdf_processor = PDFProcessingController()
+        # PDF processor for retrieval; share the ingestion one so uploads invalidate its caches
+        self.pdf_processor = pdf_processor or PDFProcessingController()
         
-        # Store active chat sessions {session_id: ChatSession}
-        self.sessions: Dict[str, ChatSession] = {}
+        # Local intent gate: greetings, thanks and small talk skip retrieval (embedder is all-MiniLM-L6-v2)
+        self.intent_gate = IntentGate(embedder)
+        
+        # Turn pipeline: follow-up rewriting races retrieval; idle LLM connections are re-opened during retrieval
+        self.query_rewrite = os.getenv("CHAT_QUERY_REWRITE", "true").lower() == "true"
+        self.rewrite_timeout = float(os.getenv("CHAT_QUERY_REWRITE_TIMEOUT_MS", "1500")) / 1000
+        self.rewrite_history_messages = int(os.getenv("CHAT_QUERY_REWRITE_HISTORY", "4"))
+        self.rewrite_min_history = int(os.getenv("CHAT_QUERY_REWRITE_MIN_HISTORY", "2"))
+        self.rewrite_max_words = int(os.getenv("CHAT_QUERY_REWRITE_MAX_WORDS", "12"))
+        self.llm_warmup = os.getenv("CHAT_LLM_WARMUP", "true").lower() == "true"
+        self.llm_warmup_idle_seconds = float(os.getenv("CHAT_LLM_WARMUP_IDLE_SECONDS", "10"))
+        self._last_llm_call = 0.0
+        
+        # Active chat sessions {session_id: ChatSession}, expired when idle and capped in size;
+        # CHAT_SESSION_BACKEND=sqlite shares them across workers
+        self.sessions = create_session_store(ChatSession)
+        
+        # Token-budgeted prompt building; old turns are summarized on a background thread
+        self.prompt_assembler = PromptAssembler()
+        self.summary_keep_messages = int(os.getenv("CHAT_SUMMARY_KEEP_MESSAGES", "4"))
+        self.summary_trigger_tokens = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "1500"))
+        self.summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+        
+        # Provider-side cache of the stable system prefix per organization (CONTEXT_CACHE_BACKEND, off by default)
+        self.context_cache = create_context_cache(self.pdf_processor.genai_client, self.llm_model)
+    
+    def with_session_store(self, sessions) -> "RAGChatController":
+        """A view of this controller keeping sessions in `sessions`; models, retrieval and caches stay shared"""
+        view = copy.copy(self)
+        view.sessions = sessions
+        return view
     
     def get_or_create_session(self, session_id: str, organization_id: str) -> ChatSession:
         """Get existing session or create a new one"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = ChatSession(session_id, organization_id)
-        return self.sessions[session_id]
-    
-    def build_context_from_documents(self, documents: List[Dict]) -> str:
-        """Build context string from retrieved documents"""
-        if not documents:
-            return "No relevant documents found."
-        
-        context_parts = []
-        for i, doc in enumerate(documents, 1):
-            context_parts.append(
-                f"[Document {i} - Score: {doc['score']:.2f}]\n{doc['content']}"
-            )
-        
-        return "\n\n".join(context_parts)
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = ChatSession(session_id, organization_id)
+            self.sessions[session_id] = session
+        return session
+    
+    @staticmethod
+    def render_document(position: int, doc: Dict) -> str:
+        return f"[Document {position} - Score: {doc['score']:.2f}]\n{doc['content']}"
     
-    def build_prompt(self, query: str, context: str, conversation_history: List[Dict], has_documents: bool) -> List:
-        """Build the prompt with context and conversation history"""
-        messages = []
+    def build_prompt(self, query: str, documents: List[Dict], conversation_history: List[Dict],
+                     summary: str = "", organization_id: str = None) -> Tuple[List, Dict]:
+        """
+        Build the prompt with context and conversation history within the token budget
         
-        # Adjust system message based on whether we have relevant documents
-        if has_documents and context != "No relevant documents found.":
-            system_prompt = f"""You are a helpful and professional AI customer support assistant for this organization. Your role is to assist customers by answering their questions accurately based on the organization's official documentation, policies, and knowledge base.
-
-Relevant information from our knowledge base:
-{context}
-
-GUIDELINES:
-1. Greet customers warmly when they say hi, hello, hey, or similar — introduce yourself as the customer support assistant
-2. Respond to farewells (bye, goodbye, thank you, etc.) in a friendly, professional manner
-3. Answer customer questions using ONLY the information provided above — do not make up or assume details
-4. Be empathetic, clear, concise, and professional in every response
-5. If a customer sounds frustrated or upset, acknowledge their concern before answering
-6. NEVER include source citations like "Document 1", "Based on the documents", chunk numbers, scores, or PDF filenames in your response
-7. If the provided information does not fully answer the customer's question, politely let them know and suggest they contact the support team directly for further assistance
-8. Never speculate or provide information outside of what is in the knowledge base"""
-        else:
-            system_prompt = """You are a helpful and professional AI customer support assistant for this organization. Your role is to assist customers with their questions and concerns about the organization's products, services, and policies.
-
-GUIDELINES:
-1. Greet customers warmly and introduce yourself as the customer support assistant
-2. Respond to farewells professionally and warmly
-3. For general questions (greetings, small talk, courtesies), respond naturally and helpfully
-4. If a customer asks a specific question about policies, products, pricing, or services and you do not have the relevant documentation loaded, politely inform them that you currently don't have enough information to answer accurately and suggest they contact the support team or try again once documents have been uploaded
-5. Be empathetic, clear, and professional at all times
-6. Never speculate or fabricate answers"""
+        The system message is a stable prefix (instructions plus the organization's
+        FAQ snippets) that can be served from the provider's context cache; retrieved
+        documents and the running summary travel with the latest customer message.
+        Returns the messages and the prompt assembler's token report.
+        """
+        faq = []
+        if self.context_cache is not None and organization_id and documents:
+            faq = self.context_cache.faq_for(organization_id, self.pdf_processor.document_generation(organization_id))
+        faq_ids = {vector_id for vector_id, _ in faq}
+        fresh_documents = [doc for doc in documents if doc.get("vector_id") not in faq_ids]
         
-        messages.append(SystemMessage(content=system_prompt))
+        document_prompt = DOCUMENT_SYSTEM_PROMPT
+        if faq:
+            document_prompt += FAQ_PROMPT_SECTION.format(faq="\n\n".join(text for _, text in faq))
+        
+        fitted = self.prompt_assembler.fit(
+            document_prompt if documents else GENERAL_SYSTEM_PROMPT, summary, query, fresh_documents,
+            conversation_history, self.render_document
+        )
+        # Adjust system message based on whether we have relevant documents (fitted or already in the FAQ)
+        use_documents = bool(fitted["documents"]) or len(fresh_documents) < len(documents)
+        system_prompt = document_prompt if use_documents else GENERAL_SYSTEM_PROMPT
+        
+        messages = [SystemMessage(content=system_prompt)]
         
         # Add conversation history
-        for msg in conversation_history:
+        for msg in fitted["history"]:
             if msg["role"] == "user":
                 messages.append(HumanMessage(content=msg["content"]))
             elif msg["role"] == "assistant":
                 messages.append(AIMessage(content=msg["content"]))
         
-        # Add current query
-        messages.append(HumanMessage(content=query))
+        # Add current query with the per-turn context; turns folded out of the history are carried by the summary
+        sections = []
+        if fitted["documents"]:
+            sections.append(CONTEXT_SECTION.format(context="\n\n".join(fitted["documents"])))
+        if summary:
+            sections.append(SUMMARY_SECTION.format(summary=summary))
+        if sections:
+            sections.append(f"Customer message:\n{query}")
+        messages.append(HumanMessage(content="\n\n".join(sections) if sections else query))
         
-        return messages
+        report = dict(fitted["tokens"])
+        report["system"] = count_tokens(system_prompt)
+        report["total"] = sum(report[key] for key in ("system", "summary", "query", "documents", "history"))
+        report["documents_used"] = fitted["documents_used"]
+        report["history_messages_used"] = fitted["history_messages_used"]
+        report["faq_snippets"] = len(faq) if use_documents else 0
+        report["variant"] = "documents" if use_documents else "general"
+        return messages, report
     
     def chat(self, session_id: str, organization_id: str, query: str, 
              top_k: int = 3, score_threshold: float = 0.4) -> Dict:
         """
-        Process a chat message with RAG and conversation history
+        Blocking wrapper around achat for scripts; not for use inside a running event loop
+        """
+        return asyncio.run(self.achat(session_id, organization_id, query, top_k, score_threshold))
+    
+    async def achat(self, session_id: str, organization_id: str, query: str,
+                    top_k: int = 3, score_threshold: float = 0.4) -> Dict:
+        """
+        Async chat: retrieval and generation never block the event loop
+        
+        The stages before generation run as a pipeline (see _aprepare_turn);
+        their timings are returned under "timings".
         """
         try:
-            # Get or create session
             session = self.get_or_create_session(session_id, organization_id)
+            timer = StageTimer()
             
-            # Retrieve relevant documents using RAG
-            print(f"\n--- Retrieving relevant documents for query: {query} ---")
-            retrieval_result = self.pdf_processor.retrieve_documents(
-                query, organization_id, top_k, score_threshold
-            )
-            
-            # Build context from retrieved documents
-            context = self.build_context_from_documents(retrieval_result.get("documents", []))
-            has_documents = len(retrieval_result.get("documents", [])) > 0
-            
-            # Get conversation history
-            conversation_history = session.get_history()
+            intent = self._quick_intent(query)
+            if intent is not None and intent["canned"]:
+                return self._finish_turn(session, query, intent["canned"], NO_RETRIEVAL, {}, intent)
             
-            # Build prompt with context and history
-            messages = self.build_prompt(query, context, conversation_history, has_documents)
+            warmup = self._start_warmup(timer)
+            intent, retrieval_result = await self._aprepare_turn(
+                session, query, intent, organization_id, top_k, score_threshold, timer
+            )
+            with timer.measure("prompt"):
+                prompt = self._prepare_messages(session, query, retrieval_result)
             
-            # Generate response using LLM
             print(f"\n--- Generating response with Gemini ---")
-            response = self.llm.invoke(messages)
-            ai_response = response.content.strip()
-            
-            lines = ai_response.split('\n')
-            cleaned_lines = []
-            skip_rest = False
-            
-            for line in lines:
-                if 'sources:' in line.lower() or 'source:' in line.lower():
-                    skip_rest = True
-                    continue
-                
-                if skip_rest or '.pdf' in line.lower() or 'chunk' in line.lower():
-                    continue
-                    
-                cleaned_lines.append(line)
-            
-            ai_response = '\n'.join(cleaned_lines).strip()
-            
-            # Add to conversation history
-            session.add_message("user", query)
-            session.add_message("assistant", ai_response)
-            
-            print(f"\n--- Response generated successfully ---")
+            # Generation opens its own connection if the warm-up has not finished by now
+            cancel_tasks(warmup)
+            with timer.measure("generation"):
+                response = await self._ainvoke(prompt)
             
-            return {
-                "status": "success",
-                "session_id": session_id,
-                "organization_id": organization_id,
-                "query": query,
-                "response": ai_response,
-                "sources": [
-                    {
-                        "pdf_filename": doc["pdf_filename"],
-                        "chunk_index": doc["chunk_index"],
-                        "score": doc["score"]
-                    }
-                    for doc in retrieval_result.get("documents", [])
-                ],
-                "conversation_length": len(session.get_history()),
-                "retrieved_documents": retrieval_result.get("total_results", 0)
-            }
+            result = self._finish_turn(session, query, self.strip_citations(response.content), retrieval_result,
+                                       prompt["tokens"], intent)
+            result["timings"] = timer.report()
+            return result
             
         except Exception as e:
             raise Exception(f"Error in chat: {str(e)}")
     
+    async def astream_chat(self, session_id: str, organization_id: str, query: str,
+                           top_k: int = 3, score_threshold: float = 0.4) -> AsyncIterator[Dict]:
+        """
+        Stream a chat turn as events: "sources", then "token" events, then "done"
+        
+        Tokens pass through CitationLineFilter as they arrive. The exchange is
+        added to the session history only once the stream completes.
+        """
+        session = self.get_or_create_session(session_id, organization_id)
+        timer = StageTimer()
+        
+        intent = self._quick_intent(query)
+        if intent is not None and intent["canned"]:
+            yield {"event": "sources", "data": {"sources": []}}
+            yield {"event": "token", "data": {"text": intent["canned"]}}
+            yield {"event": "done", "data": self._finish_turn(
+                session, query, intent["canned"], NO_RETRIEVAL, {}, intent
+            )}
+            return
+        
+        warmup = self._start_warmup(timer)
+        intent, retrieval_result = await self._aprepare_turn(
+            session, query, intent, organization_id, top_k, score_threshold, timer
+        )
+        yield {"event": "sources", "data": {"sources": self._sources(retrieval_result)}}
+        
+        with timer.measure("prompt"):
+            prompt = self._prepare_messages(session, query, retrieval_result)
+        citation_filter = CitationLineFilter()
+        parts = []
+        
+        print(f"\n--- Streaming response with Gemini ---")
+        cancel_tasks(warmup)
+        with timer.measure("generation"):
+            async for chunk in self._astream(prompt):
+                timer.mark("first_token")
+                text = citation_filter.feed(chunk.text)
+                if text:
+                    parts.append(text)
+                    yield {"event": "token", "data": {"text": text}}
+        text = citation_filter.finish()
+        if text:
+            parts.append(text)
+            yield {"event": "token", "data": {"text": text}}
+        
+        result = self._finish_turn(session, query, "".join(parts), retrieval_result, prompt["tokens"], intent)
+        result["timings"] = timer.report()
+        yield {"event": "done", "data": result}
+    
+    def _quick_intent(self, query: str) -> Optional[Dict]:
+        """Rule-only intent decision, or None when the embedding check has to run in the pipeline"""
+        if self.intent_gate.uses_embedding(query):
+            return None
+        return self.intent_gate.classify(query)
+    
+    async def _aprepare_turn(self, session: ChatSession, query: str, intent: Optional[Dict], organization_id: str,
+                             top_k: int, score_threshold: float, timer: StageTimer) -> Tuple[Dict, Dict]:
+        """
+        Run the stages before generation concurrently and return (intent, retrieval result)
+        
+        Retrieval for the message as typed starts straight away, alongside the
+        intent gate's embedding check and, for follow-ups, a history-aware
+        rewrite into a standalone query. Losing branches are cancelled: all
+        retrieval when the message turns out to be conversational, the as-typed
+        search when the rewrite changes the query, and the rewrite itself when
+        it takes longer than CHAT_QUERY_REWRITE_TIMEOUT_MS.
+        """
+        if intent is not None and not intent["retrieve"]:
+            print(f"\n--- Skipping retrieval for {intent['intent']} message ---")
+            return intent, NO_RETRIEVAL
+        
+        loop = asyncio.get_running_loop()
+        history = session.get_history()
+        intent_task = None
+        if intent is None:
+            # The embedding fallback is CPU-bound, keep it off the event loop
+            intent_task = timer.run("intent", loop.run_in_executor(None, self.intent_gate.classify, query))
+        retrieval = timer.run("retrieval", self._asearch(query, organization_id, top_k, score_threshold))
+        rewrite = None
+        gate_started = time.perf_counter()
+        needs_rewrite = self._needs_rewrite(query, history)
+        timer.record("rewrite_gate", gate_started, "rewrite" if needs_rewrite else "skipped")
+        if needs_rewrite:
+            rewrite = timer.run("rewrite", self._arewrite_query(query, history))
+        
+        if intent_task is not None:
+            intent = await intent_task
+            if not intent["retrieve"]:
+                cancel_tasks(retrieval, rewrite)
+                print(f"\n--- Skipping retrieval for {intent['intent']} message ---")
+                return intent, NO_RETRIEVAL
+        
+        if rewrite is not None:
+            try:
+                rewritten = await asyncio.wait_for(rewrite, self.rewrite_timeout)
+            except Exception as e:
+                print(f"Query rewrite skipped: {e!r}")
+                rewritten = ""
+            if rewritten and normalize(rewritten) != normalize(query):
+                cancel_tasks(retrieval)
+                retrieval = timer.run(
+                    "rewritten_retrieval", self._asearch(rewritten, organization_id, top_k, score_threshold)
+                )
+        
+        return intent, await retrieval
+    
+    def _needs_rewrite(self, query: str, history: List[Dict]) -> bool:
+        """
+        Follow-ups that lean on earlier turns are rewritten before retrieval
+        
+        That takes an elliptical opener ("what about Canada?") or, in messages
+        of at most CHAT_QUERY_REWRITE_MAX_WORDS words, a pronoun or phrase that
+        refers back ("does it ship abroad?", "the other one"), plus at least
+        CHAT_QUERY_REWRITE_MIN_HISTORY earlier messages to resolve against.
+        Longer messages usually carry their own subject and are searched as typed.
+        """
+        if not self.query_rewrite or len(history) < self.rewrite_min_history:
+            return False
+        words = normalize(query).split()
+        if any(words[:len(opener.split())] == opener.split() for opener in ELLIPSIS_OPENERS):
+            return True
+        if len(words) > self.rewrite_max_words:
+            return False
+        text = " ".join(words)
+        return bool(REFERENTIAL_WORDS.intersection(words)) or any(
+            f" {phrase} " in f" {text} " for phrase in REFERENTIAL_PHRASES
+        )
+    
+    async def _arewrite_query(self, query: str, history: List[Dict]) -> str:
+        transcript = "\n".join(
+            f"{message['role']}: {message['content'][:500]}" for message in history[-self.rewrite_history_messages:]
+        )
+        response = await self.llm.ainvoke([
+            SystemMessage(content=REWRITE_SYSTEM_PROMPT),
+            HumanMessage(content=f"Conversation:\n{transcript}\n\nLatest customer message: {query}")
+        ])
+        return response.content.strip()
+    
+    def _start_warmup(self, timer: StageTimer) -> Optional[asyncio.Task]:
+        """Re-open the LLM connection during retrieval when it has likely idled out of the pool"""
+        if not self.llm_warmup or time.monotonic() - self._last_llm_call < self.llm_warmup_idle_seconds:
+            return None
+        self._last_llm_call = time.monotonic()
+        return timer.run("llm_warmup", self._awarm_llm())
+    
+    async def _awarm_llm(self):
+        try:
+            await self.llm.client.aio.models.get(model=self.llm_model)
+        except Exception as e:
+            print(f"LLM warm-up failed: {e}")
+    
+    async def _asearch(self, query: str, organization_id: str, top_k: int, score_threshold: float) -> Dict:
+        print(f"\n--- Retrieving relevant documents for query: {query} ---")
+        started = time.perf_counter()
+        # Read before searching, so FAQ snippets never outlive a concurrent upload or delete
+        generation = self.pdf_processor.document_generation(organization_id)
+        retrieval_result = await self.pdf_processor.aretrieve_documents(
+            query, organization_id, top_k, score_threshold
+        )
+        self.intent_gate.record_retrieval(time.perf_counter() - started)
+        return dict(retrieval_result, document_generation=generation)
+    
+    def _prepare_messages(self, session: ChatSession, query: str, retrieval_result: Dict) -> Dict:
+        """
+        Build the LLM prompt from retrieved documents and the session history
+        
+        Also looks up a provider cache holding the system prefix; when one is
+        ready the LLM call sends only the messages after it.
+        """
+        messages, report = self.build_prompt(
+            query, retrieval_result.get("documents", []), session.get_history(), session.summary,
+            session.organization_id
+        )
+        cache_name = None
+        if self.context_cache is not None:
+            cache_name = self.context_cache.lookup(session.organization_id, report["variant"], messages[0].content)
+        report["cached_prefix"] = cache_name is not None
+        return {
+            "messages": messages,
+            "tokens": report,
+            "cache_name": cache_name,
+            "organization_id": session.organization_id,
+        }
+    
+    def _cache_failed(self, prompt: Dict, error: Exception):
+        """Drop a cache the provider rejected so the call can be retried with the prefix inline"""
+        print(f"Cached prompt prefix {prompt['cache_name']} rejected, resending inline: {error}")
+        self.context_cache.invalidate(prompt["organization_id"], prompt["tokens"]["variant"], prompt["cache_name"])
+        prompt["cache_name"] = None
+        prompt["tokens"]["cached_prefix"] = False
+    
+    @staticmethod
+    def _record_usage(prompt: Dict, response):
+        """Add the provider's input token counts (including cache reads) to the prompt report"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            prompt["tokens"]["provider_input"] = usage.get("input_tokens", 0)
+            prompt["tokens"]["provider_cache_read"] = usage.get("input_token_details", {}).get("cache_read", 0)
+    
+    async def _ainvoke(self, prompt: Dict):
+        self._last_llm_call = time.monotonic()
+        if prompt["cache_name"]:
+            try:
+                response = await self.llm.ainvoke(prompt["messages"][1:], cached_content=prompt["cache_name"])
+                self._record_usage(prompt, response)
+                return response
+            except Exception as e:
+                self._cache_failed(prompt, e)
+        response = await self.llm.ainvoke(prompt["messages"])
+        self._record_usage(prompt, response)
+        return response
+    
+    async def _astream(self, prompt: Dict):
+        """Stream from the LLM; a rejected cache is only retried inline if nothing was streamed yet"""
+        self._last_llm_call = time.monotonic()
+        combined = None
+        if prompt["cache_name"]:
+            try:
+                async for chunk in self.llm.astream(prompt["messages"][1:], cached_content=prompt["cache_name"]):
+                    combined = chunk if combined is None else combined + chunk
+                    yield chunk
+                self._record_usage(prompt, combined)
+                return
+            except Exception as e:
+                if combined is not None:
+                    raise
+                self._cache_failed(prompt, e)
+        async for chunk in self.llm.astream(prompt["messages"]):
+            combined = chunk if combined is None else combined + chunk
+            yield chunk
+        self._record_usage(prompt, combined)
+    
+    def _maybe_summarize(self, session: ChatSession):
+        """
+        Fold older turns into the running summary once history grows large
+        
+        Runs on the summary thread pool so it never delays a response; the next
+        turns simply use whatever summary is current.
+        """
+        with session.lock:
+            history = session.get_history()
+            older = history[:-self.summary_keep_messages] if self.summary_keep_messages else history
+            if not older or session.summary_in_progress:
+                return
+            history_tokens = sum(count_tokens(message["content"]) for message in history)
+            if len(history) < session.max_history - 2 and history_tokens < self.summary_trigger_tokens:
+                return
+            session.summary_in_progress = True
+            current_summary = session.summary
+        self.summary_executor.submit(self._summarize, session, older, current_summary)
+    
+    def _summarize(self, session: ChatSession, older: List[Dict], current_summary: str):
+        # Works on a snapshot; apply_summary swaps the result in by message id under the session lock
+        try:
+            transcript = "\n".join(f"{message['role']}: {message['content']}" for message in older)
+            response = self.llm.invoke([
+                SystemMessage(content=SUMMARY_SYSTEM_PROMPT),
+                HumanMessage(content=f"Current summary:\n{current_summary or '(none)'}\n\nNew messages:\n{transcript}")
+            ])
+            if session.apply_summary(response.content.strip(), older[-1]["seq"]):
+                self.sessions.touch(session.session_id)
+        except Exception as e:
+            print(f"History summarization failed for session {session.session_id}: {e}")
+        finally:
+            session.summary_in_progress = False
+    
+    @staticmethod
+    def strip_citations(ai_response: str) -> str:
+        """Drop source/citation lines the model adds despite the system prompt"""
+        citation_filter = CitationLineFilter()
+        return citation_filter.feed(ai_response) + citation_filter.finish()
+    
+    @staticmethod
+    def _sources(retrieval_result: Dict) -> List[Dict]:
+        return [
+            {
+                "pdf_filename": doc["pdf_filename"],
+                "chunk_index": doc["chunk_index"],
+                "score": doc["score"]
+            }
+            for doc in retrieval_result.get("documents", [])
+        ]
+    
+    def _finish_turn(self, session: ChatSession, query: str, ai_response: str, retrieval_result: Dict,
+                     prompt_tokens: Dict, intent: Dict) -> Dict:
+        """Record the cleaned exchange in history and build the response"""
+        # Add to conversation history
+        session.add_message("user", query)
+        session.add_message("assistant", ai_response)
+        self.sessions.touch(session.session_id)
+        self._maybe_summarize(session)
+        if self.context_cache is not None:
+            self.context_cache.note_retrieved(
+                session.organization_id, retrieval_result.get("documents", []),
+                retrieval_result.get("document_generation", 0)
+            )
+        
+        print(f"\n--- Response generated successfully ---")
+        
+        return {
+            "status": "success",
+            "session_id": session.session_id,
+            "organization_id": session.organization_id,
+            "query": query,
+            "response": ai_response,
+            "sources": self._sources(retrieval_result),
+            "conversation_length": len(session.get_history()),
+            "retrieved_documents": retrieval_result.get("total_results", 0),
+            "prompt_tokens": prompt_tokens,
+            "intent": intent["intent"],
+            "retrieval_skipped": not intent["retrieve"],
+            "retrieval_query": retrieval_result.get("query", query)
+        }
+    
     def get_conversation_history(self, session_id: str) -> Dict:
         """Get conversation history for a session"""
-        if session_id not in self.sessions:
+        session = self.sessions.get(session_id)
+        if session is None:
             return {
                 "status": "error",
                 "message": "Session not found"
             }
         
-        session = self.sessions[session_id]
         return {
             "status": "success",
             "session_id": session_id,
@@ -209,8 +732,10 @@ GUIDELINES:
     
     def clear_session(self, session_id: str) -> Dict:
         """Clear a chat session"""
-        if session_id in self.sessions:
-            self.sessions[session_id].clear_history()
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.clear_history()
+            self.sessions.touch(session_id)
             return {
                 "status": "success",
                 "message": f"Session {session_id} cleared"
@@ -222,8 +747,7 @@ GUIDELINES:
     
     def delete_session(self, session_id: str) -> Dict:
         """Delete a chat session completely"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        if self.sessions.pop(session_id, None) is not None:
             return {
                 "status": "success",
                 "message": f"Session {session_id} deleted"
@@ -232,3 +756,24 @@ GUIDELINES:
             "status": "error",
             "message": "Session not found"
         }
+    
+    def get_session_stats(self) -> Dict:
+        """Live session count, memory estimate and eviction counters"""
+        return {
+            "status": "success",
+            "sessions": self.sessions.get_stats()
+        }
+    
+    def get_context_cache_stats(self) -> Dict:
+        """Prompt prefix cache hits, misses and provider calls"""
+        return {
+            "status": "success",
+            "context_cache": self.context_cache.get_stats() if self.context_cache is not None else {"provider": "off"}
+        }
+    
+    def get_intent_stats(self) -> Dict:
+        """Intent gate decisions and the retrievals they skipped"""
+        return {
+            "status": "success",
+            "intent_gate": self.intent_gate.get_stats()
+        }
@@ -0,0 +1,215 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+from controllers.metrics import LatencyHistogram
+
+
+# Per-organization limits once ADMISSION_CONTROL is enabled: (requests per second, burst).
+# Set ADMISSION_<ENDPOINT>_RATE/_BURST from measured capacity before turning it on.
+DEFAULT_LIMITS = {
+    "chat": (2.0, 10),
+    "query": (10.0, 30),
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted; routers turn it into 429 with Retry-After"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Too many requests ({reason}), retry after {math.ceil(retry_after)}s")
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionTicket:
+    """A held admission slot; release() is idempotent so streaming responses can call it from several places"""
+
+    __slots__ = ("controller", "acquired", "released")
+
+    def __init__(self, controller: "AdmissionController", acquired: float):
+        self.controller = controller
+        self.acquired = acquired
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.acquired)
+
+
+class TokenBucket:
+    """Lazily refilled token bucket; one check is a few float operations"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Take one token; returns 0 on success, else the seconds until one is available"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class AdmissionController:
+    """
+    In-process admission control for chat and retrieval requests
+
+    Each request first takes a token from its (endpoint, organization) bucket,
+    so one tenant's burst cannot consume everyone's Gemini quota. Admitted
+    requests then need one of ADMISSION_MAX_CONCURRENT global slots. When all
+    are busy they wait in a FIFO queue of at most ADMISSION_MAX_QUEUE entries
+    for up to ADMISSION_QUEUE_TIMEOUT_MS. A request whose estimated wait
+    (position x average hold time / slots) already exceeds that deadline is
+    shed at once instead of timing out in the queue.
+
+    Per-endpoint limits come from ADMISSION_<ENDPOINT>_RATE and
+    ADMISSION_<ENDPOINT>_BURST (e.g. ADMISSION_CHAT_RATE=2). Admission is off
+    unless ADMISSION_CONTROL=true. Everything runs on the event loop, so no
+    locks are needed.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("ADMISSION_CONTROL", "false").lower() == "true"
+        self.max_concurrent = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+        self.max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+        self.queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000")) / 1000
+        self.max_buckets = int(os.getenv("ADMISSION_MAX_BUCKETS", "10000"))
+        self.limits: Dict[str, Tuple[float, int]] = {
+            endpoint: (
+                float(os.getenv(f"ADMISSION_{endpoint.upper()}_RATE", str(rate))),
+                int(os.getenv(f"ADMISSION_{endpoint.upper()}_BURST", str(burst))),
+            )
+            for endpoint, (rate, burst) in DEFAULT_LIMITS.items()
+        }
+
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._in_flight = 0
+        self._waiters = deque()
+        # Moving average of how long a request holds a slot, for the shedding estimate
+        self._hold_seconds = 1.0
+        self._queue_wait = LatencyHistogram()
+        self._counters = Counter()
+        self._rejections_by_org = Counter()
+
+    async def acquire(self, endpoint: str, organization_id: str) -> AdmissionTicket:
+        """Admit a request or raise AdmissionRejected; the caller must release the returned ticket"""
+        if not self.enabled:
+            return AdmissionTicket(self, time.monotonic())
+        now = time.monotonic()
+        self._check_rate(endpoint, organization_id, now)
+
+        if self._in_flight < self.max_concurrent and not self._waiters:
+            self._in_flight += 1
+            self._counters[f"{endpoint}_admitted"] += 1
+            return AdmissionTicket(self, now)
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject(endpoint, organization_id, "queue_full", self._estimated_wait(len(self._waiters)))
+        estimated = self._estimated_wait(len(self._waiters) + 1)
+        if estimated > self.queue_timeout:
+            self._reject(endpoint, organization_id, "deadline", estimated)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # release() may have handed us its slot just as the timeout fired: we were admitted
+            if not (waiter.done() and not waiter.cancelled()):
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._reject(endpoint, organization_id, "queue_timeout", self._estimated_wait(len(self._waiters)))
+        except asyncio.CancelledError:
+            # The client went away; pass a slot we were already handed to the next waiter
+            if waiter.done() and not waiter.cancelled():
+                self.release(time.monotonic())
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+        acquired = time.monotonic()
+        self._queue_wait.observe(acquired - now)
+        self._counters[f"{endpoint}_admitted"] += 1
+        self._counters["queued"] += 1
+        return AdmissionTicket(self, acquired)
+
+    def release(self, acquired: float):
+        """Free a slot acquired at `acquired`, handing it straight to the oldest live waiter"""
+        if not self.enabled:
+            return
+        self._hold_seconds += 0.1 * ((time.monotonic() - acquired) - self._hold_seconds)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, organization_id: str):
+        """Hold an admission slot for the duration of the block"""
+        ticket = await self.acquire(endpoint, organization_id)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _check_rate(self, endpoint: str, organization_id: str, now: float):
+        key = (endpoint, organization_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune_buckets(now)
+            rate, burst = self.limits[endpoint]
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        wait = bucket.take(now)
+        if wait:
+            self._reject(endpoint, organization_id, "rate_limited", wait)
+
+    def _prune_buckets(self, now: float):
+        # A full bucket carries no state a new one would not have
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[key]
+
+    def _estimated_wait(self, position: int) -> float:
+        return position * self._hold_seconds / max(1, self.max_concurrent)
+
+    def _reject(self, endpoint: str, organization_id: str, reason: str, retry_after: float):
+        self._counters[f"{endpoint}_{reason}"] += 1
+        self._rejections_by_org[organization_id] += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def get_stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout_ms": round(self.queue_timeout * 1000),
+            "average_hold_ms": round(self._hold_seconds * 1000, 1),
+            "limits": {endpoint: {"rate": rate, "burst": burst} for endpoint, (rate, burst) in self.limits.items()},
+            "buckets": len(self._buckets),
+            "counters": dict(self._counters),
+            "top_rejected_organizations": dict(self._rejections_by_org.most_common(10)),
+            "queue_wait": self._queue_wait.snapshot(),
+        }
+
+
+# Module-level singleton — shared by the chat and retrieval routers
+admission_controller = AdmissionController()
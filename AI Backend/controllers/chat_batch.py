@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from controllers.admission import AdmissionController, AdmissionRejected
+from controllers.session_store import MemorySessionStore
+
+# Rejected batch turns back off for the advised Retry-After this many times before failing
+BATCH_ADMISSION_RETRIES = 5
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def parse_records(lines: Iterable[str]) -> List[Dict]:
+    """
+    Parse JSONL chat records: {"organization_id", "session_id", "query"} plus
+    optional "id", "top_k" and "score_threshold"
+
+    Malformed lines are kept as records with an "error" so they show up in the
+    results at their position instead of aborting the batch.
+    """
+    records = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            missing = [field for field in ("organization_id", "session_id", "query") if not record.get(field)]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+        except (ValueError, AttributeError) as e:
+            record = {"error": f"Invalid record on line {number}: {str(e)}"}
+        record["index"] = len(records)
+        records.append(record)
+    return records
+
+
+class ChatBatchRunner:
+    """
+    Replays chat records through RAGChatController.achat with bounded concurrency
+
+    Records sharing a session_id run in file order so multi-turn conversations
+    replay faithfully; different sessions run concurrently, at most
+    `concurrency` turns at a time. All turns go through the same controller,
+    so the embedding, retrieval and context caches are shared exactly as in
+    production, but each batch keeps its sessions in its own
+    MemorySessionStore: replays never read, write or evict live sessions,
+    even when the server shares sessions through SQLite.
+
+    With an admission controller, every turn is admitted like a live chat
+    message for its organization; rejected turns wait out Retry-After, so a
+    replay yields to live traffic instead of bypassing the limits.
+    """
+
+    def __init__(self, chat_controller, admission: Optional[AdmissionController] = None):
+        self.chat_controller = chat_controller
+        self.admission = admission
+
+    async def run(self, records: List[Dict], concurrency: int = 8) -> AsyncIterator[Dict]:
+        """Yield one result per record as it completes, then a {"summary": ...} line"""
+        batch_id = uuid.uuid4().hex[:8]
+        controller = self.chat_controller.with_session_store(MemorySessionStore())
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        results: asyncio.Queue = asyncio.Queue()
+
+        sessions: Dict[str, List[Dict]] = OrderedDict()
+        for record in records:
+            if "error" in record:
+                results.put_nowait(self._result(record, status="error", error=record["error"]))
+            else:
+                sessions.setdefault(str(record["session_id"]), []).append(record)
+
+        async def replay(session_id: str, turns: List[Dict]):
+            for record in turns:
+                async with semaphore:
+                    results.put_nowait(await self._run_turn(controller, session_id, record))
+
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(replay(session_id, turns)) for session_id, turns in sessions.items()]
+        latencies = []
+        errors = 0
+        try:
+            for _ in range(len(records)):
+                result = await results.get()
+                if result["status"] == "success":
+                    latencies.append(result["latency_ms"])
+                else:
+                    errors += 1
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started
+        yield {"summary": {
+            "batch_id": batch_id,
+            "records": len(records),
+            "sessions": len(sessions),
+            "ok": len(latencies),
+            "errors": errors,
+            "concurrency": concurrency,
+            "elapsed_seconds": round(elapsed, 3),
+            "turns_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+        }}
+
+    async def _run_turn(self, controller, session_id: str, record: Dict) -> Dict:
+        started = time.perf_counter()
+        try:
+            ticket = await self._admit(record["organization_id"])
+            try:
+                response = await controller.achat(
+                    session_id,
+                    record["organization_id"],
+                    record["query"],
+                    record.get("top_k", 3),
+                    record.get("score_threshold", 0.4)
+                )
+            finally:
+                if ticket is not None:
+                    ticket.release()
+        except Exception as e:
+            return self._result(record, status="error", error=str(e),
+                                latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        return self._result(
+            record,
+            status="success",
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            response=response["response"],
+            sources=response["sources"],
+            intent=response.get("intent"),
+            retrieval_query=response.get("retrieval_query"),
+            prompt_tokens=response.get("prompt_tokens"),
+            timings=response.get("timings"),
+        )
+
+    async def _admit(self, organization_id: str):
+        if self.admission is None:
+            return None
+        for attempt in range(BATCH_ADMISSION_RETRIES + 1):
+            try:
+                return await self.admission.acquire("chat", organization_id)
+            except AdmissionRejected as e:
+                if attempt == BATCH_ADMISSION_RETRIES:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    @staticmethod
+    def _result(record: Dict, **fields) -> Dict:
+        result = {
+            "index": record["index"],
+            "id": record.get("id"),
+            "organization_id": record.get("organization_id"),
+            "session_id": record.get("session_id"),
+            "query": record.get("query"),
+        }
+        result.update(fields)
+        return result
@@ -0,0 +1,299 @@
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from controllers.prompt_assembler import count_tokens
+
+# Smallest prefix Gemini accepts for an explicit cache, by model family (first match wins)
+GEMINI_MIN_CACHE_TOKENS = (
+    ("gemini-2.5-pro", 4096),
+    ("gemini-2.5-flash", 1024),
+)
+GEMINI_DEFAULT_MIN_CACHE_TOKENS = 4096
+
+
+class GeminiContextCacheBackend:
+    """Explicit Gemini context caches created through the google-genai client"""
+
+    provider = "gemini"
+
+    def __init__(self, genai_client, model: str):
+        self.genai_client = genai_client
+        self.model = model if model.startswith("models/") else f"models/{model}"
+        family = self.model[len("models/"):]
+        self.min_tokens = next(
+            (tokens for prefix, tokens in GEMINI_MIN_CACHE_TOKENS if family.startswith(prefix)),
+            GEMINI_DEFAULT_MIN_CACHE_TOKENS
+        )
+
+    def count_tokens(self, text: str) -> int:
+        return self.genai_client.models.count_tokens(model=self.model, contents=text).total_tokens
+
+    def create(self, display_name: str, system_instruction: str, ttl_seconds: int) -> str:
+        from google.genai.types import CreateCachedContentConfig
+        cache = self.genai_client.caches.create(
+            model=self.model,
+            config=CreateCachedContentConfig(
+                display_name=display_name,
+                system_instruction=system_instruction,
+                ttl=f"{ttl_seconds}s"
+            )
+        )
+        return cache.name
+
+    def refresh(self, name: str, ttl_seconds: int):
+        from google.genai.types import UpdateCachedContentConfig
+        self.genai_client.caches.update(name=name, config=UpdateCachedContentConfig(ttl=f"{ttl_seconds}s"))
+
+    def delete(self, name: str):
+        self.genai_client.caches.delete(name=name)
+
+
+class LocalContextCacheBackend:
+    """
+    In-memory stand-in for a provider cache, for tests and local development
+
+    Pair it with a fake LLM: cache names it returns mean nothing to Gemini.
+    """
+
+    provider = "local"
+    min_tokens = 0
+
+    def __init__(self):
+        self.entries: Dict[str, Dict] = {}
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(text)
+
+    def create(self, display_name: str, system_instruction: str, ttl_seconds: int) -> str:
+        name = f"cachedContents/local-{hashlib.sha256(system_instruction.encode('utf-8')).hexdigest()[:16]}"
+        self.entries[name] = {
+            "display_name": display_name,
+            "system_instruction": system_instruction,
+            "expires_at": time.time() + ttl_seconds,
+        }
+        return name
+
+    def refresh(self, name: str, ttl_seconds: int):
+        if name not in self.entries:
+            raise KeyError(f"Unknown cached content: {name}")
+        self.entries[name]["expires_at"] = time.time() + ttl_seconds
+
+    def delete(self, name: str):
+        self.entries.pop(name, None)
+
+
+class ContextCacheManager:
+    """
+    Keeps one provider cache per (organization, prompt variant) for the stable prompt prefix
+
+    Lookups never block a chat turn: a missing, expired or changed prefix is
+    (re)created on a background thread and the turn falls back to sending the
+    prefix inline. Entries close to expiry get their TTL extended in the
+    background. A failed create backs off for CONTEXT_CACHE_RETRY_SECONDS.
+    Prefixes below the provider's minimum (backend.min_tokens, or
+    CONTEXT_CACHE_MIN_TOKENS when set) are never cached because the provider
+    rejects them. The len/4 estimate only rules out prefixes under half the
+    minimum; the rest are counted by the provider before a create.
+
+    The manager also counts which chunks each organization retrieves most, so
+    their text can be folded into the cached prefix as FAQ snippets. Snippet
+    text is tied to the organization's document write generation and dropped
+    when an upload or delete moves it on.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.ttl_seconds = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+        self.refresh_margin = float(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", "300"))
+        self.retry_seconds = float(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", "300"))
+        self.min_tokens = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS") or backend.min_tokens)
+        self.faq_snippets = int(os.getenv("CONTEXT_CACHE_FAQ_SNIPPETS", "5"))
+
+        self._entries: Dict[Tuple[str, str], Dict] = {}
+        self._pending = set()
+        self._retry_at: Dict[Tuple[str, str], float] = {}
+        # key -> digest of a prefix the provider counted below min_tokens
+        self._too_small: Dict[Tuple[str, str], str] = {}
+        self._generations: Dict[str, int] = {}
+        self._popular: Dict[str, Counter] = {}
+        self._snippets: Dict[str, Dict[str, str]] = {}
+        self._faq: Dict[str, Tuple[float, float, List[Tuple[str, str]]]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-cache")
+        self._stats = {"hits": 0, "misses": 0, "too_small": 0, "creates": 0, "refreshes": 0,
+                       "failures": 0, "fallbacks": 0}
+
+    def lookup(self, organization_id: str, variant: str, prefix: str) -> Optional[str]:
+        """Return a cache name holding exactly `prefix`, or None to send the prefix inline"""
+        if count_tokens(prefix) * 2 < self.min_tokens:
+            with self._lock:
+                self._stats["too_small"] += 1
+            return None
+
+        key = (organization_id, variant)
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock:
+            if self._too_small.get(key) == digest:
+                self._stats["too_small"] += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is not None and entry["digest"] == digest and entry["expires_at"] > now:
+                self._stats["hits"] += 1
+                if entry["expires_at"] - now < self.refresh_margin and key not in self._pending:
+                    self._pending.add(key)
+                    self._executor.submit(self._refresh, key, entry["name"])
+                return entry["name"]
+
+            self._stats["misses"] += 1
+            if key not in self._pending and self._retry_at.get(key, 0) <= now:
+                self._pending.add(key)
+                self._executor.submit(self._create, key, digest, prefix, entry)
+            return None
+
+    def _create(self, key: Tuple[str, str], digest: str, prefix: str, previous: Optional[Dict]):
+        try:
+            prefix_tokens = self.backend.count_tokens(prefix) if self.min_tokens else count_tokens(prefix)
+            if prefix_tokens < self.min_tokens:
+                with self._lock:
+                    self._too_small[key] = digest
+                    self._stats["too_small"] += 1
+                return
+            name = self.backend.create(f"chat-{key[0]}-{key[1]}", prefix, self.ttl_seconds)
+            with self._lock:
+                self._too_small.pop(key, None)
+                self._entries[key] = {
+                    "name": name,
+                    "digest": digest,
+                    "expires_at": time.time() + self.ttl_seconds,
+                    "prefix_tokens": prefix_tokens,
+                }
+                self._retry_at.pop(key, None)
+                self._stats["creates"] += 1
+            if previous is not None and previous["name"] != name:
+                self._delete_quietly(previous["name"])
+        except Exception as e:
+            print(f"Context cache create failed for {key[0]}/{key[1]}: {e}")
+            with self._lock:
+                self._retry_at[key] = time.time() + self.retry_seconds
+                self._stats["failures"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _refresh(self, key: Tuple[str, str], name: str):
+        try:
+            self.backend.refresh(name, self.ttl_seconds)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry["name"] == name:
+                    entry["expires_at"] = time.time() + self.ttl_seconds
+                self._stats["refreshes"] += 1
+        except Exception as e:
+            print(f"Context cache refresh failed for {key[0]}/{key[1]}: {e}")
+            with self._lock:
+                self._entries.pop(key, None)
+                self._stats["failures"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _delete_quietly(self, name: str):
+        try:
+            self.backend.delete(name)
+        except Exception as e:
+            print(f"Context cache delete failed for {name}: {e}")
+
+    def invalidate(self, organization_id: str, variant: str, name: str):
+        """Forget a cache the provider rejected; the caller retries with the prefix inline"""
+        with self._lock:
+            entry = self._entries.get((organization_id, variant))
+            if entry is not None and entry["name"] == name:
+                del self._entries[(organization_id, variant)]
+            self._stats["fallbacks"] += 1
+
+    def _advance_generation_locked(self, organization_id: str, generation: int):
+        """Drop snippet text recorded before the organization's documents last changed"""
+        if generation > self._generations.get(organization_id, 0):
+            self._generations[organization_id] = generation
+            self._snippets.pop(organization_id, None)
+            self._faq.pop(organization_id, None)
+
+    def note_retrieved(self, organization_id: str, documents: List[Dict], generation: int = 0):
+        """
+        Count retrieved chunks so the most requested ones can join the cached prefix
+
+        `generation` is the document write generation read before retrieval;
+        text retrieved before a later upload or delete is counted but not kept.
+        """
+        if not self.faq_snippets:
+            return
+        with self._lock:
+            self._advance_generation_locked(organization_id, generation)
+            fresh = generation >= self._generations.get(organization_id, 0)
+            counts = self._popular.setdefault(organization_id, Counter())
+            snippets = self._snippets.setdefault(organization_id, {})
+            for doc in documents:
+                vector_id = doc.get("vector_id")
+                if vector_id:
+                    counts[vector_id] += 1
+                    if fresh:
+                        snippets[vector_id] = doc["content"]
+            # Keep the tallies bounded: drop the long tail of rarely retrieved chunks
+            if len(counts) > 1000:
+                for vector_id, _ in counts.most_common()[500:]:
+                    del counts[vector_id]
+                    snippets.pop(vector_id, None)
+
+    def faq_for(self, organization_id: str, generation: int = 0) -> List[Tuple[str, str]]:
+        """
+        The organization's most retrieved chunks as (vector_id, text)
+
+        The selection is a snapshot renewed once per cache TTL, so the prefix
+        (and therefore the provider cache) stays stable between renewals. A
+        newer document write generation discards it straight away; until the
+        popular chunks are retrieved again the smaller selection is renewed
+        every CONTEXT_CACHE_REFRESH_MARGIN_SECONDS.
+        """
+        if not self.faq_snippets:
+            return []
+        now = time.time()
+        with self._lock:
+            self._advance_generation_locked(organization_id, generation)
+            snapshot = self._faq.get(organization_id)
+            if snapshot is not None and now - snapshot[0] < snapshot[1]:
+                return snapshot[2]
+            counts = self._popular.get(organization_id) or Counter()
+            snippets = self._snippets.get(organization_id, {})
+            popular = [vector_id for vector_id, _ in counts.most_common(self.faq_snippets)]
+            faq = [(vector_id, snippets[vector_id]) for vector_id in popular if vector_id in snippets]
+            lifetime = self.ttl_seconds if len(faq) == len(popular) else self.refresh_margin
+            self._faq[organization_id] = (now, lifetime, faq)
+            return faq
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(
+                self._stats,
+                provider=self.backend.provider,
+                caches=len(self._entries),
+                pending=len(self._pending),
+                ttl_seconds=self.ttl_seconds,
+                min_tokens=self.min_tokens,
+            )
+
+
+def create_context_cache(genai_client, model: str) -> Optional[ContextCacheManager]:
+    """Build the manager selected by CONTEXT_CACHE_BACKEND (off, gemini or local)"""
+    backend = os.getenv("CONTEXT_CACHE_BACKEND", "off").lower()
+    if backend == "off":
+        return None
+    if backend == "gemini":
+        return ContextCacheManager(GeminiContextCacheBackend(genai_client, model))
+    if backend == "local":
+        return ContextCacheManager(LocalContextCacheBackend())
+    raise ValueError(f"Unknown CONTEXT_CACHE_BACKEND: {backend}")
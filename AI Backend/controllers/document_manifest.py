@@ -0,0 +1,94 @@
+import difflib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from controllers.storage_paths import data_path
+
+
+class DocumentManifestStore:
+    """
+    Persists the ordered list of chunk vector IDs for every indexed document
+
+    Vector IDs are derived from chunk content hashes, so comparing a document's
+    previous manifest with a freshly chunked revision tells ingestion exactly
+    which chunks need embedding and upserting and which vectors to delete.
+
+    Manifests are keyed by the vector store's location as well as namespace
+    and filename: after switching VECTOR_STORE_BACKEND (or index) the new
+    index holds none of those vectors, so every document starts from scratch.
+    """
+
+    def __init__(self, vector_store: str):
+        self.vector_store = vector_store
+        self.path = os.getenv("DOCUMENT_MANIFEST_PATH") or data_path("document_manifests.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS index_manifests ("
+            " vector_store TEXT NOT NULL,"
+            " namespace TEXT NOT NULL,"
+            " pdf_filename TEXT NOT NULL,"
+            " vector_ids TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (vector_store, namespace, pdf_filename))"
+        )
+        self._conn.commit()
+
+    def get(self, namespace: str, pdf_filename: str) -> Optional[List[str]]:
+        """Return the stored vector IDs for a document, or None if it was never indexed here"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector_ids FROM index_manifests"
+                " WHERE vector_store = ? AND namespace = ? AND pdf_filename = ?",
+                (self.vector_store, namespace, pdf_filename)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, namespace: str, pdf_filename: str, vector_ids: List[str]):
+        """Replace a document's manifest after a successful re-index"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO index_manifests"
+                " (vector_store, namespace, pdf_filename, vector_ids, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.vector_store, namespace, pdf_filename,
+                 json.dumps(vector_ids, separators=(",", ":")), time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, namespace: str, pdf_filename: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM index_manifests WHERE vector_store = ? AND namespace = ? AND pdf_filename = ?",
+                (self.vector_store, namespace, pdf_filename)
+            )
+            self._conn.commit()
+
+
+def diff_manifests(old_ids: List[str], new_ids: List[str]) -> Dict[str, int]:
+    """
+    Summarise a re-index as added/updated/deleted/unchanged chunk counts
+
+    Only vectors that are actually written or removed are counted: a chunk whose
+    ID survives (even at a new position) is unchanged. Within a replaced run,
+    new and vanished chunks are paired one-to-one as updates and any surplus is
+    counted as additions or deletions.
+    """
+    old_set, new_set = set(old_ids), set(new_ids)
+    counts = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    matcher = difflib.SequenceMatcher(a=old_ids, b=new_ids, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        written = sum(1 for vector_id in new_ids[j1:j2] if vector_id not in old_set)
+        removed = sum(1 for vector_id in old_ids[i1:i2] if vector_id not in new_set)
+        paired = min(written, removed) if tag == "replace" else 0
+        counts["updated"] += paired
+        counts["added"] += written - paired
+        counts["deleted"] += removed - paired
+    counts["unchanged"] = len(new_ids) - counts["added"] - counts["updated"]
+    return counts
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from google.genai.types import EmbedContentConfig
+from controllers.metrics import LatencyHistogram
+
+# httpx base classes for connection failures and timeouts
+TRANSIENT_ERROR_NAMES = {"TransportError", "TimeoutException"}
+
+
+class EmbeddingBatcher:
+    """
+    Splits texts into provider-sized batches and embeds them concurrently
+
+    Batches are bounded by both text count and an estimated token budget, run on a
+    thread pool whose size is the in-flight limit, retried with exponential
+    backoff, and reassembled in input order. Used by both document ingestion and
+    query retrieval: RETRIEVAL_QUERY embeddings get their own lane of
+    EMBED_QUERY_IN_FLIGHT threads, so a large upload saturating the
+    EMBED_MAX_IN_FLIGHT document lane never delays a chat turn.
+    """
+
+    QUERY_TASK_TYPES = ("RETRIEVAL_QUERY",)
+
+    def __init__(self, genai_client, embedding_model: str, embedding_dimension: int):
+        self.genai_client = genai_client
+        self.embedding_model = embedding_model
+        self.embedding_dimension = embedding_dimension
+
+        self.max_batch_size = int(os.getenv("EMBED_MAX_BATCH_SIZE", "100"))
+        self.max_batch_tokens = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "20000"))
+        self.max_in_flight = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+        self.query_in_flight = int(os.getenv("EMBED_QUERY_IN_FLIGHT", "4"))
+        self.max_retries = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+        self.backoff_seconds = float(os.getenv("EMBED_BACKOFF_SECONDS", "0.5"))
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix="embed"
+        )
+        self._query_executor = ThreadPoolExecutor(
+            max_workers=self.query_in_flight, thread_name_prefix="embed-query"
+        )
+
+        # Throughput counters
+        self._lock = threading.Lock()
+        self._texts_embedded = 0
+        self._batches_completed = 0
+        self._batches_failed = 0
+        self._retries = 0
+        self._call_seconds = 0.0
+        self.batch_latency = LatencyHistogram()
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Cheap token estimate (~4 characters per token)"""
+        return max(1, len(text) // 4)
+
+    def plan_batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Return contiguous (start, end) ranges respecting count and token limits"""
+        batches = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            text_tokens = self.estimate_tokens(text)
+            if i > start and (i - start >= self.max_batch_size or
+                              tokens + text_tokens > self.max_batch_tokens):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        """Embed texts synchronously, fanning batches out across the in-flight pool"""
+        if not texts:
+            return []
+        started = time.perf_counter()
+        executor = self._executor_for(task_type)
+        futures = [
+            executor.submit(self._embed_batch, texts[start:end], task_type)
+            for start, end in self.plan_batches(texts)
+        ]
+        embeddings = []
+        for future in futures:
+            embeddings.extend(future.result())
+        self._record_call(len(texts), time.perf_counter() - started)
+        return embeddings
+
+    async def aembed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        """Embed texts without blocking the event loop"""
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        executor = self._executor_for(task_type)
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, self._embed_batch, texts[start:end], task_type)
+            for start, end in self.plan_batches(texts)
+        ])
+        self._record_call(len(texts), time.perf_counter() - started)
+        return [embedding for batch in results for embedding in batch]
+
+    def _executor_for(self, task_type: str) -> ThreadPoolExecutor:
+        return self._query_executor if task_type in self.QUERY_TASK_TYPES else self._executor
+
+    def _embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                result = self.genai_client.models.embed_content(
+                    model=self.embedding_model,
+                    contents=texts,
+                    config=EmbedContentConfig(
+                        task_type=task_type,
+                        output_dimensionality=self.embedding_dimension
+                    )
+                )
+                self.batch_latency.observe(time.perf_counter() - started)
+                with self._lock:
+                    self._batches_completed += 1
+                return [list(e.values) for e in result.embeddings]
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    with self._lock:
+                        self._batches_failed += 1
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        # Rate limits, server errors and dropped or timed-out connections are retried; nothing else is
+        code = getattr(error, "code", None) or getattr(error, "status_code", None)
+        if isinstance(code, int):
+            return code == 429 or 500 <= code < 600
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return True
+        # The SDK's HTTP client (httpx) raises its own transport errors
+        return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+    def _record_call(self, text_count: int, seconds: float):
+        with self._lock:
+            self._texts_embedded += text_count
+            self._call_seconds += seconds
+
+    def get_stats(self) -> Dict:
+        """Return throughput counters and the batch latency histogram"""
+        with self._lock:
+            stats = {
+                "texts_embedded": self._texts_embedded,
+                "batches_completed": self._batches_completed,
+                "batches_failed": self._batches_failed,
+                "retries": self._retries,
+                "chunks_per_second": round(self._texts_embedded / self._call_seconds, 2)
+                if self._call_seconds else 0.0,
+                "max_in_flight": self.max_in_flight,
+                "query_in_flight": self.query_in_flight,
+                "max_batch_size": self.max_batch_size,
+                "max_batch_tokens": self.max_batch_tokens,
+            }
+        stats["batch_latency"] = self.batch_latency.snapshot()
+        return stats
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+from controllers.storage_paths import data_path
+
+_SQL_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding cache backed by SQLite
+
+    Entries are keyed by (embedding model, output dimensionality, task type,
+    sha256 of the text) so unchanged chunks of a re-uploaded document never hit
+    the embedding API again. Vectors are stored as float32 blobs and evicted in
+    least-recently-used order once the entry or byte limit is exceeded.
+
+    Lookups only note hit times in memory; they are written back in one
+    statement every EMBEDDING_CACHE_ACCESS_FLUSH_S seconds (checked on the
+    next cache call) and always before an eviction picks its victims, so
+    reads never commit. A crash forgets at most that much recency.
+    """
+
+    def __init__(self, embedding_model: str, embedding_dimension: int):
+        self.embedding_model = embedding_model
+        self.embedding_dimension = embedding_dimension
+        self.enabled = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+        self.max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+        self.max_bytes = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.path = os.getenv("EMBEDDING_CACHE_PATH") or data_path("embedding_cache.sqlite3")
+        self.access_flush_interval = float(os.getenv("EMBEDDING_CACHE_ACCESS_FLUSH_S", "30"))
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._evictions = 0
+        self._entries = 0
+        self._bytes = 0
+        self._conn = None
+        # {key: last hit time} not yet written to last_access
+        self._pending_access: Dict[str, float] = {}
+        self._access_flushed = time.monotonic()
+
+        if self.enabled:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)"
+            )
+            self._conn.commit()
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+            self._entries, self._bytes = count, total
+
+    def make_key(self, text: str, task_type: str) -> str:
+        """Build the cache key for a text under the configured model and dimension"""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.embedding_model}|{self.embedding_dimension}|{task_type}|{digest}"
+
+    def get_many(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        """Return cached vectors in input order, with None for misses"""
+        if not self.enabled:
+            return [None] * len(texts)
+
+        keys = [self.make_key(text, task_type) for text in texts]
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            for key in found:
+                self._pending_access[key] = now
+            if time.monotonic() - self._access_flushed >= self.access_flush_interval:
+                self._flush_access_locked()
+                self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for r in results if r is not None)
+            self._hits += hits
+            self._misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[List[float]], task_type: str):
+        """Store vectors for texts, evicting least recently used entries if over budget"""
+        if not self.enabled or not texts:
+            return
+
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            blob = array("f", vector).tobytes()
+            rows[self.make_key(text, task_type)] = (blob, len(blob))
+
+        with self._lock:
+            keys = list(rows)
+            existing = 0
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                existing += self._conn.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                [(key, blob, size, now) for key, (blob, size) in rows.items()]
+            )
+            self._entries += len(rows) - existing
+            if existing:
+                self._bytes = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+                ).fetchone()[0]
+            else:
+                self._bytes += sum(size for _, size in rows.values())
+            self._writes += len(rows)
+            if time.monotonic() - self._access_flushed >= self.access_flush_interval:
+                self._flush_access_locked()
+            self._evict_locked()
+            self._conn.commit()
+
+    def _flush_access_locked(self):
+        # MAX keeps a newer time written by put_many for a re-stored key
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(at, key) for key, at in self._pending_access.items()]
+            )
+            self._pending_access.clear()
+        self._access_flushed = time.monotonic()
+
+    def _evict_locked(self):
+        if self._entries > self.max_entries or self._bytes > self.max_bytes:
+            self._flush_access_locked()
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            # Evict in small batches (at least 1% of capacity) to amortise the delete
+            overflow = max(self._entries - self.max_entries, self.max_entries // 100, 1)
+            victims = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_access LIMIT ?", (overflow,)
+            ).fetchall()
+            if not victims:
+                break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(k,) for k, _ in victims])
+            self._entries -= len(victims)
+            self._bytes -= sum(size for _, size in victims)
+            self._evictions += len(victims)
+
+    def clear(self):
+        """Remove every cached embedding"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._pending_access.clear()
+            self._entries = 0
+            self._bytes = 0
+
+    def get_stats(self) -> Dict:
+        """Return hit/miss counters and current cache size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "writes": self._writes,
+                "evictions": self._evictions,
+                "entries": self._entries,
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
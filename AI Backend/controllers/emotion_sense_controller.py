@@ -4,8 +4,13 @@ import json
 import shutil
 import tempfile
 import subprocess
+from collections import deque
+from concurrent.futures import Future
 from pathlib import Path
 
+from controllers.emotion_sense_workers import EmotionSenseWorkerPool
+from controllers.inference_batcher import DynamicBatcher
+
 # Resolve path to the emotion detection deployment folder so we can import the model architecture
 _CONTROLLERS_DIR = os.path.dirname(__file__)
 _AI_BACKEND_DIR  = os.path.dirname(_CONTROLLERS_DIR)
@@ -71,6 +76,10 @@ class EmotionSenseController:
     def __init__(self):
         self._model_dict = None
         self._ffmpeg: str | None = None
+        self._mel_transform = None
+        self._batcher: DynamicBatcher | None = None
+        # Bounded pool the routers run analyses on, so the event loop never blocks on them
+        self.workers = EmotionSenseWorkerPool()
 
     def load(self):
         """Load model, tokenizer and transcriber. Called once at startup."""
@@ -102,8 +111,17 @@ class EmotionSenseController:
             "tokenizer":   tokenizer,
             "transcriber": transcriber,
             "device":      device,
+            "batch_size":  self._default_batch_size(device),
         }
 
+        # Every request's utterances go through one inference thread that batches across requests
+        self._batcher = DynamicBatcher(
+            lambda items: self._run_inference_batch(items, len(items)),
+            max_batch_size=int(os.getenv("EMOTION_SENSE_MAX_BATCH", str(self._model_dict["batch_size"]))),
+            max_wait_ms=float(os.getenv("EMOTION_SENSE_BATCH_WAIT_MS", "5")),
+            name="emotion-sense-inference",
+        )
+
     @property
     def is_loaded(self) -> bool:
         return self._model_dict is not None
@@ -135,88 +153,97 @@ class EmotionSenseController:
             )
         return __import__("numpy").frombuffer(result.stdout, dtype=__import__("numpy").float32)
 
-    def _process_video_frames(self, video_path: str):
+    def _iter_segment_frames(self, video_path: str, segments: list):
+        """
+        Decode the video once and yield (segment, frames) in segment order.
+
+        Each segment gets the first 30 frames whose timestamp falls within
+        [start, end], resized to 224x224. Frames no segment needs are skipped
+        without conversion, and a segment's frames are released as soon as it
+        is yielded, so memory stays bounded by the segments currently open.
+        """
         import cv2
-        import numpy as np
-        import torch
+        ordered = sorted(segments, key=lambda seg: seg["start"])
+        last_end = max((seg["end"] for seg in ordered), default=0.0)
+        collected = [[] for _ in ordered]
+        next_out = 0
         cap = cv2.VideoCapture(video_path)
-        frames = []
         try:
-            while len(frames) < 30 and cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            index = 0
+            while next_out < len(ordered) and cap.isOpened():
+                if not cap.grab():
                     break
+                t = index / fps if fps and fps > 0 else cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                index += 1
+
+                # Segments whose window has passed (or that are full) are complete
+                while next_out < len(ordered) and (
+                    t > ordered[next_out]["end"] or len(collected[next_out]) >= 30
+                ):
+                    yield ordered[next_out], collected[next_out]
+                    collected[next_out] = None
+                    next_out += 1
+
+                wanted = [
+                    i for i in range(next_out, len(ordered))
+                    if ordered[i]["start"] <= t <= ordered[i]["end"] and len(collected[i]) < 30
+                ]
+                if not wanted:
+                    if t > last_end:
+                        break
+                    continue
+                ret, frame = cap.retrieve()
+                if not ret:
+                    continue
                 frame = cv2.resize(frame, (224, 224))
-                frame = frame / 255.0
-                frames.append(frame)
+                for i in wanted:
+                    collected[i].append(frame)
         finally:
             cap.release()
 
+        for i in range(next_out, len(ordered)):
+            yield ordered[i], collected[i]
+
+    def _frames_to_tensor(self, frames: list):
+        import numpy as np
+        import torch
         if len(frames) == 0:
-            raise ValueError(f"No frames extracted from: {video_path}")
+            raise ValueError("No frames extracted for segment")
 
+        frames = [frame / 255.0 for frame in frames[:30]]
         if len(frames) < 30:
             frames += [np.zeros_like(frames[0])] * (30 - len(frames))
-        else:
-            frames = frames[:30]
 
         return torch.FloatTensor(np.array(frames)).permute(0, 3, 1, 2)
 
-    def _extract_audio_features(self, video_path: str):
+    def _audio_features_from_pcm(self, audio_array, start: float, end: float):
+        """Mel features for [start, end] sliced from the 16 kHz mono PCM decoded for Whisper."""
+        import numpy as np
         import torch
         import torchaudio
-        audio_path = video_path + "_audio.wav"
-        try:
-            result = subprocess.run(
-                [self._ffmpeg, "-y", "-i", video_path, "-vn",
-                 "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1", audio_path],
-                capture_output=True, text=True,
-            )
-            if result.returncode != 0:
-                raise ValueError(
-                    f"Audio extraction failed [{result.returncode}]: {result.stderr[-400:]}"
-                )
-
-            waveform, sample_rate = torchaudio.load(audio_path)
-            if sample_rate != 16000:
-                waveform = torchaudio.transforms.Resample(sample_rate, 16000)(waveform)
-
-            mel_spec = torchaudio.transforms.MelSpectrogram(
+        samples = audio_array[max(0, int(start * 16000)):max(0, int(end * 16000))]
+        if len(samples) == 0:
+            return self._zero_audio()
+        if len(samples) < 1024:
+            samples = np.pad(samples, (0, 1024 - len(samples)))
+
+        if self._mel_transform is None:
+            self._mel_transform = torchaudio.transforms.MelSpectrogram(
                 sample_rate=16000, n_mels=64, n_fft=1024, hop_length=512
-            )(waveform)
-
-            std = mel_spec.std()
-            mel_spec = (mel_spec - mel_spec.mean()) / (std + 1e-8)
+            )
+        waveform = torch.from_numpy(np.ascontiguousarray(samples, dtype=np.float32)).unsqueeze(0)
+        mel_spec = self._mel_transform(waveform)
 
-            if mel_spec.size(2) < 300:
-                mel_spec = torch.nn.functional.pad(mel_spec, (0, 300 - mel_spec.size(2)))
-            else:
-                mel_spec = mel_spec[:, :, :300]
+        std = mel_spec.std()
+        mel_spec = (mel_spec - mel_spec.mean()) / (std + 1e-8)
 
-            return mel_spec
-        finally:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
+        if mel_spec.size(2) < 300:
+            mel_spec = torch.nn.functional.pad(mel_spec, (0, 300 - mel_spec.size(2)))
+        else:
+            mel_spec = mel_spec[:, :, :300]
 
-    def _extract_segment(self, video_path: str, start: float, end: float, tmp_dir: str) -> str:
-        seg_name = f"seg_{start:.2f}_{end:.2f}.mp4".replace(":", "-")
-        seg_path = os.path.join(tmp_dir, seg_name)
-        result = subprocess.run(
-            [self._ffmpeg, "-y", "-ss", str(start), "-to", str(end),
-             "-i", video_path, "-c", "copy", seg_path],
-            capture_output=True, text=True,
-        )
-        if result.returncode != 0 or not os.path.exists(seg_path) or os.path.getsize(seg_path) == 0:
-            result2 = subprocess.run(
-                [self._ffmpeg, "-y", "-i", video_path, "-ss", str(start), "-to", str(end),
-                 "-c:v", "mpeg4", "-c:a", "aac", seg_path],
-                capture_output=True, text=True,
-            )
-            if result2.returncode != 0:
-                raise RuntimeError(
-                    f"Segment extraction failed [{result2.returncode}]: {result2.stderr[-400:]}"
-                )
-        return seg_path
+        return mel_spec
 
     def _zero_video(self):
         import torch
@@ -226,42 +253,177 @@ class EmotionSenseController:
         import torch
         return torch.zeros(1, 64, 300)
 
-    def _run_inference(self, text: str, video_frames, audio_feats) -> dict:
+    def _default_batch_size(self, device) -> int:
+        """Micro-batch size from EMOTION_SENSE_BATCH_SIZE, else sized to half the free memory."""
+        configured = os.getenv("EMOTION_SENSE_BATCH_SIZE")
+        if configured:
+            return max(1, int(configured))
+        # R3D-18 over a 30-frame 224x224 clip dominates: a few hundred MB of activations per utterance
+        per_item = int(os.getenv("EMOTION_SENSE_BYTES_PER_ITEM", str(400 * 1024 * 1024)))
+        try:
+            import torch
+            if device.type == "cuda":
+                free = torch.cuda.mem_get_info(device)[0]
+            else:
+                free = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError, RuntimeError):
+            return 8
+        return max(1, min(32, int(free * 0.5) // per_item))
+
+    def _run_inference_batch(self, items: list, batch_size: int | None = None) -> list:
+        """
+        Run (text, video_frames, audio_feats) items through the model in micro-batches.
+
+        Returns one result dict per item, in order. The model is in eval mode
+        (BatchNorm uses running statistics), so batching does not change the
+        per-item outputs.
+        """
         import torch
         md = self._model_dict
         model, tokenizer, device = md["model"], md["tokenizer"], md["device"]
+        batch_size = batch_size or md["batch_size"]
+
+        results = []
+        for i in range(0, len(items), batch_size):
+            chunk = items[i:i + batch_size]
+            text_inputs = tokenizer(
+                [text for text, _, _ in chunk],
+                padding="max_length",
+                truncation=True,
+                max_length=128,
+                return_tensors="pt",
+            )
+            text_inputs  = {k: v.to(device) for k, v in text_inputs.items()}
+            video_frames = torch.stack([frames for _, frames, _ in chunk]).to(device)
+            audio_feats  = torch.stack([feats for _, _, feats in chunk]).to(device)
+
+            with torch.inference_mode():
+                outputs = model(text_inputs, video_frames, audio_feats)
+                emotion_probs   = torch.softmax(outputs["emotions"],   dim=1)
+                sentiment_probs = torch.softmax(outputs["sentiments"], dim=1)
+                e_vals, e_idx = torch.topk(emotion_probs,   3, dim=1)
+                s_vals, s_idx = torch.topk(sentiment_probs, 3, dim=1)
+
+            e_vals, e_idx = e_vals.cpu().tolist(), e_idx.cpu().tolist()
+            s_vals, s_idx = s_vals.cpu().tolist(), s_idx.cpu().tolist()
+            for row in range(len(chunk)):
+                results.append({
+                    "emotions": [
+                        {"label": EMOTION_MAP[label], "confidence": round(c, 4)}
+                        for label, c in zip(e_idx[row], e_vals[row])
+                    ],
+                    "sentiments": [
+                        {"label": SENTIMENT_MAP[label], "confidence": round(c, 4)}
+                        for label, c in zip(s_idx[row], s_vals[row])
+                    ],
+                })
+        return results
+
+    def _resolve_segment(self, entry: tuple) -> tuple:
+        """Wait for one submitted segment; returns ("utterance", prediction) or ("failed", segment info)."""
+        segment, future = entry
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Segment [{segment['start']:.1f}s-{segment['end']:.1f}s] failed: {e}")
+            return "failed", {
+                "start_time": round(segment["start"], 2),
+                "end_time":   round(segment["end"],   2),
+                "error":      str(e),
+            }
+        return "utterance", {
+            "start_time": round(segment["start"], 2),
+            "end_time":   round(segment["end"],   2),
+            "text":       segment["text"].strip(),
+            **result,
+        }
 
-        text_inputs = tokenizer(
-            text,
-            padding="max_length",
-            truncation=True,
-            max_length=128,
-            return_tensors="pt",
-        )
-        text_inputs  = {k: v.to(device) for k, v in text_inputs.items()}
-        video_frames = video_frames.unsqueeze(0).to(device)
-        audio_feats  = audio_feats.unsqueeze(0).to(device)
+    @staticmethod
+    def _failed_future(error: Exception) -> Future:
+        future = Future()
+        future.set_exception(error)
+        return future
+
+    @staticmethod
+    def _collect(events) -> dict:
+        result = {"utterances": [], "total_segments": 0, "failed_segments": 0}
+        for kind, payload in events:
+            if kind == "segments":
+                result["total_segments"] = payload
+            elif kind == "utterance":
+                result["utterances"].append(payload)
+            else:
+                result["failed_segments"] += 1
+        return result
 
-        with torch.inference_mode():
-            outputs = model(text_inputs, video_frames, audio_feats)
-            emotion_probs   = torch.softmax(outputs["emotions"],   dim=1)[0]
-            sentiment_probs = torch.softmax(outputs["sentiments"], dim=1)[0]
-            e_vals, e_idx = torch.topk(emotion_probs,   3)
-            s_vals, s_idx = torch.topk(sentiment_probs, 3)
+    def get_batching_stats(self) -> dict:
+        if self._batcher is None:
+            return {"loaded": False}
+        return self._batcher.get_stats()
 
-        return {
-            "emotions": [
-                {"label": EMOTION_MAP[i.item()], "confidence": round(c.item(), 4)}
-                for i, c in zip(e_idx, e_vals)
-            ],
-            "sentiments": [
-                {"label": SENTIMENT_MAP[i.item()], "confidence": round(c.item(), 4)}
-                for i, c in zip(s_idx, s_vals)
-            ],
-        }
+    def get_worker_stats(self) -> dict:
+        return self.workers.get_stats()
 
     # ── Public analysis methods ────────────────────────────────────────────
 
+    def iter_video_utterances(self, video_path: str):
+        """
+        Single-pass analysis: one ffmpeg decode to PCM (shared by Whisper and the
+        per-segment audio features) and one OpenCV pass over the frames.
+
+        Yields ("segments", count) once the media is transcribed, then one
+        ("utterance", prediction) or ("failed", segment info) per segment in
+        order, as soon as each is inferred.
+        """
+        audio_array   = self._load_audio_for_whisper(video_path)
+        transcription = self._model_dict["transcriber"].transcribe(
+            audio_array, word_timestamps=True
+        )
+        yield "segments", len(transcription["segments"])
+
+        pending     = deque()
+        max_pending = 2 * self._batcher.max_batch_size
+
+        # Segments are inferred while later ones decode; at most two batches of tensors are held
+        for segment, frames in self._iter_segment_frames(video_path, transcription["segments"]):
+            try:
+                video_frames = self._frames_to_tensor(frames)
+                audio_feats  = self._audio_features_from_pcm(
+                    audio_array, segment["start"], segment["end"]
+                )
+                pending.append((segment, self._batcher.submit((segment["text"], video_frames, audio_feats))))
+            except Exception as e:
+                pending.append((segment, self._failed_future(e)))
+            while len(pending) > max_pending:
+                yield self._resolve_segment(pending.popleft())
+        while pending:
+            yield self._resolve_segment(pending.popleft())
+
+    def iter_audio_utterances(self, audio_path: str):
+        """Audio-only counterpart of iter_video_utterances (zero video tensors)."""
+        audio_array   = self._load_audio_for_whisper(audio_path)
+        transcription = self._model_dict["transcriber"].transcribe(
+            audio_array, word_timestamps=True
+        )
+        yield "segments", len(transcription["segments"])
+
+        pending     = deque()
+        max_pending = 2 * self._batcher.max_batch_size
+        zero_video  = self._zero_video()
+
+        for segment in transcription["segments"]:
+            try:
+                audio_feats = self._audio_features_from_pcm(
+                    audio_array, segment["start"], segment["end"]
+                )
+                pending.append((segment, self._batcher.submit((segment["text"], zero_video, audio_feats))))
+            except Exception as e:
+                pending.append((segment, self._failed_future(e)))
+            while len(pending) > max_pending:
+                yield self._resolve_segment(pending.popleft())
+        while pending:
+            yield self._resolve_segment(pending.popleft())
+
     def analyze_video(self, file_bytes: bytes, filename: str) -> dict:
         suffix  = Path(filename).suffix if filename else ".mp4"
         tmp_dir = tempfile.mkdtemp()
@@ -269,42 +431,7 @@ class EmotionSenseController:
         try:
             with open(upload_path, "wb") as f:
                 f.write(file_bytes)
-
-            audio_array   = self._load_audio_for_whisper(upload_path)
-            transcription = self._model_dict["transcriber"].transcribe(
-                audio_array, word_timestamps=True
-            )
-
-            predictions    = []
-            failed_segments = 0
-
-            for segment in transcription["segments"]:
-                seg_path = None
-                try:
-                    seg_path = self._extract_segment(
-                        upload_path, segment["start"], segment["end"], tmp_dir
-                    )
-                    video_frames = self._process_video_frames(seg_path)
-                    audio_feats  = self._extract_audio_features(seg_path)
-                    result = self._run_inference(segment["text"], video_frames, audio_feats)
-                    predictions.append({
-                        "start_time": round(segment["start"], 2),
-                        "end_time":   round(segment["end"],   2),
-                        "text":       segment["text"].strip(),
-                        **result,
-                    })
-                except Exception as e:
-                    failed_segments += 1
-                    print(f"Segment [{segment['start']:.1f}s-{segment['end']:.1f}s] failed: {e}")
-                finally:
-                    if seg_path and os.path.exists(seg_path):
-                        os.remove(seg_path)
-
-            return {
-                "utterances":      predictions,
-                "total_segments":  len(transcription["segments"]),
-                "failed_segments": failed_segments,
-            }
+            return self._collect(self.iter_video_utterances(upload_path))
         finally:
             shutil.rmtree(tmp_dir, ignore_errors=True)
 
@@ -315,57 +442,16 @@ class EmotionSenseController:
         try:
             with open(upload_path, "wb") as f:
                 f.write(file_bytes)
-
-            audio_array   = self._load_audio_for_whisper(upload_path)
-            transcription = self._model_dict["transcriber"].transcribe(
-                audio_array, word_timestamps=True
-            )
-
-            predictions  = []
-            failed_count = 0
-
-            for segment in transcription["segments"]:
-                seg_audio_path = os.path.join(tmp_dir, f"seg_{segment['start']:.2f}.wav")
-                try:
-                    subprocess.run(
-                        [self._ffmpeg, "-y",
-                         "-ss", str(segment["start"]), "-to", str(segment["end"]),
-                         "-i", upload_path,
-                         "-ar", "16000", "-ac", "1", seg_audio_path],
-                        capture_output=True,
-                    )
-                    if os.path.exists(seg_audio_path) and os.path.getsize(seg_audio_path) > 0:
-                        audio_feats = self._extract_audio_features(seg_audio_path)
-                    else:
-                        audio_feats = self._zero_audio()
-
-                    result = self._run_inference(
-                        segment["text"], self._zero_video(), audio_feats
-                    )
-                    predictions.append({
-                        "start_time": round(segment["start"], 2),
-                        "end_time":   round(segment["end"],   2),
-                        "text":       segment["text"].strip(),
-                        **result,
-                    })
-                except Exception as e:
-                    failed_count += 1
-                    print(f"Audio segment failed: {e}")
-                finally:
-                    if os.path.exists(seg_audio_path):
-                        os.remove(seg_audio_path)
-
-            return {
-                "utterances":      predictions,
-                "total_segments":  len(transcription["segments"]),
-                "failed_segments": failed_count,
-                "mode":            "audio",
-            }
+            return {**self._collect(self.iter_audio_utterances(upload_path)), "mode": "audio"}
         finally:
             shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    def analyze_text(self, text: str) -> dict:
-        result = self._run_inference(text, self._zero_video(), self._zero_audio())
+    def submit_text(self, text: str) -> Future:
+        """Queue a text-only item on the inference batcher (zero video/audio tensors)."""
+        return self._batcher.submit((text, self._zero_video(), self._zero_audio()))
+
+    @staticmethod
+    def text_response(text: str, result: dict) -> dict:
         return {
             "utterances": [{
                 "start_time": 0.0,
@@ -378,6 +464,9 @@ class EmotionSenseController:
             "mode":            "text",
         }
 
+    def analyze_text(self, text: str) -> dict:
+        return self.text_response(text, self.submit_text(text).result())
+
 
 # Module-level singleton — shared across the whole FastAPI process
 emotion_sense_controller = EmotionSenseController()
@@ -0,0 +1,361 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+from controllers.storage_paths import DATA_DIR, data_path
+
+EMOTION_SENSE_JOB_WORKERS = int(os.getenv("EMOTION_SENSE_JOB_WORKERS", "1"))
+EMOTION_SENSE_MAX_JOBS_QUEUED = int(os.getenv("EMOTION_SENSE_MAX_JOBS_QUEUED", "50"))
+# How often job event streams check the job tables for new results
+EMOTION_SENSE_JOB_POLL_INTERVAL = float(os.getenv("EMOTION_SENSE_JOB_POLL_INTERVAL", "0.5"))
+
+ACTIVE_STATUSES = ("queued", "running")
+MEDIA_MODES = ("video", "audio")
+
+
+class EmotionSenseJobQueueFull(Exception):
+    """Raised when EMOTION_SENSE_MAX_JOBS_QUEUED analysis jobs are already waiting"""
+
+
+class EmotionSenseJobCancelled(Exception):
+    """Raised inside a job's worker thread when the job was cancelled"""
+
+
+class EmotionSenseJobManager:
+    """
+    Background analysis jobs for long recordings with incremental results
+
+    Uploads are spooled to the data directory and recorded in a SQLite job
+    table; every utterance is written to an utterance table as soon as it is
+    inferred, together with the job's progress. Clients poll or follow the
+    job's event stream from any sequence number, so a dropped client can
+    reconnect without losing results. Jobs left queued or running by a
+    restart are re-queued and analysed from the start.
+
+    Up to EMOTION_SENSE_JOB_WORKERS jobs run at a time, each on a thread of
+    the controller's EmotionSenseWorkerPool, so EMOTION_SENSE_WORKERS bounds
+    jobs and synchronous requests together. A job waits while the pool is
+    full rather than being rejected; keep EMOTION_SENSE_JOB_WORKERS below
+    EMOTION_SENSE_WORKERS to leave threads for synchronous requests.
+    Cancellation is checked between utterances (an in-progress Whisper
+    transcription finishes first).
+    """
+
+    def __init__(self, controller):
+        # controller is the EmotionSenseController that runs the analysis
+        self.controller = controller
+        self.path = os.getenv("EMOTION_SENSE_JOBS_PATH") or data_path("emotion_sense_jobs.sqlite3")
+        self.spool_dir = os.path.join(DATA_DIR, "emotion_sense_uploads")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " filename TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " file_path TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " total_segments INTEGER,"
+            " processed_segments INTEGER NOT NULL DEFAULT 0,"
+            " failed_segments INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS utterances ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+        self._conn.commit()
+
+        self._queue: deque = deque()
+        self._running: Dict[str, threading.Event] = {}  # job_id -> cancel flag
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._stopping = False
+
+    # ── Lifecycle ───────────────────────────────────────────────────────────
+
+    def start(self):
+        """Start the workers and re-queue jobs left over from a previous run"""
+        if self._workers:
+            return
+        if not self.controller.is_loaded:
+            # Running jobs without a model would fail them and delete their uploads
+            print("EmotionSense model not loaded; analysis jobs stay queued and workers are not started")
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", ACTIVE_STATUSES
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),)
+            )
+            self._conn.commit()
+        self._queue = deque(job_id for job_id, in rows)
+        if rows:
+            print(f"Resumed {len(rows)} EmotionSense job(s) from the persistent queue")
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(max(1, EMOTION_SENSE_JOB_WORKERS))
+        ]
+
+    async def stop(self):
+        self._stopping = True
+        for cancelled in self._running.values():
+            cancelled.set()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # ── Public API ──────────────────────────────────────────────────────────
+
+    async def submit(self, upload, mode: str) -> Dict:
+        """Spool an uploaded recording to disk and queue it; returns the new job record"""
+        if len(self._queue) >= EMOTION_SENSE_MAX_JOBS_QUEUED:
+            raise EmotionSenseJobQueueFull(
+                f"EmotionSense job queue is full ({EMOTION_SENSE_MAX_JOBS_QUEUED} jobs waiting)"
+            )
+
+        job_id = uuid.uuid4().hex
+        filename = upload.filename or f"upload.{'mp4' if mode == 'video' else 'mp3'}"
+        file_path = os.path.join(self.spool_dir, f"{job_id}{Path(filename).suffix}")
+        await asyncio.to_thread(self._spool, upload.file, file_path)
+
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, filename, mode, file_path, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, filename, mode, file_path, now, now)
+            )
+            self._conn.commit()
+        self._queue.append(job_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self.get_job(job_id)
+
+    @staticmethod
+    def _spool(source, file_path: str):
+        source.seek(0)
+        with open(file_path, "wb") as dest:
+            shutil.copyfileobj(source, dest, 1024 * 1024)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT job_id, filename, mode, status, total_segments, processed_segments,"
+                " failed_segments, error, created_at, updated_at FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT job_id, filename, mode, status, total_segments, processed_segments,"
+                " failed_segments, error, created_at, updated_at FROM jobs"
+                " ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def get_results(self, job_id: str, after: int = 0, limit: int = 1000) -> List[Dict]:
+        """Utterance results with sequence number > after, in segment order"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT seq, kind, payload FROM utterances WHERE job_id = ? AND seq > ?"
+                " ORDER BY seq LIMIT ?",
+                (job_id, after, limit)
+            ).fetchall()
+        return [{"seq": seq, "status": "success" if kind == "utterance" else "failed", **json.loads(payload)}
+                for seq, kind, payload in rows]
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """
+        Cancel a queued or running job; returns None if the job does not exist
+
+        Call from the event loop only: the queue and running table are owned by
+        the loop's workers.
+        """
+        job = self.get_job(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+
+        cancelled = self._running.get(job_id)
+        if cancelled is not None:
+            # The worker records the cancellation after the current utterance
+            cancelled.set()
+            return {**job, "status": "cancelling"}
+
+        if job_id in self._queue:
+            self._queue.remove(job_id)
+        self._finish(job_id, "cancelled")
+        return self.get_job(job_id)
+
+    def get_stats(self) -> Dict:
+        return {
+            "workers": len(self._workers),
+            "queued": len(self._queue),
+            "running": len(self._running),
+            "max_queued": EMOTION_SENSE_MAX_JOBS_QUEUED,
+        }
+
+    # ── Workers ─────────────────────────────────────────────────────────────
+
+    async def _worker(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job_id = self._queue.popleft()
+            cancelled = threading.Event()
+            self._running[job_id] = cancelled
+            try:
+                slot = await self._reserve_worker(cancelled)
+                if slot is None:
+                    # Cancelled while waiting; on shutdown the job stays queued for the next start
+                    if not self._stopping:
+                        self._finish(job_id, "cancelled")
+                    continue
+                await slot.run(self._run_job, job_id, cancelled)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            except Exception as e:
+                print(f"EmotionSense job {job_id} crashed: {e}")
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _reserve_worker(self, cancelled: threading.Event):
+        """Wait for a place in the shared worker pool; None if the job is cancelled meanwhile"""
+        while not cancelled.is_set():
+            slot = self.controller.workers.try_reserve("job")
+            if slot is not None:
+                return slot
+            await asyncio.sleep(EMOTION_SENSE_JOB_POLL_INTERVAL)
+        return None
+
+    def _run_job(self, job_id: str, cancelled: threading.Event):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT mode, file_path FROM jobs WHERE job_id = ? AND status IN (?, ?)",
+                (job_id,) + ACTIVE_STATUSES
+            ).fetchone()
+            if row is None:
+                return
+            # Claim the job only if it is still active; a cancellation may have finished it meanwhile
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = 'running', total_segments = NULL, processed_segments = 0,"
+                " failed_segments = 0, updated_at = ? WHERE job_id = ? AND status IN (?, ?)",
+                (time.time(), job_id) + ACTIVE_STATUSES
+            ).rowcount
+            if not claimed:
+                self._conn.commit()
+                return
+            # A job resumed after a restart is analysed again from the start
+            self._conn.execute("DELETE FROM utterances WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+        mode, file_path = row
+
+        if mode == "video":
+            events = self.controller.iter_video_utterances(file_path)
+        else:
+            events = self.controller.iter_audio_utterances(file_path)
+        processed = failed = 0
+        try:
+            for kind, payload in events:
+                if cancelled.is_set():
+                    raise EmotionSenseJobCancelled()
+                if kind == "segments":
+                    with self._db_lock:
+                        self._conn.execute(
+                            "UPDATE jobs SET total_segments = ?, updated_at = ? WHERE job_id = ?",
+                            (payload, time.time(), job_id)
+                        )
+                        self._conn.commit()
+                    continue
+                processed += 1
+                failed += kind == "failed"
+                with self._db_lock:
+                    self._conn.execute(
+                        "INSERT INTO utterances (job_id, seq, kind, payload) VALUES (?, ?, ?, ?)",
+                        (job_id, processed, kind, json.dumps(payload))
+                    )
+                    self._conn.execute(
+                        "UPDATE jobs SET processed_segments = ?, failed_segments = ?, updated_at = ?"
+                        " WHERE job_id = ?",
+                        (processed, failed, time.time(), job_id)
+                    )
+                    self._conn.commit()
+            self._finish(job_id, "completed")
+        except EmotionSenseJobCancelled:
+            if self._stopping:
+                # Interrupted by shutdown: leave the job (and its upload) for the next start
+                with self._db_lock:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'queued', updated_at = ? WHERE job_id = ?", (time.time(), job_id)
+                    )
+                    self._conn.commit()
+            else:
+                self._finish(job_id, "cancelled")
+        except Exception as e:
+            self._finish(job_id, "failed", error=str(e))
+        finally:
+            events.close()
+
+    # ── Persistence helpers ─────────────────────────────────────────────────
+
+    def _finish(self, job_id: str, status: str, error: str = None):
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (status, error, time.time(), job_id)
+            )
+            self._conn.commit()
+            row = self._conn.execute("SELECT file_path FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row and os.path.exists(row[0]):
+            os.remove(row[0])
+
+    @staticmethod
+    def _row_to_job(row) -> Dict:
+        (job_id, filename, mode, status, total_segments, processed_segments,
+         failed_segments, error, created_at, updated_at) = row
+        if status == "completed":
+            progress = 100.0
+        elif total_segments:
+            progress = round(100 * processed_segments / total_segments, 1)
+        else:
+            progress = 0.0
+        return {
+            "job_id": job_id,
+            "filename": filename,
+            "mode": mode,
+            "status": status,
+            "stage": "transcribing" if status == "running" and total_segments is None else status,
+            "progress_percent": progress,
+            "total_segments": total_segments,
+            "processed_segments": processed_segments,
+            "failed_segments": failed_segments,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
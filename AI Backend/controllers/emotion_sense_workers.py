@@ -0,0 +1,182 @@
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from controllers.metrics import LatencyHistogram
+
+
+class EmotionSenseBusy(Exception):
+    """Raised when the EmotionSense worker pool and its queue are full; routers answer 503"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class WorkerSlot:
+    """
+    A reserved place in the worker queue
+
+    Routers reserve before reading the upload, so an overloaded pool rejects
+    requests without buffering them first. run() hands the slot to a worker;
+    release() frees a slot that was never run and is a no-op afterwards.
+    """
+
+    __slots__ = ("pool", "kind", "enqueued", "taken")
+
+    def __init__(self, pool: "EmotionSenseWorkerPool", kind: str):
+        self.pool = pool
+        self.kind = kind
+        self.enqueued = time.monotonic()
+        self.taken = False
+
+    async def run(self, fn: Callable, *args):
+        self.taken = True
+        return await self.pool._run_slot(self, fn, *args)
+
+    def release(self):
+        if not self.taken:
+            self.taken = True
+            self.pool._release_slot(self)
+
+
+class EmotionSenseWorkerPool:
+    """
+    Bounded worker pool that keeps EmotionSense analysis off the event loop
+
+    EMOTION_SENSE_WORKERS threads run media analyses (Whisper, decoding and
+    feeding the inference batcher); ffmpeg runs as a subprocess and OpenCV
+    and torch release the GIL, so other routers keep being served. At most
+    EMOTION_SENSE_MAX_QUEUED further requests wait for a worker; beyond that
+    reservations are rejected with EmotionSenseBusy instead of piling up.
+
+    Text-only requests need no decoding, so they skip the threads and await
+    the inference batcher directly, bounded separately by
+    EMOTION_SENSE_MAX_TEXT_IN_FLIGHT; they batch with each other and with
+    media segments.
+    """
+
+    def __init__(self):
+        self.workers = int(os.getenv("EMOTION_SENSE_WORKERS", "2"))
+        self.max_queued = int(os.getenv("EMOTION_SENSE_MAX_QUEUED", "8"))
+        self.max_text_in_flight = int(os.getenv("EMOTION_SENSE_MAX_TEXT_IN_FLIGHT", "256"))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="emotion-sense")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._text_in_flight = 0
+        self._counters = Counter()
+        self._queue_wait = LatencyHistogram()
+        self._run_time = LatencyHistogram(
+            (100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+        )
+
+    def reserve(self, kind: str) -> WorkerSlot:
+        """Reserve a place in the queue, or raise EmotionSenseBusy when it is full"""
+        slot = self.try_reserve(kind)
+        if slot is None:
+            with self._lock:
+                self._counters[f"{kind}_rejected"] += 1
+                retry_after = self._retry_after()
+            raise EmotionSenseBusy("EmotionSense is at capacity, retry shortly", retry_after)
+        return slot
+
+    def try_reserve(self, kind: str) -> Optional[WorkerSlot]:
+        """Reserve a place in the queue, or return None when it is full (for callers that wait and retry)"""
+        with self._lock:
+            if self._pending >= self.workers + self.max_queued:
+                return None
+            self._pending += 1
+            self._counters[f"{kind}_submitted"] += 1
+        return WorkerSlot(self, kind)
+
+    async def run(self, kind: str, fn: Callable, *args):
+        """Run fn(*args) on a worker, or raise EmotionSenseBusy when the queue is full"""
+        return await self.reserve(kind).run(fn, *args)
+
+    async def run_batched(self, kind: str, submit: Callable[[], Future]):
+        """
+        Await a future-returning submission (e.g. to the inference batcher)
+        on the event loop, without holding a worker thread
+        """
+        with self._lock:
+            if self._text_in_flight >= self.max_text_in_flight:
+                self._counters[f"{kind}_rejected"] += 1
+                raise EmotionSenseBusy("EmotionSense is at capacity, retry shortly", 1)
+            self._text_in_flight += 1
+            self._counters[f"{kind}_submitted"] += 1
+        try:
+            result = await asyncio.wrap_future(submit())
+        except Exception:
+            self._count(f"{kind}_failed")
+            raise
+        finally:
+            with self._lock:
+                self._text_in_flight -= 1
+        self._count(f"{kind}_completed")
+        return result
+
+    def _count(self, key: str):
+        with self._lock:
+            self._counters[key] += 1
+
+    async def _run_slot(self, slot: WorkerSlot, fn: Callable, *args):
+        kind = slot.kind
+
+        def work():
+            started = time.monotonic()
+            self._queue_wait.observe(started - slot.enqueued)
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args)
+            finally:
+                self._run_time.observe(time.monotonic() - started)
+                with self._lock:
+                    self._running -= 1
+
+        def finished(future):
+            # Also runs when a queued job is cancelled before it started
+            with self._lock:
+                self._pending -= 1
+                if future.cancelled():
+                    self._counters[f"{kind}_cancelled"] += 1
+                elif future.exception() is not None:
+                    self._counters[f"{kind}_failed"] += 1
+                else:
+                    self._counters[f"{kind}_completed"] += 1
+
+        future = self._executor.submit(work)
+        future.add_done_callback(finished)
+        return await asyncio.wrap_future(future)
+
+    def _release_slot(self, slot: WorkerSlot):
+        with self._lock:
+            self._pending -= 1
+            self._counters[f"{slot.kind}_abandoned"] += 1
+
+    def _retry_after(self) -> int:
+        snapshot = self._run_time.snapshot()
+        average_seconds = snapshot["avg_ms"] / 1000 if snapshot["count"] else 10.0
+        return max(1, round(average_seconds * (self._pending - self.workers + 1) / self.workers))
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return self._pending - self._running
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "text_in_flight": self._text_in_flight,
+                "max_text_in_flight": self.max_text_in_flight,
+                "counters": dict(self._counters),
+                "queue_wait": self._queue_wait.snapshot(),
+                "run_time": self._run_time.snapshot(),
+            }
@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+from controllers.metrics import LatencyHistogram
+
+
+class _Pending:
+    __slots__ = ("item", "future", "enqueued")
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class DynamicBatcher:
+    """
+    Cross-request dynamic batching in front of a batch inference function
+
+    Callers enqueue items from any thread and wait on per-item futures. A
+    single inference thread takes the oldest item, keeps collecting until the
+    batch has `max_batch_size` items or the oldest item has waited
+    `max_wait_ms`, runs one `run_batch(items)` call and resolves the futures
+    in order. Items already queued when the window closes still join the
+    batch, so under load batches fill without waiting at all.
+
+    If a batch raises, its items are retried one by one so a single bad input
+    only fails its own request.
+    """
+
+    def __init__(self, run_batch: Callable[[List], List], max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 name: str = "inference-batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_wait = LatencyHistogram()
+        self._batch_latency = LatencyHistogram()
+        self._stats = {"items": 0, "batches": 0, "failed_batches": 0, "failed_items": 0}
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        pending = _Pending(item)
+        self._queue.put(pending)
+        return pending.future
+
+    def submit_many(self, items: List) -> List[Future]:
+        return [self.submit(item) for item in items]
+
+    def infer(self, item):
+        """Blocking single-item inference through the shared batches"""
+        return self.submit(item).result()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            deadline = first.enqueued + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch: List[_Pending]):
+        started = time.monotonic()
+        for pending in batch:
+            self._queue_wait.observe(started - pending.enqueued)
+        try:
+            results = self.run_batch([pending.item for pending in batch])
+            for pending, result in zip(batch, results):
+                pending.future.set_result(result)
+            failed = False
+        except Exception as e:
+            failed = True
+            if len(batch) > 1:
+                print(f"Inference batch of {len(batch)} failed, retrying one by one: {e}")
+            for pending in batch:
+                try:
+                    if len(batch) == 1:
+                        raise e
+                    pending.future.set_result(self.run_batch([pending.item])[0])
+                except Exception as item_error:
+                    pending.future.set_exception(item_error)
+                    with self._lock:
+                        self._stats["failed_items"] += 1
+        self._batch_latency.observe(time.monotonic() - started)
+        with self._lock:
+            self._stats["items"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["failed_batches"] += failed
+            self._batch_sizes[len(batch)] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(
+                self._stats,
+                queue_depth=self._queue.qsize(),
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=round(self.max_wait * 1000, 2),
+                average_batch_size=round(self._stats["items"] / self._stats["batches"], 2)
+                if self._stats["batches"] else 0.0,
+                batch_sizes=dict(sorted(self._batch_sizes.items())),
+                queue_wait=self._queue_wait.snapshot(),
+                batch_latency=self._batch_latency.snapshot(),
+            )
@@ -0,0 +1,519 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+from controllers.ingestion_pipeline import IngestionDocument
+from controllers.storage_paths import DATA_DIR, data_path
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_MAX_QUEUED = int(os.getenv("INGESTION_MAX_QUEUED", "1000"))
+INGESTION_PROGRESS_INTERVAL = float(os.getenv("INGESTION_PROGRESS_INTERVAL", "2.0"))
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "5000"))
+# Checked against the archive's central directory before anything is extracted
+BULK_MAX_ARCHIVE_ENTRIES = int(os.getenv("BULK_MAX_ARCHIVE_ENTRIES", "20000"))
+BULK_MAX_UNCOMPRESSED_BYTES = int(os.getenv("BULK_MAX_UNCOMPRESSED_BYTES", str(4 * 1024 ** 3)))
+INGESTION_LEASE_SECONDS = float(os.getenv("INGESTION_LEASE_SECONDS", "60"))
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "5"))
+
+# "cancelling": cancel requested for a job another worker is running
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+
+class IngestionQueueFull(Exception):
+    """Raised when the ingestion backlog is at INGESTION_MAX_QUEUED"""
+
+
+class BulkProgress:
+    """Aggregated stage counters for a bulk job's documents"""
+
+    def __init__(self, documents: List[IngestionDocument]):
+        self.documents = documents
+        self.stage = "processing"
+
+    def progress(self) -> Dict:
+        totals = {
+            "stage": self.stage,
+            "files_total": len(self.documents),
+            "files_completed": sum(1 for d in self.documents if d.stage == "completed"),
+            "files_failed": sum(1 for d in self.documents if d.error is not None),
+        }
+        for key in ("total_pages", "pages_extracted", "chunks_processed", "chunks_embedded",
+                    "vectors_stored", "vectors_deleted"):
+            totals[key] = sum(getattr(d, key) for d in self.documents)
+        return totals
+
+
+class IngestionJobManager:
+    """
+    Background PDF ingestion jobs with per-organization fairness
+
+    Uploads are spooled to the data directory and recorded in a SQLite job table,
+    so queued and interrupted jobs are resumed after a restart. A fixed pool of
+    asyncio workers takes jobs round-robin across organizations, so one tenant
+    uploading hundreds of files cannot starve the others.
+
+    Several server processes can share the job table. A process claims a job
+    by writing its owner id and a lease of INGESTION_LEASE_SECONDS, renewed
+    with every progress update. Every INGESTION_POLL_SECONDS each process
+    queues jobs it has not seen yet, including running jobs whose lease ran
+    out because their process died. A cancel for a job running elsewhere
+    marks it "cancelling", and its owner stops at the next renewal.
+    """
+
+    def __init__(self, processor):
+        # processor is the PDFProcessingController that runs the ingestion pipeline
+        self.processor = processor
+        self.path = os.getenv("INGESTION_JOBS_PATH") or data_path("ingestion_jobs.sqlite3")
+        self.spool_dir = os.path.join(DATA_DIR, "uploads")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " organization_id TEXT NOT NULL,"
+            " pdf_filename TEXT NOT NULL,"
+            " file_path TEXT NOT NULL,"
+            " kind TEXT NOT NULL DEFAULT 'single',"  # bulk jobs point file_path at a spool directory
+            " incremental INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " owner TEXT,"
+            " lease_expires REAL,"
+            " progress TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+        self._conn.commit()
+
+        # Round-robin queues {organization_id: deque[job_id]}
+        self._org_queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = set()
+        self._running: Dict[str, tuple] = {}  # job_id -> (task, IngestionDocument | BulkProgress)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._poller: Optional[asyncio.Task] = None
+
+    # ── Lifecycle ───────────────────────────────────────────────────────────
+
+    def start(self):
+        """Start the worker pool and pick up jobs left over from a previous run"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        found = self._poll()
+        if found:
+            print(f"Resumed {found} ingestion job(s) from the persistent queue")
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(max(1, INGESTION_WORKERS))
+        ]
+        self._poller = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        tasks = self._workers + ([self._poller] if self._poller is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._poller = None
+
+    # ── Public API ──────────────────────────────────────────────────────────
+
+    async def submit(self, pdf_file, organization_id: str, incremental: bool = True) -> Dict:
+        """Spool an upload to disk and queue it; returns the new job record"""
+        if len(self._queued) >= INGESTION_MAX_QUEUED:
+            raise IngestionQueueFull(f"Ingestion queue is full ({INGESTION_MAX_QUEUED} jobs waiting)")
+
+        job_id = uuid.uuid4().hex
+        file_path = os.path.join(self.spool_dir, f"{job_id}.pdf")
+        await self.processor.save_upload(pdf_file, file_path)
+
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, organization_id, pdf_filename, file_path, incremental,"
+                " status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, organization_id, pdf_file.filename, file_path, int(incremental), now, now)
+            )
+            self._conn.commit()
+        self._push(organization_id, job_id)
+        return self.get_job(job_id)
+
+    async def submit_bulk(self, pdf_files: list, archive, organization_id: str,
+                          incremental: bool = True) -> Dict:
+        """
+        Spool many PDFs (individual uploads and/or a zip archive) as one bulk job
+
+        Non-PDF archive members are ignored; paths inside the archive are flattened
+        to their base names. Spooled files are named "<job id>-<seq>-<name>", so
+        uploads sharing a filename never overwrite each other; a repeated name
+        is indexed as "<stem>_<tag><ext>".
+        """
+        if len(self._queued) >= INGESTION_MAX_QUEUED:
+            raise IngestionQueueFull(f"Ingestion queue is full ({INGESTION_MAX_QUEUED} jobs waiting)")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.spool_dir, job_id)
+        os.makedirs(job_dir)
+        names = set()
+        try:
+            for position, pdf_file in enumerate(pdf_files, 1):
+                name = os.path.basename(pdf_file.filename or "")
+                if name.lower().endswith(".pdf"):
+                    name = self._unique_name(name, names, str(position))
+                    await self.processor.save_upload(
+                        pdf_file, self._spool_path(job_dir, job_id, len(names), name)
+                    )
+            if archive is not None:
+                archive_path = os.path.join(self.spool_dir, f"{job_id}.zip")
+                await self.processor.save_upload(archive, archive_path)
+                try:
+                    await asyncio.to_thread(self._extract_archive, archive_path, job_dir, job_id, names)
+                finally:
+                    os.remove(archive_path)
+
+            file_count = len(os.listdir(job_dir))
+            if file_count == 0:
+                raise ValueError("No PDF files found in the upload")
+            if file_count > BULK_MAX_FILES:
+                raise ValueError(f"Too many files in one bulk upload (max {BULK_MAX_FILES})")
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, organization_id, pdf_filename, file_path, incremental,"
+                " status, created_at, updated_at, kind) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, 'bulk')",
+                (job_id, organization_id, f"{file_count} files", job_dir, int(incremental), now, now)
+            )
+            self._conn.commit()
+        self._push(organization_id, job_id)
+        return self.get_job(job_id)
+
+    @staticmethod
+    def _spool_path(job_dir: str, job_id: str, seq: int, name: str) -> str:
+        return os.path.join(job_dir, f"{job_id}-{seq:05d}-{name}")
+
+    @staticmethod
+    def _document_name(spooled: str) -> str:
+        """The pdf_filename a spooled bulk file is indexed under"""
+        return spooled.split("-", 2)[2]
+
+    @staticmethod
+    def _unique_name(name: str, names: set, tag: str) -> str:
+        """Reserve `name` among a job's files, tagging a repeat so both documents are kept"""
+        if name in names:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}_{tag}{ext}"
+        names.add(name)
+        return name
+
+    @classmethod
+    def _extract_archive(cls, archive_path: str, job_dir: str, job_id: str, names: set):
+        try:
+            archive = zipfile.ZipFile(archive_path)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Invalid zip archive: {e}")
+        with archive:
+            members = archive.infolist()
+            if len(members) > BULK_MAX_ARCHIVE_ENTRIES:
+                raise ValueError(f"Too many entries in the archive (max {BULK_MAX_ARCHIVE_ENTRIES})")
+            members = [
+                member for member in members
+                if not member.is_dir() and os.path.basename(member.filename).lower().endswith(".pdf")
+            ]
+            if len(names) + len(members) > BULK_MAX_FILES:
+                raise ValueError(f"Too many files in one bulk upload (max {BULK_MAX_FILES})")
+            # Declared sizes are binding: zipfile stops reading a member at its declared size
+            if sum(member.file_size for member in members) > BULK_MAX_UNCOMPRESSED_BYTES:
+                raise ValueError(
+                    f"Archive expands beyond the {BULK_MAX_UNCOMPRESSED_BYTES} byte limit"
+                )
+
+            for member in members:
+                # Same base name in two archive folders: keep both under distinct names
+                name = cls._unique_name(os.path.basename(member.filename), names, f"{member.CRC:08x}")
+                target = cls._spool_path(job_dir, job_id, len(names), name)
+                with archive.open(member) as source, open(target, "wb") as dest:
+                    shutil.copyfileobj(source, dest, 1024 * 1024)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Return a job's status, with live stage progress while it is running"""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT job_id, organization_id, pdf_filename, status, progress, result, error,"
+                " created_at, updated_at FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = self._row_to_job(row)
+        running = self._running.get(job_id)
+        if running is not None:
+            job["progress"] = running[1].progress()
+        return job
+
+    def list_jobs(self, organization_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        query = ("SELECT job_id, organization_id, pdf_filename, status, progress, result, error,"
+                 " created_at, updated_at FROM jobs")
+        params: tuple = ()
+        if organization_id:
+            query += " WHERE organization_id = ?"
+            params = (organization_id,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._db_lock:
+            rows = self._conn.execute(query, params + (limit,)).fetchall()
+        jobs = [self._row_to_job(row) for row in rows]
+        for job in jobs:
+            running = self._running.get(job["job_id"])
+            if running is not None:
+                job["progress"] = running[1].progress()
+        return jobs
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Cancel a queued or running job; returns None if the job does not exist"""
+        job = self.get_job(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+
+        running = self._running.get(job_id)
+        if running is not None:
+            # The worker records the cancellation once the pipeline unwinds
+            running[0].cancel()
+            return {**job, "status": "cancelling"}
+
+        queue = self._org_queues.get(job["organization_id"])
+        if queue is not None and job_id in queue:
+            queue.remove(job_id)
+            self._queued.discard(job_id)
+            if not queue:
+                del self._org_queues[job["organization_id"]]
+        if not self._finish(job_id, "cancelled", statuses=("queued",)):
+            # Claimed by another process meanwhile: its owner stops at the next lease renewal
+            self._update(job_id, status="cancelling", statuses=("running",))
+        return self.get_job(job_id)
+
+    def get_stats(self) -> Dict:
+        return {
+            "workers": len(self._workers),
+            "owner": self.owner,
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "organizations_waiting": len(self._org_queues),
+            "max_queued": INGESTION_MAX_QUEUED,
+            "lease_seconds": INGESTION_LEASE_SECONDS,
+        }
+
+    # ── Workers ─────────────────────────────────────────────────────────────
+
+    def _push(self, organization_id: str, job_id: str):
+        self._org_queues.setdefault(organization_id, deque()).append(job_id)
+        self._queued.add(job_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _poll(self) -> int:
+        """
+        Queue jobs this process has not seen: ones submitted through other
+        processes and ones whose owner's lease expired. Returns how many.
+        """
+        now = time.time()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT job_id, organization_id, status FROM jobs WHERE status = 'queued'"
+                " OR (status IN ('running', 'cancelling') AND lease_expires < ?) ORDER BY created_at",
+                (now,)
+            ).fetchall()
+        found = 0
+        for job_id, organization_id, status in rows:
+            if job_id in self._queued or job_id in self._running:
+                continue
+            if status == "cancelling":
+                # Its owner died before it could stop the job
+                self._finish(job_id, "cancelled", statuses=("cancelling",))
+                continue
+            self._push(organization_id, job_id)
+            found += 1
+        return found
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(INGESTION_POLL_SECONDS)
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Ingestion job poll failed: {e}")
+
+    def _pop_fair(self) -> Optional[str]:
+        """Take the next job from the organization at the head of the rotation"""
+        if not self._org_queues:
+            return None
+        organization_id, queue = next(iter(self._org_queues.items()))
+        job_id = queue.popleft()
+        self._queued.discard(job_id)
+        del self._org_queues[organization_id]
+        if queue:
+            self._org_queues[organization_id] = queue  # re-append at the tail
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job_id = self._pop_fair()
+            if job_id is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                await self._run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ingestion job {job_id} crashed: {e}")
+
+    async def _run_job(self, job_id: str):
+        now = time.time()
+        with self._db_lock:
+            # Claim: only one process gets a queued job, or one whose owner's lease expired
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_expires = ?, updated_at = ?"
+                " WHERE job_id = ? AND (status = 'queued' OR (status = 'running' AND lease_expires < ?))",
+                (self.owner, now + INGESTION_LEASE_SECONDS, now, job_id, now)
+            ).rowcount
+            self._conn.commit()
+            row = self._conn.execute(
+                "SELECT organization_id, pdf_filename, file_path, incremental, kind FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone() if claimed else None
+        if row is None:
+            return
+        organization_id, pdf_filename, file_path, incremental, kind = row
+
+        if kind == "bulk":
+            documents = [
+                IngestionDocument(
+                    os.path.join(file_path, spooled), organization_id, self._document_name(spooled),
+                    bool(incremental)
+                )
+                for spooled in sorted(os.listdir(file_path))
+            ]
+            document = BulkProgress(documents)
+            task = asyncio.create_task(self.processor.ingest_documents(documents))
+        else:
+            document = IngestionDocument(file_path, organization_id, pdf_filename, bool(incremental))
+            task = asyncio.create_task(self.processor.ingest_document(document))
+        self._running[job_id] = (task, document)
+        owned = ("running", "cancelling")
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=INGESTION_PROGRESS_INTERVAL)
+                # Renewal fails once a cancel arrived through another process or the lease was lost
+                if not self._update(job_id, progress=document.progress(), owned=True, statuses=("running",)):
+                    task.cancel()
+            result = task.result()
+            self._finish(job_id, "completed", owned=True, statuses=owned,
+                         progress=document.progress(), result=result)
+        except asyncio.CancelledError:
+            if not task.done():
+                # The worker itself is shutting down: hand the job back to the queue
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                with self._db_lock:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'queued', owner = NULL, lease_expires = NULL, updated_at = ?"
+                        " WHERE job_id = ? AND owner = ? AND status = 'running'",
+                        (time.time(), job_id, self.owner)
+                    )
+                    self._conn.commit()
+                raise
+            document.stage = "cancelled"
+            self._finish(job_id, "cancelled", owned=True, statuses=owned, progress=document.progress())
+        except Exception as e:
+            document.stage = "failed"
+            self._finish(job_id, "failed", owned=True, statuses=owned,
+                         progress=document.progress(), error=str(e))
+        finally:
+            self._running.pop(job_id, None)
+
+    # ── Persistence helpers ─────────────────────────────────────────────────
+
+    def _update(self, job_id: str, status: str = None, progress: Dict = None,
+                result: Dict = None, error: str = None, owned: bool = False,
+                statuses: tuple = None) -> bool:
+        """
+        Update a job row; returns False when the conditions did not hold
+
+        owned: only while this process holds the job (also renews the lease)
+        statuses: only while the job is in one of these statuses
+        """
+        now = time.time()
+        fields, params = ["updated_at = ?"], [now]
+        if status is not None:
+            fields.append("status = ?")
+            params.append(status)
+        if progress is not None:
+            fields.append("progress = ?")
+            params.append(json.dumps(progress))
+        if result is not None:
+            fields.append("result = ?")
+            params.append(json.dumps(result))
+        if error is not None:
+            fields.append("error = ?")
+            params.append(error)
+        conditions, condition_params = ["job_id = ?"], [job_id]
+        if owned:
+            fields.append("lease_expires = ?")
+            params.append(now + INGESTION_LEASE_SECONDS)
+            conditions.append("owner = ?")
+            condition_params.append(self.owner)
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            condition_params.extend(statuses)
+        with self._db_lock:
+            updated = self._conn.execute(
+                f"UPDATE jobs SET {', '.join(fields)} WHERE {' AND '.join(conditions)}",
+                params + condition_params
+            ).rowcount
+            self._conn.commit()
+        return bool(updated)
+
+    def _finish(self, job_id: str, status: str, **fields) -> bool:
+        """Record a final status and remove the spooled upload; False if the conditions did not hold"""
+        if not self._update(job_id, status=status, **fields):
+            return False
+        with self._db_lock:
+            row = self._conn.execute("SELECT file_path FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row and os.path.isdir(row[0]):
+            shutil.rmtree(row[0], ignore_errors=True)
+        elif row and os.path.exists(row[0]):
+            os.remove(row[0])
+        return True
+
+    @staticmethod
+    def _row_to_job(row) -> Dict:
+        job_id, organization_id, pdf_filename, status, progress, result, error, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "organization_id": organization_id,
+            "pdf_filename": pdf_filename,
+            "status": status,
+            "progress": json.loads(progress) if progress else None,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
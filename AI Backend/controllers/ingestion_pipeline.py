@@ -0,0 +1,433 @@
+import asyncio
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+from pypdf import PdfReader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from controllers.document_manifest import diff_manifests
+
+# Pipeline tuning — every stage is bounded so a 500-page manual never sits in memory at once
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_EXTRACT_PAGE_BATCH = int(os.getenv("PDF_EXTRACT_PAGE_BATCH", "16"))
+# Each embed batch is fanned out by EmbeddingBatcher into concurrent provider-sized requests
+PDF_EMBED_BATCH_SIZE = int(os.getenv("PDF_EMBED_BATCH_SIZE", "400"))
+PDF_UPSERT_BATCH_SIZE = int(os.getenv("PDF_UPSERT_BATCH_SIZE", "100"))
+PDF_PIPELINE_QUEUE_SIZE = int(os.getenv("PDF_PIPELINE_QUEUE_SIZE", "4"))
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    """Lazily create the shared page-extraction process pool (None when disabled)"""
+    global _extraction_pool
+    if PDF_EXTRACT_WORKERS <= 0:
+        return None
+    if _extraction_pool is None:
+        _extraction_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+    return _extraction_pool
+
+
+def count_pdf_pages(pdf_file_path: str) -> int:
+    """Return the number of pages in a PDF (runs inside the extraction pool)"""
+    return len(PdfReader(pdf_file_path).pages)
+
+
+def extract_page_range(pdf_file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) — top-level so worker processes can unpickle it"""
+    reader = PdfReader(pdf_file_path)
+    return [(reader.pages[i].extract_text() or "") + "\n" for i in range(start, end)]
+
+
+async def iter_pdf_pages(pdf_file_path: str, total_pages: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Yield page texts in order while later page ranges are extracted in parallel
+
+    At most two page batches per worker are in flight, so extraction never runs
+    far ahead of the consumer.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    if total_pages is None:
+        total_pages = await loop.run_in_executor(pool, count_pdf_pages, pdf_file_path)
+    max_pending = max(1, PDF_EXTRACT_WORKERS) * 2
+
+    pending = deque()
+    next_page = 0
+    try:
+        while next_page < total_pages or pending:
+            while next_page < total_pages and len(pending) < max_pending:
+                end = min(next_page + PDF_EXTRACT_PAGE_BATCH, total_pages)
+                pending.append(
+                    loop.run_in_executor(pool, extract_page_range, pdf_file_path, next_page, end)
+                )
+                next_page = end
+            for page_text in await pending.popleft():
+                yield page_text
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class StreamingChunker:
+    """
+    Incremental wrapper around RecursiveCharacterTextSplitter
+
+    Text is buffered until it exceeds a flush threshold, split, and every chunk
+    except the last is emitted. The last chunk is carried over so chunks never
+    end at an arbitrary buffer boundary and overlap is preserved across flushes.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                 flush_threshold: Optional[int] = None):
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+        self.flush_threshold = flush_threshold or chunk_size * 8
+        self._parts: List[str] = []
+        self._buffered = 0
+
+    def feed(self, text: str) -> List[str]:
+        """Add text and return any chunks that are now final"""
+        self._parts.append(text)
+        self._buffered += len(text)
+        if self._buffered < self.flush_threshold:
+            return []
+        return self._drain(final=False)
+
+    def flush(self) -> List[str]:
+        """Return the remaining chunks at end of document"""
+        return self._drain(final=True)
+
+    def _drain(self, final: bool) -> List[str]:
+        text = "".join(self._parts)
+        self._parts = []
+        self._buffered = 0
+        if not text.strip():
+            return []
+
+        pieces = self.splitter.split_text(text)
+        if final:
+            return pieces
+        if len(pieces) <= 1:
+            self._parts = [text]
+            self._buffered = len(text)
+            return []
+
+        # Carry the trailing chunk (and anything after it) into the next round
+        tail = pieces[-1]
+        tail_start = text.rfind(tail)
+        carry = text[tail_start:] if tail_start >= 0 else tail
+        self._parts = [carry]
+        self._buffered = len(carry)
+        return pieces[:-1]
+
+
+class IngestionDocument:
+    """Identity and running counters for one PDF flowing through the pipeline"""
+
+    def __init__(self, pdf_file_path: str, organization_id: str, pdf_filename: str,
+                 incremental: bool = True):
+        self.pdf_file_path = pdf_file_path
+        self.organization_id = organization_id
+        self.pdf_filename = pdf_filename
+        self.namespace = f"org_{organization_id}"
+        self.incremental = incremental
+        self.stage = "queued"
+        self.error: Optional[str] = None
+        self.total_pages = 0
+        self.pages_extracted = 0
+        self.chunks_processed = 0
+        self.chunks_embedded = 0
+        self.vectors_stored = 0
+        self.vectors_deleted = 0
+        # Ordered chunk vector IDs of this revision, the previous manifest, and IDs written so far
+        self.chunk_ids: List[str] = []
+        self.previous_ids: List[str] = []
+        self.previous_id_set: set = set()
+        self.written_ids: List[str] = []
+        self._occurrences: Dict[str, int] = {}
+
+    def progress(self) -> Dict:
+        """Stage-level counters, safe to read while the pipeline is running"""
+        return {
+            "stage": self.stage,
+            "total_pages": self.total_pages,
+            "pages_extracted": self.pages_extracted,
+            "chunks_processed": self.chunks_processed,
+            "chunks_embedded": self.chunks_embedded,
+            "vectors_stored": self.vectors_stored,
+            "vectors_deleted": self.vectors_deleted,
+        }
+
+    def next_vector_id(self, text: str) -> str:
+        """Content-addressed vector ID; repeated identical chunks get an occurrence suffix"""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        seen = self._occurrences.get(digest, 0)
+        self._occurrences[digest] = seen + 1
+        suffix = f"{digest}_{seen}" if seen else digest
+        return f"{self.organization_id}_{self.pdf_filename}_{suffix}"
+
+
+_DONE = object()
+
+
+class PDFIngestionPipeline:
+    """
+    Staged PDF ingestion: page extraction -> chunking -> embedding -> upsert
+
+    Stages run as concurrent tasks joined by bounded queues, so extraction of
+    later pages overlaps with embedding and upserting earlier chunks. Only one
+    batch per queue slot is ever held in memory.
+
+    Several documents can share one run: their pages are extracted concurrently
+    and their chunks are coalesced into the same embedding and upsert batches.
+
+    Each document keeps a manifest of its chunk vector IDs. In incremental mode
+    chunks already present in the previous manifest skip embedding and upsert,
+    and vectors that vanished from the new revision are deleted at the end.
+    """
+
+    def __init__(self, processor):
+        # processor is the PDFProcessingController that owns embeddings and storage
+        self.processor = processor
+        self._document_locks: Dict[tuple, asyncio.Lock] = {}
+
+    async def run(self, document: IngestionDocument) -> dict:
+        """Ingest a single PDF and return its stage counters"""
+        result = (await self.run_many([document]))[0]
+        if document.error:
+            raise Exception(document.error)
+        return result
+
+    async def run_many(self, documents: List[IngestionDocument]) -> List[dict]:
+        """
+        Ingest documents of one organization through shared batches
+
+        A failure in one document (unreadable PDF, no text) is recorded on that
+        document and does not stop the others. Returns one result per document.
+        """
+        if len({document.namespace for document in documents}) > 1:
+            raise ValueError("All documents in one ingestion run must belong to the same organization")
+
+        seen = set()
+        for document in documents:
+            if document.pdf_filename in seen:
+                document.error = "Duplicate filename in this upload"
+            seen.add(document.pdf_filename)
+        active = [document for document in documents if document.error is None]
+
+        locks = [
+            self._document_locks.setdefault((document.namespace, document.pdf_filename), asyncio.Lock())
+            for document in sorted(active, key=lambda d: d.pdf_filename)
+        ]
+        for lock in locks:
+            await lock.acquire()
+        try:
+            await self._run_locked(active)
+        finally:
+            for lock in locks:
+                lock.release()
+
+        return [self._document_result(document) for document in documents]
+
+    async def _run_locked(self, documents: List[IngestionDocument]):
+        manifest_store = self.processor.manifest_store
+        for document in documents:
+            document.stage = "processing"
+            previous_ids = await asyncio.to_thread(
+                manifest_store.get, document.namespace, document.pdf_filename
+            )
+            if previous_ids is None:
+                # First manifest for this document: clear vectors written by the old positional ID scheme
+                previous_ids = []
+                await asyncio.to_thread(
+                    self.processor.delete_legacy_vectors, document.organization_id, document.pdf_filename
+                )
+            document.previous_ids = previous_ids
+            document.previous_id_set = set(previous_ids)
+
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=PDF_PIPELINE_QUEUE_SIZE)
+        upsert_queue: asyncio.Queue = asyncio.Queue(maxsize=PDF_PIPELINE_QUEUE_SIZE)
+        by_filename = {document.pdf_filename: document for document in documents}
+
+        tasks = [
+            asyncio.create_task(self._produce_chunks(documents, embed_queue)),
+            asyncio.create_task(self._embed_batches(by_filename, embed_queue, upsert_queue)),
+            asyncio.create_task(self._upsert_batches(by_filename, upsert_queue)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for document in documents:
+                if document.error is None:
+                    document.error = str(e) or type(e).__name__
+            await self._discard_written(documents)
+            raise
+
+        for document in documents:
+            if document.error is None and document.chunks_processed == 0:
+                document.error = "No text content found in PDF"
+            if document.error is None:
+                await self._finalize(document)
+        await self._discard_written([d for d in documents if d.error is not None])
+
+    async def _finalize(self, document: IngestionDocument):
+        """Delete vanished vectors and save the new manifest"""
+        document.stage = "finalizing"
+        current_ids = set(document.chunk_ids)
+        vanished = [vector_id for vector_id in document.previous_ids if vector_id not in current_ids]
+        if vanished:
+            await asyncio.to_thread(
+                self.processor.delete_from_pinecone, vanished, document.organization_id
+            )
+            document.vectors_deleted = len(vanished)
+
+        await asyncio.to_thread(
+            self.processor.manifest_store.save,
+            document.namespace, document.pdf_filename, document.chunk_ids
+        )
+        document.stage = "completed"
+
+    async def _discard_written(self, documents: List[IngestionDocument]):
+        """Remove vectors a failed document wrote that its old manifest does not reference"""
+        for document in documents:
+            document.stage = "failed"
+            orphans = [vector_id for vector_id in document.written_ids
+                       if vector_id not in document.previous_id_set]
+            if orphans:
+                try:
+                    await asyncio.to_thread(
+                        self.processor.delete_from_pinecone, orphans, document.organization_id
+                    )
+                except Exception as e:
+                    print(f"Could not remove partial vectors of {document.pdf_filename}: {e}")
+
+    @staticmethod
+    def _document_result(document: IngestionDocument) -> dict:
+        result = {
+            "pdf_filename": document.pdf_filename,
+            "status": "failed" if document.error else "success",
+            "pages_extracted": document.pages_extracted,
+            "chunks_processed": document.chunks_processed,
+            "vectors_stored": document.vectors_stored,
+            "vectors_deleted": document.vectors_deleted,
+            "namespace": document.namespace,
+        }
+        if document.error:
+            result["error"] = document.error
+        else:
+            reindex = diff_manifests(document.previous_ids, document.chunk_ids)
+            reindex["mode"] = "incremental" if document.incremental else "full"
+            result["reindex"] = reindex
+        return result
+
+    async def _produce_chunks(self, documents: List[IngestionDocument], embed_queue: asyncio.Queue):
+        batch: List[Document] = []
+        # Extract several documents at once; each keeps its own page batches in flight
+        semaphore = asyncio.Semaphore(max(1, PDF_EXTRACT_WORKERS))
+
+        async def emit(document: IngestionDocument, texts: List[str]):
+            nonlocal batch
+            for text in texts:
+                chunk_index = document.chunks_processed
+                vector_id = document.next_vector_id(text)
+                document.chunk_ids.append(vector_id)
+                document.chunks_processed += 1
+                if document.incremental and vector_id in document.previous_id_set:
+                    continue
+                batch.append(Document(
+                    page_content=text,
+                    metadata={
+                        "chunk_index": chunk_index,
+                        "vector_id": vector_id,
+                        "pdf_filename": document.pdf_filename,
+                    }
+                ))
+                if len(batch) >= PDF_EMBED_BATCH_SIZE:
+                    full, batch = batch, []
+                    await embed_queue.put(full)
+
+        async def produce(document: IngestionDocument):
+            async with semaphore:
+                try:
+                    chunker = StreamingChunker()
+                    document.total_pages = await asyncio.get_running_loop().run_in_executor(
+                        get_extraction_pool(), count_pdf_pages, document.pdf_file_path
+                    )
+                    async for page_text in iter_pdf_pages(document.pdf_file_path, document.total_pages):
+                        document.pages_extracted += 1
+                        await emit(document, chunker.feed(page_text))
+                    await emit(document, chunker.flush())
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    document.error = f"Error extracting text from PDF: {str(e)}"
+
+        await asyncio.gather(*[produce(document) for document in documents])
+
+        if batch:
+            await embed_queue.put(batch)
+        await embed_queue.put(_DONE)
+
+    async def _embed_batches(self, by_filename: Dict[str, IngestionDocument],
+                             embed_queue: asyncio.Queue, upsert_queue: asyncio.Queue):
+        while True:
+            item = await embed_queue.get()
+            if item is _DONE:
+                await upsert_queue.put(_DONE)
+                return
+            embeddings = await asyncio.to_thread(self.processor.generate_embeddings, item)
+            for chunk in item:
+                by_filename[chunk.metadata["pdf_filename"]].chunks_embedded += 1
+            await upsert_queue.put((item, embeddings))
+
+    async def _upsert_batches(self, by_filename: Dict[str, IngestionDocument],
+                              upsert_queue: asyncio.Queue):
+        pending_chunks: List[Document] = []
+        pending_embeddings: List[List[float]] = []
+
+        while True:
+            item = await upsert_queue.get()
+            if item is _DONE:
+                break
+            chunks, embeddings = item
+            pending_chunks.extend(chunks)
+            pending_embeddings.extend(embeddings)
+            while len(pending_chunks) >= PDF_UPSERT_BATCH_SIZE:
+                await self._store(
+                    by_filename,
+                    pending_chunks[:PDF_UPSERT_BATCH_SIZE],
+                    pending_embeddings[:PDF_UPSERT_BATCH_SIZE],
+                )
+                pending_chunks = pending_chunks[PDF_UPSERT_BATCH_SIZE:]
+                pending_embeddings = pending_embeddings[PDF_UPSERT_BATCH_SIZE:]
+
+        if pending_chunks:
+            await self._store(by_filename, pending_chunks, pending_embeddings)
+
+    async def _store(self, by_filename: Dict[str, IngestionDocument], chunks: List[Document],
+                     embeddings: List[List[float]]):
+        # One upsert may mix documents; each chunk carries its own filename and vector ID
+        first = by_filename[chunks[0].metadata["pdf_filename"]]
+        await asyncio.to_thread(
+            self.processor.store_in_pinecone,
+            chunks,
+            embeddings,
+            first.organization_id,
+            first.pdf_filename,
+        )
+        for chunk in chunks:
+            document = by_filename[chunk.metadata["pdf_filename"]]
+            document.vectors_stored += 1
+            document.written_ids.append(chunk.metadata["vector_id"])
@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+import numpy as np
+
+
+# Phrases that make up a purely conversational message, by intent
+CONVERSATIONAL_PHRASES = {
+    "greeting": [
+        "hi", "hello", "hey", "hiya", "howdy", "greetings", "good morning", "good afternoon",
+        "good evening", "hi there", "hello there", "hey there",
+    ],
+    "farewell": [
+        "bye", "goodbye", "bye bye", "see you", "see ya", "see you later", "good night", "take care",
+        "have a nice day", "have a good day", "have a great day", "talk to you later",
+    ],
+    "thanks": [
+        "thanks", "thank you", "thx", "ty", "many thanks", "thanks a lot", "thank you so much",
+        "thank you very much", "cheers", "much appreciated", "appreciate it", "i appreciate it",
+    ],
+    "smalltalk": [
+        "how are you", "how are you doing", "how is it going", "hows it going", "whats up",
+        "who are you", "are you a bot", "are you human", "what is your name", "whats your name",
+        "nice to meet you",
+    ],
+}
+
+# Words allowed around the phrases above without turning the message into a question
+FILLER_WORDS = {
+    "ok", "okay", "great", "cool", "awesome", "perfect", "nice", "so", "and", "again", "too",
+    "you", "all", "team", "everyone", "then", "now", "very", "much", "for", "the", "help", "oh",
+}
+
+# Short replies that usually continue the previous answer ("yes please") and need its context
+FOLLOW_UP_WORDS = {"yes", "yeah", "yep", "no", "nope", "sure", "please", "ok", "okay", "more", "that", "this", "it"}
+
+# Prototype sentences for the embedding fallback on short messages the rules miss
+CONVERSATIONAL_PROTOTYPES = [
+    "hello there, how are you today", "good morning to you", "hey, hope you are well",
+    "thanks a lot for your help", "thank you, that was helpful", "goodbye and have a nice day",
+    "see you later", "nice talking to you", "how is your day going", "you have been very helpful",
+]
+QUESTION_PROTOTYPES = [
+    "what is your refund policy", "how do I reset my password", "where is my order",
+    "I need help with my account", "can I change my subscription plan", "my payment failed",
+    "how long does shipping take", "I want to cancel my order", "what are your opening hours",
+    "the product I received is damaged",
+]
+
+CANNED_REPLIES = {
+    "greeting": "Hello! I'm the customer support assistant. How can I help you today?",
+    "farewell": "Thank you for reaching out! Have a great day, and feel free to come back anytime.",
+    "thanks": "You're very welcome! Is there anything else I can help you with?",
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9\s]+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_NON_WORD.sub("", text.lower().replace("'", "")).split())
+
+
+class IntentGate:
+    """
+    Decides whether a chat message needs knowledge-base retrieval
+
+    Messages made only of greetings, farewells, thanks and small-talk phrases
+    (plus filler words) are matched by rules. Other short messages without
+    digits are compared against conversational and support-question
+    prototypes with the all-MiniLM-L6-v2 embedder, when one is supplied.
+    Anything else, and anything uncertain, is retrieved as before.
+
+    Rule-matched greetings, farewells and thanks can be answered with a canned
+    reply (CHAT_CANNED_REPLIES) so the turn skips the LLM as well.
+    """
+
+    def __init__(self, embedder=None):
+        self.embedder = embedder
+        self.enabled = os.getenv("CHAT_INTENT_GATE", "true").lower() == "true"
+        self.canned_replies = os.getenv("CHAT_CANNED_REPLIES", "false").lower() == "true"
+        self.max_words = int(os.getenv("CHAT_INTENT_MAX_WORDS", "6"))
+        self.threshold = float(os.getenv("CHAT_INTENT_THRESHOLD", "0.6"))
+        self.margin = float(os.getenv("CHAT_INTENT_MARGIN", "0.1"))
+
+        self._phrases = {
+            tuple(phrase.split()): intent
+            for intent, phrases in CONVERSATIONAL_PHRASES.items()
+            for phrase in phrases
+        }
+        self._longest_phrase = max(len(words) for words in self._phrases)
+        self._prototypes = None
+        self._lock = threading.Lock()
+        self._intents = Counter()
+        self._stats = {"classified": 0, "skipped_retrievals": 0, "canned_replies": 0,
+                       "rule_matches": 0, "embedding_matches": 0, "classify_seconds": 0.0}
+        self._retrievals = 0
+        self._retrieval_seconds = 0.0
+
+    def classify(self, text: str) -> Dict:
+        """
+        Return {"intent", "retrieve", "canned", "method"} for a message
+
+        intent is "greeting", "farewell", "thanks", "smalltalk" or "question".
+        """
+        started = time.perf_counter()
+        decision = {"intent": "question", "retrieve": True, "canned": None, "method": "default"}
+        if self.enabled:
+            words = normalize(text).split()
+            intent = self._match_rules(words)
+            if intent is not None:
+                decision = {"intent": intent, "retrieve": False, "method": "rule",
+                            "canned": CANNED_REPLIES.get(intent) if self.canned_replies else None}
+            elif self._embedding_candidate(words) and self._is_conversational(" ".join(words)):
+                decision = {"intent": "smalltalk", "retrieve": False, "canned": None, "method": "embedding"}
+
+        with self._lock:
+            self._stats["classified"] += 1
+            self._stats["classify_seconds"] += time.perf_counter() - started
+            self._intents[decision["intent"]] += 1
+            if not decision["retrieve"]:
+                self._stats["skipped_retrievals"] += 1
+                self._stats[f"{decision['method']}_matches"] += 1
+            if decision["canned"]:
+                self._stats["canned_replies"] += 1
+        return decision
+
+    def uses_embedding(self, text: str) -> bool:
+        """Whether classify(text) would fall through the rules to the (CPU-bound) embedding check"""
+        if not self.enabled:
+            return False
+        words = normalize(text).split()
+        return self._match_rules(words) is None and self._embedding_candidate(words)
+
+    def _match_rules(self, words: List[str]) -> Optional[str]:
+        """Intent of a message made only of conversational phrases and fillers, else None"""
+        found = set()
+        i = 0
+        while i < len(words):
+            for size in range(min(self._longest_phrase, len(words) - i), 0, -1):
+                intent = self._phrases.get(tuple(words[i:i + size]))
+                if intent is not None:
+                    found.add(intent)
+                    i += size
+                    break
+            else:
+                if words[i] not in FILLER_WORDS:
+                    return None
+                i += 1
+        if not found:
+            return None
+        for intent in ("farewell", "thanks", "smalltalk", "greeting"):
+            if intent in found:
+                return intent
+
+    def _embedding_candidate(self, words: List[str]) -> bool:
+        # Order numbers, amounts and dates always go to retrieval
+        return (self.embedder is not None and 0 < len(words) <= self.max_words
+                and not any(char.isdigit() for word in words for char in word)
+                and not FOLLOW_UP_WORDS.intersection(words))
+
+    def _is_conversational(self, text: str) -> bool:
+        if self._prototypes is None:
+            conversational = self.embedder.encode(CONVERSATIONAL_PROTOTYPES, normalize_embeddings=True)
+            questions = self.embedder.encode(QUESTION_PROTOTYPES, normalize_embeddings=True)
+            self._prototypes = (np.asarray(conversational), np.asarray(questions))
+        conversational, questions = self._prototypes
+        vector = np.asarray(self.embedder.encode([text], normalize_embeddings=True))[0]
+        best_conversational = float(np.max(conversational @ vector))
+        best_question = float(np.max(questions @ vector))
+        return best_conversational >= self.threshold and best_conversational - best_question >= self.margin
+
+    def record_retrieval(self, seconds: float):
+        """Time a retrieval that did run, to estimate what the skipped ones saved"""
+        with self._lock:
+            self._retrievals += 1
+            self._retrieval_seconds += seconds
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            average_retrieval = self._retrieval_seconds / self._retrievals if self._retrievals else 0.0
+            return dict(
+                self._stats,
+                enabled=self.enabled,
+                canned_replies_enabled=self.canned_replies,
+                embedding_fallback=self.embedder is not None,
+                intents=dict(self._intents),
+                retrievals=self._retrievals,
+                average_retrieval_seconds=round(average_retrieval, 4),
+                # Each skipped retrieval saves one query embedding call and one vector search
+                estimated_seconds_saved=round(average_retrieval * self._stats["skipped_retrievals"], 2),
+                classify_seconds=round(self._stats["classify_seconds"], 4),
+            )
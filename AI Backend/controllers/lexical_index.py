@@ -0,0 +1,225 @@
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List
+from controllers.storage_paths import data_path
+
+# Compound tokens such as "ord-10293", "sku_4471" or "v2.1" are kept whole and
+# also split into their parts, so both the exact code and its pieces match
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./#][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z0-9]+")
+# An ID needs a digit plus a letter or separator, so bare years and amounts ("2024", "100") are not IDs
+_ID_TOKEN_RE = re.compile(r"^(?=.*\d)(?=.*[a-z\-_./#])[a-z0-9][a-z0-9\-_./#]{3,}$")
+
+# Function words carry no topical signal; indexing them lets chit-chat match arbitrary chunks
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further
+had has have having he her here hers herself him himself his how i if in into is it its itself
+just like me more most my myself no nor not now of off on once only or other our ours ourselves
+out over own same she should so some such than that the their theirs them themselves then there
+these they this those through to today too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        tokens.append(token)
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part not in STOP_WORDS)
+    return tokens
+
+
+def id_terms(query: str) -> List[str]:
+    """Order numbers, SKUs or policy codes in a short (1-3 word) query; empty otherwise"""
+    words = query.lower().split()
+    if not 0 < len(words) <= 3:
+        return []
+    return [
+        token for word in words for token in _TOKEN_RE.findall(word)
+        if _ID_TOKEN_RE.match(token)
+    ]
+
+
+class _NamespaceIndex:
+    """In-memory postings for one namespace"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.terms: Dict[str, List[str]] = {}
+        self.metadata: Dict[str, dict] = {}
+        self.total_length = 0
+
+    def add(self, vector_id: str, term_counts: Dict[str, int], length: int, metadata: dict):
+        self.remove(vector_id)
+        for term, count in term_counts.items():
+            self.postings.setdefault(term, {})[vector_id] = count
+        self.lengths[vector_id] = length
+        self.terms[vector_id] = list(term_counts)
+        self.metadata[vector_id] = metadata
+        self.total_length += length
+
+    def remove(self, vector_id: str) -> bool:
+        if vector_id not in self.metadata:
+            return False
+        del self.metadata[vector_id]
+        self.total_length -= self.lengths.pop(vector_id)
+        for term in self.terms.pop(vector_id):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(vector_id, None)
+                if not docs:
+                    del self.postings[term]
+        return True
+
+
+class LexicalIndex:
+    """
+    Per-organization BM25 inverted index over the same chunks stored as vectors
+
+    Chunks are indexed by vector ID whenever they are upserted and dropped when
+    their vectors are deleted, so the lexical and dense indexes always describe
+    the same corpus. Term counts are persisted in SQLite and loaded into
+    in-memory postings the first time a namespace is searched.
+    """
+
+    def __init__(self):
+        self.k1 = float(os.getenv("BM25_K1", "1.2"))
+        self.b = float(os.getenv("BM25_B", "0.75"))
+        self.rare_term_fraction = float(os.getenv("BM25_RARE_TERM_FRACTION", "0.05"))
+        self.path = os.getenv("LEXICAL_INDEX_PATH") or data_path("lexical_index.sqlite3")
+        self._lock = threading.Lock()
+        self._namespaces: Dict[str, _NamespaceIndex] = {}
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " namespace TEXT NOT NULL,"
+            " vector_id TEXT NOT NULL,"
+            " terms TEXT NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " PRIMARY KEY (namespace, vector_id))"
+        )
+        self._conn.commit()
+
+    def _load_locked(self, namespace: str) -> _NamespaceIndex:
+        index = self._namespaces.get(namespace)
+        if index is None:
+            index = _NamespaceIndex()
+            rows = self._conn.execute(
+                "SELECT vector_id, terms, length, metadata FROM chunks WHERE namespace = ?", (namespace,)
+            )
+            for vector_id, terms, length, metadata in rows:
+                index.add(vector_id, json.loads(terms), length, json.loads(metadata))
+            self._namespaces[namespace] = index
+        return index
+
+    def add(self, namespace: str, entries: List[Dict]):
+        """Index chunks given as {"id", "text", "metadata"} dicts, replacing existing IDs"""
+        rows = []
+        with self._lock:
+            index = self._load_locked(namespace)
+            for entry in entries:
+                tokens = tokenize(entry["text"])
+                term_counts = dict(Counter(tokens))
+                index.add(entry["id"], term_counts, len(tokens), entry["metadata"])
+                rows.append((
+                    namespace, entry["id"], json.dumps(term_counts, separators=(",", ":")),
+                    len(tokens), json.dumps(entry["metadata"])
+                ))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (namespace, vector_id, terms, length, metadata)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def remove(self, namespace: str, vector_ids: List[str]):
+        with self._lock:
+            index = self._load_locked(namespace)
+            for vector_id in vector_ids:
+                index.remove(vector_id)
+            self._conn.executemany(
+                "DELETE FROM chunks WHERE namespace = ? AND vector_id = ?",
+                [(namespace, vector_id) for vector_id in vector_ids]
+            )
+            self._conn.commit()
+
+    def search(self, namespace: str, query: str, top_k: int,
+               required_terms: List[str] = None) -> List[Dict]:
+        """
+        Return the top_k chunks by BM25 score as {"id", "score", "normalized_score", "metadata"} dicts
+
+        normalized_score divides the BM25 score by the best score any chunk
+        could reach for this query (every term, saturated term frequency), so
+        it lies in [0, 1] and can be compared against a relevance floor.
+
+        When the query has selective terms (found in at most RARE_TERM_FRACTION
+        of chunks), only chunks containing one of them are scored, so codes and
+        IDs never walk the postings of ubiquitous words. With required_terms,
+        only chunks containing at least one of those exact terms are returned.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            index = self._load_locked(namespace)
+            doc_count = len(index.lengths)
+            if not terms or doc_count == 0:
+                return []
+            avg_length = index.total_length / doc_count or 1.0
+
+            postings = [index.postings[term] for term in terms if term in index.postings]
+            rare_limit = max(1, int(doc_count * self.rare_term_fraction))
+            if required_terms:
+                rare = [index.postings[term] for term in required_terms if term in index.postings]
+                if not rare:
+                    return []
+            else:
+                rare = [docs for docs in postings if len(docs) <= rare_limit]
+            candidates = set().union(*rare) if rare else None
+
+            # Terms missing from the index still count towards the maximum
+            max_score = sum(
+                self._idf(doc_count, len(index.postings.get(term, ()))) * (self.k1 + 1) for term in terms
+            )
+            scores: Dict[str, float] = {}
+            for docs in postings:
+                idf = self._idf(doc_count, len(docs))
+                if candidates is None:
+                    matched = docs.items()
+                else:
+                    matched = ((vector_id, docs[vector_id]) for vector_id in candidates if vector_id in docs)
+                for vector_id, tf in matched:
+                    norm = self.k1 * (1 - self.b + self.b * index.lengths[vector_id] / avg_length)
+                    scores[vector_id] = scores.get(vector_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [
+                {"id": vector_id, "score": score, "normalized_score": score / max_score,
+                 "metadata": index.metadata[vector_id]}
+                for vector_id, score in best
+            ]
+
+    @staticmethod
+    def _idf(doc_count: int, doc_freq: int) -> float:
+        return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> Dict[str, float]:
+    """Fuse ranked ID lists: each list contributes 1 / (k + rank) per ID"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, vector_id in enumerate(ranking, 1):
+            fused[vector_id] = fused.get(vector_id, 0.0) + 1.0 / (k + rank)
+    return fused
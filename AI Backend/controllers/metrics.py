@@ -0,0 +1,47 @@
+import threading
+from typing import Dict, Sequence
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram with fixed millisecond buckets
+
+    Buckets are not cumulative: an observation is counted once, in the first
+    bucket whose bound it does not exceed, so "<=50ms" holds only those above
+    the previous bound (25ms). Observations beyond the last bound go to "+Inf".
+    """
+
+    DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(sorted(buckets_ms))
+        self._counts = [0] * (len(self.buckets_ms) + 1)
+        self._count = 0
+        self._sum_ms = 0.0
+        self._max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """Record one observation given in seconds"""
+        ms = seconds * 1000.0
+        with self._lock:
+            self._count += 1
+            self._sum_ms += ms
+            self._max_ms = max(self._max_ms, ms)
+            for i, bound in enumerate(self.buckets_ms):
+                if ms <= bound:
+                    self._counts[i] += 1
+                    return
+            self._counts[-1] += 1
+
+    def snapshot(self) -> Dict:
+        """Return bucket counts and summary statistics"""
+        with self._lock:
+            buckets = {f"<={bound}ms": count for bound, count in zip(self.buckets_ms, self._counts)}
+            buckets["+Inf"] = self._counts[-1]
+            return {
+                "count": self._count,
+                "avg_ms": round(self._sum_ms / self._count, 2) if self._count else 0.0,
+                "max_ms": round(self._max_ms, 2),
+                "buckets": buckets,
+            }
@@ -0,0 +1,90 @@
+import os
+from typing import Callable, Dict, List
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token), same heuristic as the embedding batcher
+
+    This is not the model's tokenizer: it undercounts for code, numbers and
+    non-English text, so budgets built on it keep a safety margin.
+    """
+    return max(1, len(text) // 4)
+
+
+class PromptAssembler:
+    """
+    Fits retrieved documents and conversation history into a prompt token budget
+
+    Sizes are count_tokens estimates, so only (1 - CHAT_PROMPT_TOKEN_MARGIN)
+    of CHAT_PROMPT_TOKEN_BUDGET is filled; the rest absorbs estimation error.
+
+    The system instructions, running summary and current query are always
+    included. The most recent CHAT_PROMPT_MIN_RECENT_MESSAGES history messages
+    come next, then documents in rank order (capped at CHAT_PROMPT_DOCUMENT_SHARE
+    of what is left unless older history needs less), then older history from
+    newest to oldest until the budget runs out.
+    """
+
+    def __init__(self):
+        self.token_budget = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "4000"))
+        self.token_margin = float(os.getenv("CHAT_PROMPT_TOKEN_MARGIN", "0.2"))
+        self.document_share = float(os.getenv("CHAT_PROMPT_DOCUMENT_SHARE", "0.6"))
+        self.min_recent_messages = int(os.getenv("CHAT_PROMPT_MIN_RECENT_MESSAGES", "2"))
+
+    def fit(self, system_text: str, summary: str, query: str, documents: List[Dict],
+            history: List[Dict], render_document: Callable[[int, Dict], str]) -> Dict:
+        """
+        Select what goes into the prompt
+
+        Returns the chosen documents (rendered) and history messages plus a
+        per-section token report.
+        """
+        tokens = {
+            "system": count_tokens(system_text),
+            "summary": count_tokens(summary) if summary else 0,
+            "query": count_tokens(query),
+            "documents": 0,
+            "history": 0,
+        }
+        usable_budget = int(self.token_budget * (1 - self.token_margin))
+        remaining = usable_budget - tokens["system"] - tokens["summary"] - tokens["query"]
+
+        history_tokens = [count_tokens(message["content"]) for message in history]
+        kept_from = len(history)
+
+        def take_history(limit_index: int):
+            nonlocal kept_from, remaining
+            while kept_from > limit_index and history_tokens[kept_from - 1] <= remaining:
+                kept_from -= 1
+                remaining -= history_tokens[kept_from]
+                tokens["history"] += history_tokens[kept_from]
+
+        take_history(max(0, len(history) - self.min_recent_messages))
+
+        older_need = sum(history_tokens[:kept_from])
+        document_limit = max(int(remaining * self.document_share), remaining - older_need)
+        rendered = []
+        for doc in documents:
+            text = render_document(len(rendered) + 1, doc)
+            cost = count_tokens(text)
+            if tokens["documents"] + cost > document_limit:
+                break
+            rendered.append(text)
+            tokens["documents"] += cost
+        remaining -= tokens["documents"]
+
+        if kept_from == len(history) - min(self.min_recent_messages, len(history)):
+            take_history(0)
+
+        tokens["total"] = sum(tokens.values())
+        tokens["budget"] = self.token_budget
+        tokens["usable_budget"] = usable_budget
+        tokens["estimated"] = True
+        return {
+            "documents": rendered,
+            "history": history[kept_from:],
+            "tokens": tokens,
+            "documents_used": len(rendered),
+            "history_messages_used": len(history) - kept_from,
+        }
@@ -1,13 +1,25 @@
+import asyncio
 import os
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from google import genai
-from google.genai.types import HttpOptions, EmbedContentConfig
-from pinecone import Pinecone
+from google.genai.types import HttpOptions
 from dotenv import load_dotenv
+from controllers.ingestion_pipeline import PDFIngestionPipeline, IngestionDocument
+from controllers.embedding_batcher import EmbeddingBatcher
+from controllers.embedding_cache import EmbeddingCache
+from controllers.retrieval_cache import QueryEmbeddingCache, SemanticResultCache
+from controllers.document_manifest import DocumentManifestStore
+from controllers.vector_store import create_vector_store
+from controllers.lexical_index import LexicalIndex, id_terms, reciprocal_rank_fusion
+from controllers.reranker import create_reranker
+
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
 
 # Load environment variables
 load_dotenv()
@@ -26,15 +38,46 @@ class PDFProcessingController:
         self.embedding_model = os.getenv("GEMINI_EMBEDDING_MODEL", "models/gemini-embedding-001")
         self.embedding_dimension = int(os.getenv("EMBEDDING_DIMENSION", "768"))
         
-        # Initialize Pinecone
-        self.pc = Pinecone(api_key=self.pinecone_api_key)
-        self.index = self.pc.Index(name=self.pinecone_index_name, host=self.pinecone_host)
+        # Vector index: hosted Pinecone or the local NumPy store (VECTOR_STORE_BACKEND)
+        self.index = create_vector_store(
+            self.pinecone_api_key, self.pinecone_index_name, self.pinecone_host
+        )
         
         # Initialize google-genai client with api_version='v1beta'
         self.genai_client = genai.Client(
             api_key=self.google_api_key,
             http_options=HttpOptions(api_version="v1beta")
         )
+        
+        # Batched, concurrency-limited embedding client shared by ingestion and retrieval
+        self.embedding_batcher = EmbeddingBatcher(
+            self.genai_client, self.embedding_model, self.embedding_dimension
+        )
+        
+        # Persistent content-addressed cache so unchanged chunks are never re-embedded
+        self.embedding_cache = EmbeddingCache(self.embedding_model, self.embedding_dimension)
+        
+        # Hot-question caches for retrieve_documents: query text -> embedding, embedding -> results
+        self.query_embedding_cache = QueryEmbeddingCache()
+        self.result_cache = SemanticResultCache()
+        
+        # BM25 index over the same chunks, for exact matches on order numbers, SKUs and codes
+        self.lexical_index = LexicalIndex()
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "dense").lower()
+        # Relevance floor for BM25-only hits (normalized BM25 score, 0-1)
+        self.lexical_score_threshold = float(os.getenv("LEXICAL_SCORE_THRESHOLD", "0.2"))
+        self.retrieval_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RETRIEVAL_WORKERS", "8")), thread_name_prefix="retrieval"
+        )
+        
+        # Optional cross-encoder reranking of over-fetched candidates (RERANKER_ENABLED)
+        self.reranker = create_reranker()
+        
+        # Per-document chunk manifests used for incremental re-indexing, kept per vector index
+        self.manifest_store = DocumentManifestStore(self.index.location)
+        
+        # Staged extraction -> chunking -> embedding -> upsert pipeline used by process_pdf
+        self.ingestion_pipeline = PDFIngestionPipeline(self)
     
     def extract_text_from_pdf(self, pdf_file_path: str) -> str:
         """
@@ -42,10 +85,7 @@ class PDFProcessingController:
         """
         try:
             reader = PdfReader(pdf_file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+            return "".join((page.extract_text() or "") + "\n" for page in reader.pages)
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
     
@@ -79,31 +119,43 @@ class PDFProcessingController:
     def generate_embeddings(self, chunks: List[Document]) -> List[List[float]]:
         """
         Generate embeddings for text chunks using Gemini
+        
+        Chunks already in the embedding cache are served from it; only new text is sent to Gemini.
         """
         try:
             texts = [chunk.page_content for chunk in chunks]
-            result = self.genai_client.models.embed_content(
-                model=self.embedding_model,
-                contents=texts,
-                config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT", output_dimensionality=self.embedding_dimension)
-            )
-            return [list(e.values) for e in result.embeddings]
+            embeddings = self.embedding_cache.get_many(texts, "RETRIEVAL_DOCUMENT")
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            if missing:
+                missing_texts = [texts[i] for i in missing]
+                fresh = self.embedding_batcher.embed(missing_texts, "RETRIEVAL_DOCUMENT")
+                self.embedding_cache.put_many(missing_texts, fresh, "RETRIEVAL_DOCUMENT")
+                for i, embedding in zip(missing, fresh):
+                    embeddings[i] = embedding
+            return embeddings
         except Exception as e:
             raise Exception(f"Error generating embeddings: {str(e)}")
     
     def store_in_pinecone(self, chunks: List[Document], embeddings: List[List[float]], 
-                          organization_id: str, pdf_filename: str):
+                          organization_id: str, pdf_filename: str, start_index: int = 0):
         """
         Store embeddings in Pinecone with organization-based namespace
+        
+        Chunks carrying "vector_id"/"chunk_index"/"pdf_filename" metadata (set by the
+        ingestion pipeline, which may mix documents in one batch) keep those; otherwise
+        IDs are positional, offset by start_index.
         """
         try:
             vectors = []
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                vector_id = f"{organization_id}_{pdf_filename}_{i}"
+            lexical_entries = []
+            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings), start_index):
+                chunk_filename = chunk.metadata.get("pdf_filename", pdf_filename)
+                chunk_index = chunk.metadata.get("chunk_index", i)
+                vector_id = chunk.metadata.get("vector_id") or f"{organization_id}_{chunk_filename}_{i}"
                 metadata = {
                     "organization_id": organization_id,
-                    "pdf_filename": pdf_filename,
-                    "chunk_index": i,
+                    "pdf_filename": chunk_filename,
+                    "chunk_index": chunk_index,
                     "text": chunk.page_content[:1000]  # Store first 1000 chars of text
                 }
                 vectors.append({
@@ -111,10 +163,17 @@ class PDFProcessingController:
                     "values": embedding,
                     "metadata": metadata
                 })
+                lexical_entries.append({
+                    "id": vector_id,
+                    "text": chunk.page_content,
+                    "metadata": metadata
+                })
             
             # Upsert vectors to Pinecone with namespace
             namespace = f"org_{organization_id}"
             self.index.upsert(vectors=vectors, namespace=namespace)
+            self.lexical_index.add(namespace, lexical_entries)
+            self.result_cache.invalidate(namespace)
             
             return {
                 "vectors_stored": len(vectors),
@@ -123,47 +182,135 @@ class PDFProcessingController:
         except Exception as e:
             raise Exception(f"Error storing in Pinecone: {str(e)}")
     
-    async def process_pdf(self, pdf_file, organization_id: str):
+    def delete_from_pinecone(self, vector_ids: List[str], organization_id: str):
         """
-        Main method to process PDF: extract text, chunk, embed, and store in Pinecone
+        Delete vectors by ID from the organization's namespace
         """
-        temp_file_path = None
         try:
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                content = await pdf_file.read()
-                temp_file.write(content)
-                temp_file_path = temp_file.name
-            
-            # Extract text from PDF
-            text = self.extract_text_from_pdf(temp_file_path)
-            
-            if not text.strip():
-                raise Exception("No text content found in PDF")
-            
-            # Split text into chunks
-            chunks = self.split_text_into_chunks(text)
-            
-            # Generate embeddings
-            embeddings = self.generate_embeddings(chunks)
-            
-            # Store in Pinecone
-            storage_result = self.store_in_pinecone(
-                chunks, 
-                embeddings, 
-                organization_id, 
-                pdf_file.filename
-            )
-            
+            namespace = f"org_{organization_id}"
+            for start in range(0, len(vector_ids), 1000):
+                self.index.delete(ids=vector_ids[start:start + 1000], namespace=namespace)
+            self.lexical_index.remove(namespace, vector_ids)
+            self.result_cache.invalidate(namespace)
             return {
-                "status": "success",
-                "message": "PDF processed and stored successfully",
-                "pdf_filename": pdf_file.filename,
-                "organization_id": organization_id,
-                "chunks_processed": len(chunks),
-                "vectors_stored": storage_result["vectors_stored"],
-                "namespace": storage_result["namespace"]
+                "vectors_deleted": len(vector_ids),
+                "namespace": namespace
             }
+        except Exception as e:
+            raise Exception(f"Error deleting from Pinecone: {str(e)}")
+    
+    def delete_legacy_vectors(self, organization_id: str, pdf_filename: str):
+        """
+        Remove vectors stored under the old positional ID scheme ({org}_{file}_{i})
+        
+        Only IDs whose suffix is purely numeric are deleted, so other documents
+        sharing the filename prefix are left alone. Indexes that do not support
+        listing by prefix are skipped.
+        """
+        prefix = f"{organization_id}_{pdf_filename}_"
+        namespace = f"org_{organization_id}"
+        try:
+            legacy_ids = [
+                vector_id
+                for page in self.index.list(prefix=prefix, namespace=namespace)
+                for vector_id in page
+                if vector_id[len(prefix):].isdigit()
+            ]
+        except Exception as e:
+            print(f"Skipping legacy vector cleanup for {pdf_filename}: {e}")
+            return
+        if legacy_ids:
+            self.delete_from_pinecone(legacy_ids, organization_id)
+    
+    async def save_upload(self, pdf_file, destination_path: str = None) -> str:
+        """
+        Stream an uploaded file to disk in 1 MB blocks and return its path
+        
+        Writes to a new temporary file unless destination_path is given.
+        """
+        if destination_path:
+            target = open(destination_path, "wb")
+        else:
+            target = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+        with target:
+            while True:
+                block = await pdf_file.read(1024 * 1024)
+                if not block:
+                    break
+                target.write(block)
+            return target.name
+    
+    async def ingest_document(self, document: IngestionDocument) -> dict:
+        """
+        Run a saved PDF through the ingestion pipeline and format the result
+        """
+        pipeline_result = await self.ingestion_pipeline.run(document)
+        
+        print(f"\n--- Ingested {document.pdf_filename}: {pipeline_result['pages_extracted']} pages, "
+              f"{pipeline_result['chunks_processed']} chunks ---")
+        
+        return {
+            "status": "success",
+            "message": "PDF processed and stored successfully",
+            "pdf_filename": document.pdf_filename,
+            "organization_id": document.organization_id,
+            "pages_extracted": pipeline_result["pages_extracted"],
+            "chunks_processed": pipeline_result["chunks_processed"],
+            "vectors_stored": pipeline_result["vectors_stored"],
+            "vectors_deleted": pipeline_result["vectors_deleted"],
+            "namespace": pipeline_result["namespace"],
+            "reindex": pipeline_result["reindex"]
+        }
+    
+    async def ingest_documents(self, documents: List[IngestionDocument]) -> dict:
+        """
+        Ingest many saved PDFs of one organization through shared embedding and upsert batches
+        
+        Returns per-file status plus aggregate throughput for the whole run.
+        """
+        started = time.perf_counter()
+        results = await self.ingestion_pipeline.run_many(documents)
+        elapsed = time.perf_counter() - started
+        
+        succeeded = [r for r in results if r["status"] == "success"]
+        pages = sum(r["pages_extracted"] for r in results)
+        chunks = sum(r["chunks_processed"] for r in results)
+        vectors = sum(r["vectors_stored"] for r in results)
+        
+        print(f"\n--- Bulk ingested {len(succeeded)}/{len(results)} files: {pages} pages, "
+              f"{chunks} chunks in {elapsed:.1f}s ---")
+        
+        return {
+            "status": "success" if len(succeeded) == len(results) else "partial",
+            "organization_id": documents[0].organization_id if documents else None,
+            "files_total": len(results),
+            "files_succeeded": len(succeeded),
+            "files_failed": len(results) - len(succeeded),
+            "files": results,
+            "throughput": {
+                "elapsed_seconds": round(elapsed, 2),
+                "pages_extracted": pages,
+                "chunks_processed": chunks,
+                "vectors_stored": vectors,
+                "pages_per_second": round(pages / elapsed, 2) if elapsed else 0.0,
+                "chunks_per_second": round(chunks / elapsed, 2) if elapsed else 0.0
+            }
+        }
+    
+    async def process_pdf(self, pdf_file, organization_id: str, incremental: bool = True):
+        """
+        Main method to process PDF: extract text, chunk, embed, and store in Pinecone
+        
+        The upload is streamed to disk and fed through the staged ingestion pipeline,
+        so neither the full document text nor all of its vectors are held in memory.
+        With incremental=True only chunks that changed since the last upload of the
+        same file are embedded and upserted; vanished chunks are always deleted.
+        """
+        temp_file_path = None
+        try:
+            temp_file_path = await self.save_upload(pdf_file)
+            document = IngestionDocument(temp_file_path, organization_id, pdf_file.filename, incremental)
+            return await self.ingest_document(document)
             
         except Exception as e:
             raise Exception(f"Error processing PDF: {str(e)}")
@@ -173,7 +320,50 @@ class PDFProcessingController:
             if temp_file_path and os.path.exists(temp_file_path):
                 os.remove(temp_file_path)
     
-    def retrieve_documents(self, query: str, organization_id: str, top_k: int = 3, score_threshold: float = 0.4):
+    def get_reranker_stats(self):
+        """
+        Return reranker load state, score cache, fallback counters and latency
+        """
+        return {
+            "status": "success",
+            "reranker": self.reranker.get_stats() if self.reranker is not None else {"enabled": False}
+        }
+    
+    def get_embedding_stats(self):
+        """
+        Return embedding throughput and cache hit/miss counters for monitoring
+        """
+        return {
+            "status": "success",
+            "batcher": self.embedding_batcher.get_stats(),
+            "cache": self.embedding_cache.get_stats()
+        }
+    
+    def clear_embedding_cache(self):
+        """
+        Drop every cached embedding
+        """
+        self.embedding_cache.clear()
+        return {
+            "status": "success",
+            "message": "Embedding cache cleared"
+        }
+    
+    def document_generation(self, organization_id: str) -> int:
+        """
+        Write generation of an organization's documents; moves on with every upsert or delete
+        """
+        return self.result_cache.generation(f"org_{organization_id}")
+    
+    def retrieve_documents(self, query: str, organization_id: str, top_k: int = 3,
+                           score_threshold: float = 0.4, mode: str = None):
+        """
+        Blocking wrapper around aretrieve_documents for scripts; not for use inside a running event loop
+        """
+        return asyncio.run(self.aretrieve_documents(query, organization_id, top_k, score_threshold, mode))
+    
+    async def aretrieve_documents(self, query: str, organization_id: str, top_k: int = 3,
+                                  score_threshold: float = 0.4, mode: str = None):
         """
         Retrieve relevant documents from Pinecone based on a query
         
@@ -181,64 +371,219 @@ class PDFProcessingController:
             query: The search query
             organization_id: Organization ID to search within specific namespace
             top_k: Number of top results to return
-            score_threshold: Minimum similarity score threshold
+            score_threshold: Minimum similarity score threshold for dense results
+                (BM25-only results use LEXICAL_SCORE_THRESHOLD instead)
+            mode: "dense", "hybrid" or "lexical" (defaults to RETRIEVAL_MODE)
+        
+        In hybrid mode BM25 and dense search run concurrently and are fused with
+        reciprocal rank fusion. ID-like queries (order numbers, SKUs, policy codes)
+        are answered from the lexical index alone when it has matches. With the
+        reranker enabled, other queries over-fetch candidates and keep the top_k
+        by cross-encoder score.
+        
+        The query is embedded through the batcher's async path and the blocking
+        index and BM25 lookups run on the retrieval thread pool, so the event
+        loop keeps serving other requests while a search is in flight.
         
         Returns:
             List of relevant documents with their content and scores
         """
+        mode = self._resolve_mode(mode)
+        
         try:
-            # Generate embedding for the query
-            result = self.genai_client.models.embed_content(
-                model=self.embedding_model,
-                contents=[query],
-                config=EmbedContentConfig(task_type="RETRIEVAL_QUERY", output_dimensionality=self.embedding_dimension)
-            )
-            query_embedding = list(result.embeddings[0].values)
-            
-            # Search in Pinecone with organization namespace
             namespace = f"org_{organization_id}"
+            fetch_k = self.reranker.fetch_k(top_k) if self.reranker is not None else top_k
+            candidates = fetch_k if mode == "dense" else max(fetch_k * 4, 20)
+            cache_hit = False
+            loop = asyncio.get_running_loop()
             
-            print(f"\n--- Searching in namespace: {namespace} ---")
-            print(f"Query: {query}")
-            print(f"Top K: {top_k}, Score Threshold: {score_threshold}\n")
-            
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                namespace=namespace,
-                include_metadata=True
-            )
+            # Order numbers, SKUs and policy codes: exact lexical hits skip the dense path
+            codes = id_terms(query) if mode == "hybrid" else []
+            exact_matches = []
+            if codes:
+                exact_matches = await loop.run_in_executor(
+                    self.retrieval_executor, self.lexical_index.search, namespace, query, top_k, codes
+                )
             
-            # Filter by score threshold and format results
-            relevant_docs = []
-            for match in results['matches']:
-                score = match['score']
-                if score >= score_threshold:
-                    relevant_docs.append({
-                        "content": match['metadata'].get('text', ''),
-                        "score": score,
-                        "pdf_filename": match['metadata'].get('pdf_filename', 'Unknown'),
-                        "chunk_index": match['metadata'].get('chunk_index', 0),
-                        "organization_id": match['metadata'].get('organization_id', '')
-                    })
+            if exact_matches:
+                mode = "lexical"
+                relevant_docs = self._lexical_documents(exact_matches, top_k)
+            elif mode == "lexical":
+                lexical_matches = await loop.run_in_executor(
+                    self.retrieval_executor, self.lexical_index.search, namespace, query, candidates
+                )
+                relevant_docs = self._lexical_documents(self._above_lexical_floor(lexical_matches), fetch_k)
+            elif mode == "dense":
+                relevant_docs, cache_hit = await self._adense_search(namespace, query, fetch_k, score_threshold)
+            else:
+                (dense_docs, cache_hit), lexical_matches = await asyncio.gather(
+                    self._adense_search(namespace, query, candidates, score_threshold),
+                    loop.run_in_executor(
+                        self.retrieval_executor, self.lexical_index.search, namespace, query, candidates
+                    )
+                )
+                relevant_docs = self._fuse_results(dense_docs, lexical_matches, fetch_k)
             
-            # Print results to console
-            print(f"\n--- Found {len(relevant_docs)} Relevant Documents ---")
-            for i, doc in enumerate(relevant_docs, 1):
-                print(f"\nDocument {i}:")
-                print(f"Score: {doc['score']:.4f}")
-                print(f"Source: {doc['pdf_filename']} (Chunk {doc['chunk_index']})")
-                print(f"Content: {doc['content'][:200]}...")
-                print("-" * 80)
+            if self.reranker is not None and not exact_matches:
+                relevant_docs = await self._arerank(query, relevant_docs, top_k)
             
-            return {
-                "status": "success",
-                "query": query,
-                "organization_id": organization_id,
-                "namespace": namespace,
-                "total_results": len(relevant_docs),
-                "documents": relevant_docs
-            }
+            return self._retrieval_response(query, organization_id, mode, relevant_docs, cache_hit)
             
         except Exception as e:
             raise Exception(f"Error retrieving documents: {str(e)}")
+    
+    async def _arerank(self, query: str, documents: List[dict], top_k: int) -> List[dict]:
+        """
+        Rerank on the reranker's own thread, abandoning the wait once the budget is spent
+        
+        An abandoned rerank finishes in the background and still fills the score
+        cache; until it does, other queries keep their original order.
+        """
+        future = self.reranker.submit(query, documents, top_k)
+        if future is None:
+            return documents[:top_k]
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.reranker.budget)
+        except asyncio.TimeoutError:
+            self.reranker.note_timeout()
+            return documents[:top_k]
+    
+    def _resolve_mode(self, mode: str) -> str:
+        mode = (mode or self.retrieval_mode).lower()
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        return mode
+    
+    @staticmethod
+    def _retrieval_response(query: str, organization_id: str, mode: str,
+                            relevant_docs: List[dict], cache_hit: bool) -> dict:
+        return {
+            "status": "success",
+            "query": query,
+            "organization_id": organization_id,
+            "namespace": f"org_{organization_id}",
+            "retrieval_mode": mode,
+            "total_results": len(relevant_docs),
+            "documents": relevant_docs,
+            "cache_hit": cache_hit
+        }
+    
+    async def _adense_search(self, namespace: str, query: str, top_k: int, score_threshold: float):
+        """
+        Embed the query and search the vector index, going through both retrieval caches
+        
+        Cache lookups run inline, the embedding and index query off the event
+        loop. Returns the documents and whether they came from the result cache.
+        """
+        query_embedding = self.query_embedding_cache.get(query)
+        if query_embedding is None:
+            query_embedding = (await self.embedding_batcher.aembed([query], "RETRIEVAL_QUERY"))[0]
+            self.query_embedding_cache.put(query, query_embedding)
+        
+        generation = self.result_cache.generation(namespace)
+        relevant_docs = self.result_cache.get(namespace, query_embedding, top_k, score_threshold)
+        if relevant_docs is not None:
+            print(f"\n--- Served {len(relevant_docs)} documents from result cache ({namespace}) ---")
+            return relevant_docs, True
+        
+        relevant_docs = await asyncio.get_running_loop().run_in_executor(
+            self.retrieval_executor, self._search_index,
+            namespace, query, query_embedding, top_k, score_threshold
+        )
+        self.result_cache.put(namespace, generation, query_embedding, top_k, score_threshold, relevant_docs)
+        return relevant_docs, False
+    
+    @staticmethod
+    def _format_match(match: dict) -> dict:
+        """Shape a vector or lexical index match as a retrieved document"""
+        metadata = match['metadata']
+        return {
+            "content": metadata.get('text', ''),
+            "score": match['score'],
+            "pdf_filename": metadata.get('pdf_filename', 'Unknown'),
+            "chunk_index": metadata.get('chunk_index', 0),
+            "organization_id": metadata.get('organization_id', ''),
+            "vector_id": match['id']
+        }
+    
+    def _lexical_documents(self, lexical_matches: List[dict], top_k: int) -> List[dict]:
+        """BM25 hits as documents: "score" is the normalized BM25 score, "lexical_score" the raw one"""
+        return [
+            dict(self._format_match(match), score=match["normalized_score"], lexical_score=match["score"])
+            for match in lexical_matches[:top_k]
+        ]
+    
+    def _above_lexical_floor(self, lexical_matches: List[dict]) -> List[dict]:
+        return [match for match in lexical_matches if match["normalized_score"] >= self.lexical_score_threshold]
+    
+    def _fuse_results(self, dense_docs: List[dict], lexical_matches: List[dict], top_k: int) -> List[dict]:
+        """
+        Merge dense and BM25 rankings with reciprocal rank fusion
+        
+        Documents are ordered by the fused value, returned as "rrf_score".
+        "score" stays the cosine similarity for dense hits; BM25-only hits must
+        clear LEXICAL_SCORE_THRESHOLD and carry their normalized BM25 score.
+        """
+        docs = {}
+        for doc in dense_docs:
+            docs[doc["vector_id"]] = dict(doc)
+        lexical_ranking = []
+        for match in lexical_matches:
+            doc = docs.get(match["id"])
+            if doc is None:
+                if match["normalized_score"] < self.lexical_score_threshold:
+                    continue
+                doc = docs[match["id"]] = dict(self._format_match(match), score=match["normalized_score"])
+            doc["lexical_score"] = match["score"]
+            lexical_ranking.append(match["id"])
+        
+        fused = reciprocal_rank_fusion([
+            [doc["vector_id"] for doc in dense_docs],
+            lexical_ranking
+        ])
+        ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return [dict(docs[vector_id], rrf_score=fused[vector_id]) for vector_id in ranked]
+    
+    def _search_index(self, namespace: str, query: str, query_embedding: List[float],
+                      top_k: int, score_threshold: float) -> List[dict]:
+        """
+        Query the vector index and return matches above the score threshold
+        """
+        print(f"\n--- Searching in namespace: {namespace} ---")
+        print(f"Query: {query}")
+        print(f"Top K: {top_k}, Score Threshold: {score_threshold}\n")
+        
+        results = self.index.query(
+            vector=query_embedding,
+            top_k=top_k,
+            namespace=namespace,
+            include_metadata=True
+        )
+        
+        # Filter by score threshold and format results
+        relevant_docs = [
+            self._format_match(match)
+            for match in results['matches']
+            if match['score'] >= score_threshold
+        ]
+        
+        # Print results to console
+        print(f"\n--- Found {len(relevant_docs)} Relevant Documents ---")
+        for i, doc in enumerate(relevant_docs, 1):
+            print(f"\nDocument {i}:")
+            print(f"Score: {doc['score']:.4f}")
+            print(f"Source: {doc['pdf_filename']} (Chunk {doc['chunk_index']})")
+            print(f"Content: {doc['content'][:200]}...")
+            print("-" * 80)
+        
+        return relevant_docs
+    
+    def get_retrieval_cache_stats(self):
+        """
+        Return query-embedding and result cache counters for monitoring
+        """
+        return {
+            "status": "success",
+            "query_embedding_cache": self.query_embedding_cache.get_stats(),
+            "result_cache": self.result_cache.get_stats()
+        }
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from controllers.metrics import LatencyHistogram
+
+
+class CrossEncoderReranker:
+    """
+    Local cross-encoder reranking of retrieved chunks within a latency budget
+
+    Retrieval over-fetches RERANKER_CANDIDATES chunks; each (query, chunk)
+    pair is scored by a small CPU cross-encoder (int8 dynamically quantized
+    by default) in batches of RERANKER_BATCH_SIZE, and the best top_k are
+    kept. Scores are cached by (query hash, chunk id), so repeated questions
+    only pay for chunks they have not seen.
+
+    Before each batch the expected batch time (from a moving average per
+    pair) is checked against RERANKER_BUDGET_MS; if it would overrun, the
+    candidates are returned in their original vector/fusion order instead.
+    The model loads on a background thread and retrieval falls back to the
+    original order until it is ready.
+
+    Async callers submit() to the reranker's own pool of RERANKER_WORKERS
+    threads. At most RERANKER_MAX_QUEUED submissions may wait behind busy
+    workers, and only while their expected wait (queue position x average
+    rerank time / workers) still fits the budget; anything else is refused
+    and keeps its original order, so reranks never pile up or take threads
+    from the retrieval pool. A queued rerank's budget counts from submission.
+    """
+
+    def __init__(self):
+        self.model_name = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.candidates = int(os.getenv("RERANKER_CANDIDATES", "20"))
+        self.budget = float(os.getenv("RERANKER_BUDGET_MS", "150")) / 1000
+        self.batch_size = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+        self.max_length = int(os.getenv("RERANKER_MAX_LENGTH", "256"))
+        self.quantize = os.getenv("RERANKER_QUANTIZE", "true").lower() == "true"
+        self.cache_size = int(os.getenv("RERANKER_CACHE_SIZE", "50000"))
+        self.workers = int(os.getenv("RERANKER_WORKERS", "2"))
+        self.max_queued = int(os.getenv("RERANKER_MAX_QUEUED", str(self.workers)))
+
+        self._model = None
+        self._cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._pair_seconds: Optional[float] = None
+        # Moving average of a whole rerank, for the queueing estimate
+        self._rerank_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._latency = LatencyHistogram()
+        self._stats = Counter()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reranker")
+        self._in_flight = 0
+        threading.Thread(target=self._load, name="reranker-load", daemon=True).start()
+
+    def _load(self):
+        try:
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(self.model_name, device="cpu", max_length=self.max_length)
+            if self.quantize:
+                import torch
+                model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.predict([("warm up", "warm up")], show_progress_bar=False)
+            self._model = model
+            print(f"Reranker {self.model_name} loaded (quantized={self.quantize})")
+        except Exception as e:
+            print(f"WARNING: Reranker {self.model_name} failed to load: {e}")
+
+    def fetch_k(self, top_k: int) -> int:
+        """How many candidates retrieval should return for a final top_k"""
+        return max(top_k, self.candidates)
+
+    def rerank(self, query: str, documents: List[Dict], top_k: int, started: Optional[float] = None) -> List[Dict]:
+        """
+        Return the top_k documents by cross-encoder score (as "rerank_score"),
+        or the first top_k in their original order when the model is not ready
+        or the budget (counted from `started`, default now) would be exceeded
+        """
+        started = time.perf_counter() if started is None else started
+        if len(documents) <= 1:
+            with self._lock:
+                self._stats["in_budget"] += 1
+            return documents[:top_k]
+        if self._model is None:
+            return self._fallback(documents, top_k, "model_unavailable")
+
+        query_key = hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+        scores = {}
+        missing = []
+        with self._lock:
+            for doc in documents:
+                key = (query_key, doc["vector_id"])
+                score = self._cache.get(key)
+                if score is None:
+                    missing.append(doc)
+                else:
+                    self._cache.move_to_end(key)
+                    scores[doc["vector_id"]] = score
+            self._stats["cache_hits"] += len(scores)
+            self._stats["cache_misses"] += len(missing)
+
+        deadline = started + self.budget
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            pair_seconds = self._pair_seconds or 0.0
+            if time.perf_counter() + len(batch) * pair_seconds > deadline:
+                return self._fallback(documents, top_k, "budget_exceeded")
+            batch_started = time.perf_counter()
+            batch_scores = self._model.predict(
+                [(query, doc["content"]) for doc in batch], batch_size=len(batch), show_progress_bar=False
+            )
+            per_pair = (time.perf_counter() - batch_started) / len(batch)
+            with self._lock:
+                self._pair_seconds = per_pair if self._pair_seconds is None else \
+                    self._pair_seconds + 0.2 * (per_pair - self._pair_seconds)
+                for doc, score in zip(batch, batch_scores):
+                    scores[doc["vector_id"]] = self._cache[(query_key, doc["vector_id"])] = float(score)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self._stats["pairs_scored"] += len(batch)
+
+        ranked = sorted(documents, key=lambda doc: scores[doc["vector_id"]], reverse=True)[:top_k]
+        elapsed = time.perf_counter() - started
+        self._latency.observe(elapsed)
+        with self._lock:
+            self._rerank_seconds = elapsed if self._rerank_seconds is None else \
+                self._rerank_seconds + 0.2 * (elapsed - self._rerank_seconds)
+            self._stats["reranked"] += 1
+            # A rerank finishing past the budget has already been abandoned by its caller
+            if elapsed <= self.budget:
+                self._stats["in_budget"] += 1
+        return [dict(doc, rerank_score=round(scores[doc["vector_id"]], 4)) for doc in ranked]
+
+    def submit(self, query: str, documents: List[Dict], top_k: int) -> Optional[Future]:
+        """Start rerank() on the reranker pool, or return None when it could not finish within the budget"""
+        started = time.perf_counter()
+        with self._lock:
+            self._stats["submitted"] += 1
+            queued = self._in_flight - self.workers + 1
+            if queued > 0:
+                if queued > self.max_queued:
+                    self._stats["fallback_busy"] += 1
+                    return None
+                if self._rerank_seconds is not None and queued * self._rerank_seconds / self.workers > self.budget:
+                    self._stats["fallback_queue_wait"] += 1
+                    return None
+            self._in_flight += 1
+        future = self._executor.submit(self.rerank, query, documents, top_k, started)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def note_timeout(self):
+        """Record an async rerank abandoned at the budget (its scores still land in the cache)"""
+        with self._lock:
+            self._stats["fallback_budget_exceeded"] += 1
+
+    def _fallback(self, documents: List[Dict], top_k: int, reason: str) -> List[Dict]:
+        with self._lock:
+            self._stats[f"fallback_{reason}"] += 1
+        return documents[:top_k]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(
+                self._stats,
+                model=self.model_name,
+                loaded=self._model is not None,
+                quantized=self.quantize,
+                candidates=self.candidates,
+                budget_ms=round(self.budget * 1000),
+                cached_scores=len(self._cache),
+                workers=self.workers,
+                in_flight=self._in_flight,
+                fallback_rate=round(1 - self._stats["in_budget"] / self._stats["submitted"], 4)
+                if self._stats["submitted"] else None,
+                ms_per_pair=round(self._pair_seconds * 1000, 3) if self._pair_seconds is not None else None,
+                latency=self._latency.snapshot(),
+            )
+
+
+def create_reranker() -> Optional[CrossEncoderReranker]:
+    """Build the reranker when RERANKER_ENABLED is true (off by default)"""
+    if os.getenv("RERANKER_ENABLED", "false").lower() != "true":
+        return None
+    return CrossEncoderReranker()
@@ -0,0 +1,171 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form used as the exact-match cache key"""
+    return _WHITESPACE_RE.sub(" ", query.strip().lower()).rstrip("?.! ")
+
+
+class QueryEmbeddingCache:
+    """
+    In-memory LRU cache of normalized query text -> query embedding
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, query: str) -> Optional[List[float]]:
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return embedding
+
+    def put(self, query: str, embedding: List[float]):
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+class _NamespaceResults:
+    """Fixed-capacity ring of cached results for one namespace"""
+
+    def __init__(self, capacity: int, dimension: int):
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.entries: List[Optional[dict]] = [None] * capacity
+        self.size = 0
+        self.next_slot = 0
+
+
+class SemanticResultCache:
+    """
+    Per-namespace retrieval result cache keyed by query embedding
+
+    A lookup reuses a cached result when a previous query with the same top_k
+    and score threshold has cosine similarity above the reuse threshold. Each
+    namespace holds a bounded ring of unit-normalised query vectors so a lookup
+    is a single matrix-vector product. Writes to a namespace invalidate it; a
+    generation counter stops in-flight queries from caching pre-write results.
+    """
+
+    def __init__(self):
+        self.similarity_threshold = float(os.getenv("RESULT_CACHE_SIMILARITY", "0.97"))
+        self.capacity = int(os.getenv("RESULT_CACHE_PER_NAMESPACE", "512"))
+        self.ttl_seconds = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+        self.enabled = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+
+        self._namespaces: Dict[str, _NamespaceResults] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def generation(self, namespace: str) -> int:
+        """Current write generation of a namespace; pass it back to put()"""
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def get(self, namespace: str, query_embedding: List[float], top_k: int,
+            score_threshold: float) -> Optional[List[Dict]]:
+        """Return cached documents for a sufficiently similar query, or None"""
+        if not self.enabled:
+            return None
+        query = self._unit(query_embedding)
+        now = time.time()
+        with self._lock:
+            results = self._namespaces.get(namespace)
+            if results is None or results.size == 0 or results.vectors.shape[1] != query.shape[0]:
+                self._misses += 1
+                return None
+
+            similarities = results.vectors[:results.size] @ query
+            for slot in np.argsort(-similarities):
+                if similarities[slot] < self.similarity_threshold:
+                    break
+                entry = results.entries[slot]
+                if (entry["top_k"] == top_k and entry["score_threshold"] == score_threshold
+                        and now - entry["created_at"] <= self.ttl_seconds):
+                    self._hits += 1
+                    return list(entry["documents"])
+
+            self._misses += 1
+            return None
+
+    def put(self, namespace: str, generation: int, query_embedding: List[float], top_k: int,
+            score_threshold: float, documents: List[Dict]):
+        """Cache a result unless the namespace was written to since `generation` was read"""
+        if not self.enabled:
+            return
+        query = self._unit(query_embedding)
+        with self._lock:
+            if self._generations.get(namespace, 0) != generation:
+                return
+            results = self._namespaces.get(namespace)
+            if results is None or results.vectors.shape[1] != query.shape[0]:
+                results = _NamespaceResults(self.capacity, query.shape[0])
+                self._namespaces[namespace] = results
+
+            slot = results.next_slot
+            results.vectors[slot] = query
+            results.entries[slot] = {
+                "top_k": top_k,
+                "score_threshold": score_threshold,
+                "documents": list(documents),
+                "created_at": time.time(),
+            }
+            results.next_slot = (slot + 1) % self.capacity
+            results.size = min(results.size + 1, self.capacity)
+
+    def invalidate(self, namespace: str):
+        """Drop cached results for a namespace after its vectors change"""
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            if self._namespaces.pop(namespace, None) is not None:
+                self._invalidations += 1
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "namespaces": len(self._namespaces),
+                "entries": sum(r.size for r in self._namespaces.values()),
+                "similarity_threshold": self.similarity_threshold,
+            }
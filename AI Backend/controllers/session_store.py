@@ -0,0 +1,506 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+from controllers.storage_paths import data_path
+
+# Fixed per-session allowance for the object, deque and dict overhead
+SESSION_OVERHEAD_BYTES = 512
+
+# Serialized histories at least this large are zlib-compressed
+COMPRESS_MIN_BYTES = 512
+
+
+def estimate_session_bytes(session) -> int:
+    """Approximate memory held by a ChatSession's history"""
+    return SESSION_OVERHEAD_BYTES + sum(
+        len(message["content"].encode("utf-8")) + len(message["role"]) + 64
+        for message in session.get_history()
+    )
+
+
+class MemorySessionStore:
+    """
+    Bounded in-process store for ChatSession objects
+
+    Behaves like the dict it replaces (in, [], del, get, pop, len) but expires
+    sessions idle for longer than the TTL and evicts least recently used
+    sessions once the session count or estimated byte total exceeds its cap.
+    Expired sessions are dropped lazily on access and by a periodic sweep.
+    """
+
+    def __init__(self):
+        self.ttl_seconds = float(os.getenv("CHAT_SESSION_TTL_SECONDS", "1800"))
+        self.max_sessions = int(os.getenv("CHAT_MAX_SESSIONS", "10000"))
+        self.max_bytes = int(os.getenv("CHAT_MAX_SESSION_BYTES", str(256 * 1024 * 1024)))
+        self.sweep_interval = float(os.getenv("CHAT_SESSION_SWEEP_SECONDS", "60"))
+
+        self._sessions: "OrderedDict[str, object]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sweeper: Optional[asyncio.Task] = None
+        self._evictions = {"expired": 0, "max_sessions": 0, "max_bytes": 0}
+        self._created = 0
+        self._sweeps = 0
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return self._live_locked(session_id, time.time())
+
+    def __getitem__(self, session_id: str):
+        with self._lock:
+            if not self._live_locked(session_id, time.time()):
+                raise KeyError(session_id)
+            self._touch_locked(session_id)
+            return self._sessions[session_id]
+
+    def get(self, session_id: str, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def __setitem__(self, session_id: str, session):
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove_locked(session_id)
+            else:
+                self._created += 1
+            self._sessions[session_id] = session
+            self._sizes[session_id] = 0
+            self._touch_locked(session_id)
+            self._enforce_limits_locked()
+
+    def __delitem__(self, session_id: str):
+        with self._lock:
+            if session_id not in self._sessions:
+                raise KeyError(session_id)
+            self._remove_locked(session_id)
+
+    def pop(self, session_id: str, default=None):
+        with self._lock:
+            if session_id not in self._sessions:
+                return default
+            session = self._sessions[session_id]
+            self._remove_locked(session_id)
+            return session
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def touch(self, session_id: str):
+        """Record activity and re-measure a session after its history changed"""
+        with self._lock:
+            if session_id in self._sessions:
+                self._touch_locked(session_id)
+                self._enforce_limits_locked()
+
+    def _touch_locked(self, session_id: str):
+        self._sessions.move_to_end(session_id)
+        self._last_access[session_id] = time.time()
+        size = estimate_session_bytes(self._sessions[session_id])
+        self._bytes += size - self._sizes[session_id]
+        self._sizes[session_id] = size
+
+    def _live_locked(self, session_id: str, now: float) -> bool:
+        if session_id not in self._sessions:
+            return False
+        if now - self._last_access[session_id] > self.ttl_seconds:
+            self._remove_locked(session_id)
+            self._evictions["expired"] += 1
+            return False
+        return True
+
+    def _remove_locked(self, session_id: str):
+        del self._sessions[session_id]
+        del self._last_access[session_id]
+        self._bytes -= self._sizes.pop(session_id)
+
+    def _enforce_limits_locked(self):
+        # Never evict the most recently used session, even if it alone exceeds max_bytes
+        while len(self._sessions) > 1:
+            if len(self._sessions) > self.max_sessions:
+                reason = "max_sessions"
+            elif self._bytes > self.max_bytes:
+                reason = "max_bytes"
+            else:
+                break
+            oldest = next(iter(self._sessions))
+            self._remove_locked(oldest)
+            self._evictions[reason] += 1
+
+    def sweep(self) -> int:
+        """Drop every session idle past the TTL; returns how many were removed"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            # Sessions are in least-recently-used order, so expired ones are at the front
+            expired = []
+            for session_id in self._sessions:
+                if self._last_access[session_id] >= cutoff:
+                    break
+                expired.append(session_id)
+            for session_id in expired:
+                self._remove_locked(session_id)
+            self._evictions["expired"] += len(expired)
+            self._sweeps += 1
+        return len(expired)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                print(f"Session sweep expired {removed} idle chat sessions")
+
+    def start(self):
+        """Start the background sweeper on the running event loop"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "live_sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "created": self._created,
+                "evictions": dict(self._evictions),
+                "sweeps": self._sweeps,
+                "ttl_seconds": self.ttl_seconds,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def encode_session(session) -> bytes:
+    """Serialize a session as compact JSON, zlib-compressed when large (first byte is the format)"""
+    payload = json.dumps(session.to_dict(), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(payload) >= COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(payload, 1)
+    return b"j" + payload
+
+
+def decode_session(session_cls, session_id: str, blob: bytes):
+    payload = zlib.decompress(blob[1:]) if blob[:1] == b"z" else blob[1:]
+    return session_cls.from_dict(session_id, json.loads(payload))
+
+
+class SQLiteSessionStore:
+    """
+    Chat session store shared by every worker through one SQLite WAL file
+
+    Same dict-like interface as MemorySessionStore. Sessions are cached locally
+    in a small LRU; each lookup compares the cached write stamp with the row's
+    and reloads only if another worker wrote the session since. Changes
+    recorded via touch() and access times are buffered and written in one
+    transaction by a background flusher every CHAT_SESSION_FLUSH_MS (or
+    immediately when no flusher is running). TTL and size caps are enforced by
+    the periodic sweep.
+
+    Writes compare-and-swap on the write stamp this worker last saw. When
+    another worker saved the session in between, its copy is read back, the
+    turns added here are rebased onto it (ChatSession.rebase) and the merged
+    session is written, so concurrent turns are never overwritten.
+    """
+
+    def __init__(self, session_cls):
+        self.session_cls = session_cls
+        self.ttl_seconds = float(os.getenv("CHAT_SESSION_TTL_SECONDS", "1800"))
+        self.max_sessions = int(os.getenv("CHAT_MAX_SESSIONS", "10000"))
+        self.max_bytes = int(os.getenv("CHAT_MAX_SESSION_BYTES", str(256 * 1024 * 1024)))
+        self.sweep_interval = float(os.getenv("CHAT_SESSION_SWEEP_SECONDS", "60"))
+        self.flush_interval = float(os.getenv("CHAT_SESSION_FLUSH_MS", "50")) / 1000
+        self.cache_size = int(os.getenv("CHAT_SESSION_CACHE_SIZE", "1000"))
+        self.path = os.getenv("CHAT_SESSION_DB_PATH") or data_path("chat_sessions.sqlite3")
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " data BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access)")
+        self._conn.commit()
+
+        # session_id -> (write stamp, session) for sessions this worker has read or written
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # session_id -> (write stamp the change is based on, session)
+        self._dirty: Dict[str, tuple] = {}
+        self._accessed: Dict[str, float] = {}
+        self._tasks = []
+        self._stats = {
+            "cache_hits": 0, "reloads": 0, "writes": 0, "write_batches": 0, "write_conflicts": 0,
+            "created": 0, "evictions": {"expired": 0, "max_sessions": 0, "max_bytes": 0}, "sweeps": 0,
+        }
+
+    def _cache_put_locked(self, session_id: str, version: int, session):
+        self._cache[session_id] = (version, session)
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, session_id: str, default=None):
+        now = time.time()
+        with self._lock:
+            if session_id in self._dirty:
+                self._accessed[session_id] = now
+                self._cache.move_to_end(session_id)
+                self._stats["cache_hits"] += 1
+                return self._dirty[session_id][1]
+
+            cached = self._cache.get(session_id)
+            if cached is not None:
+                row = self._conn.execute(
+                    "SELECT version, last_access FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is not None and row[0] == cached[0] and now - row[1] <= self.ttl_seconds:
+                    self._accessed[session_id] = now
+                    self._cache.move_to_end(session_id)
+                    self._stats["cache_hits"] += 1
+                    return cached[1]
+
+            row = self._conn.execute(
+                "SELECT data, version, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or now - row[2] > self.ttl_seconds:
+                self._cache.pop(session_id, None)
+                return default
+            session = decode_session(self.session_cls, session_id, row[0])
+            self._cache_put_locked(session_id, row[1], session)
+            self._accessed[session_id] = now
+            self._stats["reloads"] += 1
+            return session
+
+    def __getitem__(self, session_id: str):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __setitem__(self, session_id: str, session):
+        with self._lock:
+            self._stats["created"] += 1
+            self._cache_put_locked(session_id, 0, session)
+            self._dirty[session_id] = (0, session)
+            self._accessed[session_id] = time.time()
+            if not self._tasks:
+                self._flush_locked()
+
+    def touch(self, session_id: str):
+        """Queue a write of a session whose history changed"""
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached is None:
+                return
+            if session_id not in self._dirty:
+                self._dirty[session_id] = cached
+            self._accessed[session_id] = time.time()
+            if not self._tasks:
+                self._flush_locked()
+
+    def pop(self, session_id: str, default=None):
+        session = self.get(session_id)
+        with self._lock:
+            self._cache.pop(session_id, None)
+            self._dirty.pop(session_id, None)
+            self._accessed.pop(session_id, None)
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+        return default if session is None else session
+
+    def __delitem__(self, session_id: str):
+        if self.pop(session_id) is None:
+            raise KeyError(session_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE last_access >= ?", (time.time() - self.ttl_seconds,)
+            ).fetchone()[0]
+
+    def flush(self):
+        """Write buffered session changes and access times in one transaction"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._dirty and not self._accessed:
+            return
+        now = time.time()
+        touched = [
+            (last_access, session_id)
+            for session_id, last_access in self._accessed.items()
+            if session_id not in self._dirty
+        ]
+        # IMMEDIATE takes the write lock first, so a conflicting row cannot change again mid-merge
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for session_id, (base_version, session) in self._dirty.items():
+                version = self._write_locked(session_id, session, base_version, self._accessed.get(session_id, now))
+                session.mark_synced()
+                cached = self._cache.get(session_id)
+                if cached is not None and cached[1] is session:
+                    self._cache[session_id] = (version, session)
+            self._conn.executemany("UPDATE sessions SET last_access = ? WHERE session_id = ?", touched)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        if self._dirty:
+            self._stats["writes"] += len(self._dirty)
+            self._stats["write_batches"] += 1
+        self._dirty.clear()
+        self._accessed.clear()
+
+    def _write_locked(self, session_id: str, session, base_version: int, last_access: float) -> int:
+        """Write one session if its row still has base_version, else merge onto the stored copy"""
+        version = random.getrandbits(62) + 1
+        blob = encode_session(session)
+        if base_version:
+            written = self._conn.execute(
+                "UPDATE sessions SET data = ?, size = ?, version = ?, last_access = ?"
+                " WHERE session_id = ? AND version = ?",
+                (blob, len(blob), version, last_access, session_id, base_version)
+            ).rowcount
+        else:
+            written = self._conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, data, size, version, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (session_id, blob, len(blob), version, last_access)
+            ).rowcount
+        if written:
+            return version
+
+        row = self._conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is not None:
+            self._stats["write_conflicts"] += 1
+            session.rebase(decode_session(self.session_cls, session_id, row[0]))
+            blob = encode_session(session)
+        # Still inside the IMMEDIATE transaction, so the row cannot have moved since the read
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, data, size, version, last_access)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (session_id, blob, len(blob), version, last_access)
+        )
+        return version
+
+    def sweep(self) -> int:
+        """Delete expired sessions, then the least recently used beyond the caps"""
+        with self._lock:
+            self._flush_locked()
+            evictions = self._stats["evictions"]
+            with self._conn:
+                expired = self._conn.execute(
+                    "DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,)
+                ).rowcount
+                evictions["expired"] += expired
+
+                count, total = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions"
+                ).fetchone()
+                if count > self.max_sessions:
+                    evictions["max_sessions"] += self._conn.execute(
+                        "DELETE FROM sessions WHERE session_id IN ("
+                        " SELECT session_id FROM sessions ORDER BY last_access LIMIT ?)",
+                        (count - self.max_sessions,)
+                    ).rowcount
+                    total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM sessions").fetchone()[0]
+                if total > self.max_bytes:
+                    victims = []
+                    for session_id, size in self._conn.execute(
+                        "SELECT session_id, size FROM sessions ORDER BY last_access"
+                    ):
+                        if total <= self.max_bytes:
+                            break
+                        victims.append((session_id,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", victims)
+                    evictions["max_bytes"] += len(victims)
+            self._stats["sweeps"] += 1
+            return expired
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._dirty or self._accessed:
+                await asyncio.to_thread(self.flush)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = await asyncio.to_thread(self.sweep)
+            if removed:
+                print(f"Session sweep expired {removed} idle chat sessions")
+
+    def start(self):
+        """Start the background flusher and sweeper on the running event loop"""
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._flush_loop()), loop.create_task(self._sweep_loop())]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.flush()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions WHERE last_access >= ?",
+                (time.time() - self.ttl_seconds,)
+            ).fetchone()
+            stats = dict(self._stats, evictions=dict(self._stats["evictions"]))
+            stats.update({
+                "backend": "sqlite",
+                "live_sessions": count,
+                "bytes": total,
+                "cached_sessions": len(self._cache),
+                "pending_writes": len(self._dirty),
+                "ttl_seconds": self.ttl_seconds,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+            })
+            return stats
+
+
+def create_session_store(session_cls):
+    """Build the store selected by CHAT_SESSION_BACKEND (memory or sqlite)"""
+    backend = os.getenv("CHAT_SESSION_BACKEND", "memory").lower()
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(session_cls)
+    raise ValueError(f"Unknown CHAT_SESSION_BACKEND: {backend}")
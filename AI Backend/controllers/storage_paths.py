@@ -0,0 +1,13 @@
+import os
+
+_AI_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Local state (caches, manifests, indexes, job queues) lives under one data directory
+DATA_DIR = os.getenv("AI_BACKEND_DATA_DIR", os.path.join(_AI_BACKEND_DIR, "data"))
+
+
+def data_path(*parts: str) -> str:
+    """Return a path inside the data directory, creating parent folders as needed"""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,75 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Optional
+
+
+class StageTimer:
+    """
+    Start offsets and durations of the stages of one chat turn
+
+    Stages started with `run` execute as concurrent tasks, so the report shows
+    how much they overlapped: with a good pipeline `total_ms` stays close to the
+    longest stage rather than `stage_sum_ms`.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict] = {}
+        self.marks: Dict[str, float] = {}
+
+    def run(self, name: str, awaitable: Awaitable) -> asyncio.Task:
+        """Start `awaitable` as a task whose timing is recorded under `name`"""
+        async def timed():
+            begin = time.perf_counter()
+            status = "done"
+            try:
+                return await awaitable
+            except asyncio.CancelledError:
+                status = "cancelled"
+                raise
+            except Exception:
+                status = "failed"
+                raise
+            finally:
+                self.record(name, begin, status)
+        return asyncio.ensure_future(timed())
+
+    @contextmanager
+    def measure(self, name: str):
+        """Time an inline (sequential) stage"""
+        begin = time.perf_counter()
+        status = "done"
+        try:
+            yield
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            self.record(name, begin, status)
+
+    def record(self, name: str, begin: float, status: str = "done"):
+        self.stages[name] = {
+            "start_ms": round((begin - self.started) * 1000, 1),
+            "ms": round((time.perf_counter() - begin) * 1000, 1),
+            "status": status,
+        }
+
+    def mark(self, name: str):
+        """Record a point in time, e.g. the first streamed token"""
+        self.marks.setdefault(name, round((time.perf_counter() - self.started) * 1000, 1))
+
+    def report(self) -> Dict:
+        return {
+            "stages": self.stages,
+            "marks": self.marks,
+            "stage_sum_ms": round(sum(stage["ms"] for stage in self.stages.values()), 1),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+
+def cancel_tasks(*tasks: Optional[asyncio.Task]):
+    """Cancel the branches of a turn that lost the race; None entries are skipped"""
+    for task in tasks:
+        if task is not None and not task.done():
+            task.cancel()
@@ -0,0 +1,390 @@
+import hashlib
+import json
+import os
+import sqlite3
+import string
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import unquote
+import numpy as np
+from controllers.storage_paths import DATA_DIR
+
+_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + "_-")
+_MAX_DIRNAME = 200
+
+
+def namespace_dirname(namespace: str) -> str:
+    """
+    Collision-free directory name for a namespace
+
+    Every UTF-8 byte outside [A-Za-z0-9_-] is percent-encoded, so distinct
+    namespaces never share a directory. The empty namespace maps to "~" and
+    names too long for the filesystem to "~" + SHA-256; encoded names never
+    contain "~", so neither can collide with them.
+    """
+    if namespace == "":
+        return "~"
+    try:
+        raw = namespace.encode("utf-8")
+    except UnicodeEncodeError:
+        raise ValueError(f"Namespace is not valid UTF-8: {namespace!r}")
+    encoded = "".join(chr(byte) if chr(byte) in _SAFE_CHARS else f"%{byte:02X}" for byte in raw)
+    if unquote(encoded, errors="strict") != namespace:
+        raise ValueError(f"Namespace does not round-trip through its directory name: {namespace!r}")
+    if len(encoded) > _MAX_DIRNAME:
+        return "~" + hashlib.sha256(raw).hexdigest()
+    return encoded
+
+
+class VectorStore(ABC):
+    """
+    Minimal Pinecone-compatible index interface used by PDFProcessingController
+
+    Backends accept and return the same shapes as a Pinecone Index, so
+    store_in_pinecone and retrieve_documents run unchanged on any of them.
+    `location` names the physical index (backend plus index or directory) so
+    state kept about its contents, like document manifests, is never applied
+    to a different one.
+    """
+
+    location: str
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict], namespace: str):
+        ...
+
+    @abstractmethod
+    def query(self, vector: List[float], top_k: int, namespace: str, include_metadata: bool = True) -> Dict:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str], namespace: str):
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str, namespace: str) -> Iterator[List[str]]:
+        ...
+
+
+class PineconeVectorStore(VectorStore):
+    """Pass-through to a hosted Pinecone index"""
+
+    def __init__(self, api_key: str, index_name: str, host: Optional[str]):
+        from pinecone import Pinecone
+        self.pc = Pinecone(api_key=api_key)
+        self.index = self.pc.Index(name=index_name, host=host)
+        self.location = f"pinecone:{host or index_name}"
+
+    def upsert(self, vectors, namespace):
+        return self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, vector, top_k, namespace, include_metadata=True):
+        return self.index.query(
+            vector=vector, top_k=top_k, namespace=namespace, include_metadata=include_metadata
+        )
+
+    def delete(self, ids, namespace):
+        return self.index.delete(ids=ids, namespace=namespace)
+
+    def list(self, prefix, namespace):
+        return self.index.list(prefix=prefix, namespace=namespace)
+
+
+class _LocalNamespace:
+    """
+    One namespace of the local store
+
+    Vectors live in a float32 memory-mapped matrix (one row per vector, unit
+    normalised for cosine scoring) that doubles in capacity as it fills. IDs
+    and metadata are kept in a SQLite sidecar and mirrored in memory. Deleted
+    rows are zeroed and reused by later upserts.
+
+    The IVF index is rebuilt on a background thread from a snapshot of the
+    live rows and swapped in under the lock; until then queries keep using
+    the previous index (or exact search), so upserts and queries never wait
+    on k-means.
+    """
+
+    def __init__(self, directory: str, metric: str, ivf_threshold: int, nprobe: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.metric = metric
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.lock = threading.RLock()
+
+        self._conn = sqlite3.connect(os.path.join(directory, "rows.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, metadata TEXT)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+        dimension = self._conn.execute("SELECT value FROM info WHERE key = 'dimension'").fetchone()
+        self.dimension: Optional[int] = int(dimension[0]) if dimension else None
+        self.matrix: Optional[np.memmap] = None
+        self.capacity = 0
+        self.id_to_row: Dict[str, int] = {}
+        self.row_ids: List[Optional[str]] = []
+        self.row_metadata: List[Optional[dict]] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.free_rows: List[int] = []
+        self._ivf: Optional[dict] = None
+        self._ivf_building = False
+        # Rows written while a rebuild runs; they are unassigned in the new index
+        self._ivf_pending: set = set()
+
+        if self.dimension is not None:
+            self._open_matrix()
+            for row, vector_id, metadata in self._conn.execute("SELECT row, id, metadata FROM rows"):
+                self._ensure_rows(row + 1)
+                self.id_to_row[vector_id] = row
+                self.row_ids[row] = vector_id
+                self.row_metadata[row] = json.loads(metadata) if metadata else {}
+                self.alive[row] = True
+            self.free_rows = [row for row in range(len(self.row_ids)) if not self.alive[row]]
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.directory, "vectors.f32")
+
+    def _open_matrix(self, min_capacity: int = 1024):
+        row_bytes = self.dimension * 4
+        size = os.path.getsize(self._matrix_path) if os.path.exists(self._matrix_path) else 0
+        capacity = max(size // row_bytes, min_capacity)
+        if size < capacity * row_bytes:
+            with open(self._matrix_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self.matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+",
+                                shape=(capacity, self.dimension))
+        self.capacity = capacity
+
+    def _ensure_rows(self, count: int):
+        if count > self.capacity:
+            self.matrix.flush()
+            del self.matrix
+            self._open_matrix(max(count, self.capacity * 2))
+        missing = count - len(self.row_ids)
+        if missing > 0:
+            self.row_ids.extend([None] * missing)
+            self.row_metadata.extend([None] * missing)
+            self.alive = np.concatenate([self.alive, np.zeros(missing, dtype=bool)])
+
+    def _prepare(self, values) -> np.ndarray:
+        vector = np.asarray(values, dtype=np.float32)
+        if self.metric == "cosine":
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector = vector / norm
+        return vector
+
+    def upsert(self, vectors: List[Dict]):
+        with self.lock:
+            if self.dimension is None:
+                self.dimension = len(vectors[0]["values"])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO info (key, value) VALUES ('dimension', ?)", (str(self.dimension),)
+                )
+                self._open_matrix()
+
+            rows = []
+            for item in vectors:
+                if len(item["values"]) != self.dimension:
+                    raise ValueError(
+                        f"Vector dimension {len(item['values'])} does not match namespace dimension {self.dimension}"
+                    )
+                row = self.id_to_row.get(item["id"])
+                if row is None:
+                    row = self.free_rows.pop() if self.free_rows else len(self.row_ids)
+                    self._ensure_rows(row + 1)
+                self.matrix[row] = self._prepare(item["values"])
+                self.id_to_row[item["id"]] = row
+                self.row_ids[row] = item["id"]
+                self.row_metadata[row] = item.get("metadata") or {}
+                self.alive[row] = True
+                rows.append((row, item["id"], json.dumps(self.row_metadata[row])))
+                if self._ivf is not None:
+                    self._ivf["unassigned"].add(row)
+                if self._ivf_building:
+                    self._ivf_pending.add(row)
+
+            self.matrix.flush()
+            self._conn.executemany("INSERT OR REPLACE INTO rows (row, id, metadata) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            removed = []
+            for vector_id in ids:
+                row = self.id_to_row.pop(vector_id, None)
+                if row is None:
+                    continue
+                self.matrix[row] = 0.0
+                self.row_ids[row] = None
+                self.row_metadata[row] = None
+                self.alive[row] = False
+                self.free_rows.append(row)
+                removed.append((vector_id,))
+            if removed:
+                self.matrix.flush()
+                self._conn.executemany("DELETE FROM rows WHERE id = ?", removed)
+                self._conn.commit()
+
+    def query(self, values: List[float], top_k: int, include_metadata: bool) -> Dict:
+        with self.lock:
+            count = len(self.row_ids)
+            if self.dimension is None or count == 0:
+                return {"matches": []}
+            query = self._prepare(values)
+
+            candidates = self._ivf_candidates(query) if int(self.alive.sum()) >= self.ivf_threshold else None
+            if candidates is not None:
+                scores = self.matrix[candidates] @ query
+                rows = candidates
+            else:
+                # Exact search: one matrix-vector product over every row
+                scores = np.asarray(self.matrix[:count] @ query)
+                scores[~self.alive[:count]] = -np.inf
+                rows = np.arange(count)
+
+            k = min(top_k, len(rows))
+            if k == 0:
+                return {"matches": []}
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            matches = []
+            for i in best:
+                row = int(rows[i])
+                if not self.alive[row]:
+                    continue
+                match = {"id": self.row_ids[row], "score": float(scores[i])}
+                if include_metadata:
+                    match["metadata"] = self.row_metadata[row]
+                matches.append(match)
+            return {"matches": matches}
+
+    def _ivf_candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Approximate search: probe the nprobe closest k-means cells plus rows
+        added since the build. Returns None (exact search) until a first
+        index has been built.
+        """
+        alive_count = int(self.alive.sum())
+        ivf = self._ivf
+        if ivf is None or len(ivf["unassigned"]) > 0.1 * alive_count:
+            self._start_ivf_build()
+        if ivf is None:
+            return None
+
+        probe = np.argsort(-(ivf["centroids"] @ query))[:self.nprobe]
+        parts = [ivf["lists"][cell] for cell in probe]
+        parts.append(np.fromiter(ivf["unassigned"], dtype=np.int64))
+        candidates = np.unique(np.concatenate(parts))
+        return candidates[self.alive[candidates]]
+
+    def _start_ivf_build(self):
+        """Snapshot the live rows (caller holds the lock) and run k-means on a background thread"""
+        if self._ivf_building:
+            return
+        self._ivf_building = True
+        self._ivf_pending = set()
+        rows = np.flatnonzero(self.alive)
+        data = np.array(self.matrix[rows])
+        threading.Thread(
+            target=self._rebuild_ivf, args=(rows, data), name="vector-ivf-build", daemon=True
+        ).start()
+
+    def _rebuild_ivf(self, rows: np.ndarray, data: np.ndarray):
+        try:
+            ivf = self._build_ivf(rows, data)
+        except Exception as e:
+            print(f"IVF rebuild failed for {self.directory}: {e}")
+            ivf = None
+        with self.lock:
+            if ivf is not None:
+                ivf["unassigned"] = self._ivf_pending
+                self._ivf = ivf
+            self._ivf_pending = set()
+            self._ivf_building = False
+
+    @staticmethod
+    def _build_ivf(rows: np.ndarray, data: np.ndarray, iterations: int = 8) -> dict:
+        cells = max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(rows), cells, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for cell in range(cells):
+                members = data[assignment == cell]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[cell] = centroid / norm if norm else centroid
+        assignment = np.argmax(data @ centroids.T, axis=1)
+        return {
+            "centroids": centroids,
+            "lists": [rows[assignment == cell] for cell in range(cells)],
+            "unassigned": set(),
+        }
+
+    def list_ids(self, prefix: str) -> List[str]:
+        with self.lock:
+            return [vector_id for vector_id in self.id_to_row if vector_id.startswith(prefix)]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index persisted under the data directory
+
+    Exact top-k for small namespaces; namespaces with at least
+    LOCAL_VECTOR_IVF_THRESHOLD vectors switch to an IVF (k-means cell) index
+    that scores only the LOCAL_VECTOR_NPROBE closest cells.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.getenv("LOCAL_VECTOR_STORE_DIR") or os.path.join(DATA_DIR, "vectors")
+        self.location = f"local:{os.path.abspath(self.directory)}"
+        self.metric = os.getenv("LOCAL_VECTOR_METRIC", "cosine")
+        self.ivf_threshold = int(os.getenv("LOCAL_VECTOR_IVF_THRESHOLD", "50000"))
+        self.nprobe = int(os.getenv("LOCAL_VECTOR_NPROBE", "8"))
+        self._namespaces: Dict[str, _LocalNamespace] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: str) -> _LocalNamespace:
+        with self._lock:
+            store = self._namespaces.get(namespace)
+            if store is None:
+                directory = os.path.join(self.directory, namespace_dirname(namespace))
+                store = _LocalNamespace(directory, self.metric, self.ivf_threshold, self.nprobe)
+                self._namespaces[namespace] = store
+            return store
+
+    def upsert(self, vectors, namespace):
+        if vectors:
+            self._namespace(namespace).upsert(vectors)
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k, namespace, include_metadata=True):
+        return self._namespace(namespace).query(vector, top_k, include_metadata)
+
+    def delete(self, ids, namespace):
+        self._namespace(namespace).delete(ids)
+        return {}
+
+    def list(self, prefix, namespace):
+        ids = self._namespace(namespace).list_ids(prefix)
+        for start in range(0, len(ids), 100):
+            yield ids[start:start + 100]
+
+
+def create_vector_store(pinecone_api_key: Optional[str], index_name: str, host: Optional[str]) -> VectorStore:
+    """Build the backend selected by VECTOR_STORE_BACKEND (pinecone or local)"""
+    backend = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+    if backend == "local":
+        return LocalVectorStore()
+    if backend == "pinecone":
+        return PineconeVectorStore(pinecone_api_key, index_name, host)
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend}")
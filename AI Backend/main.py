@@ -26,6 +26,30 @@ async def _load_emotion_sense_model():
     except Exception as e:
         print(f"WARNING: EmotionSense model failed to load: {e}")
 
+@app.on_event("startup")
+async def _start_ingestion_workers():
+    rag.job_manager.start()
+
+@app.on_event("shutdown")
+async def _stop_ingestion_workers():
+    await rag.job_manager.stop()
+
+@app.on_event("startup")
+async def _start_emotion_sense_jobs():
+    emotion_sense.job_manager.start()
+
+@app.on_event("shutdown")
+async def _stop_emotion_sense_jobs():
+    await emotion_sense.job_manager.stop()
+
+@app.on_event("startup")
+async def _start_session_sweeper():
+    AI_Chat.controller.sessions.start()
+
+@app.on_event("shutdown")
+async def _stop_session_sweeper():
+    await AI_Chat.controller.sessions.stop()
+
 # Include routers
 app.include_router(healthcheck.router)
 app.include_router(rag.router)
@@ -1,13 +1,22 @@
-from fastapi import APIRouter, HTTPException
+import json
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 from controllers.AI_Chat import RAGChatController
+from controllers.chat_batch import ChatBatchRunner, parse_records
+from controllers.admission import admission_controller, AdmissionRejected
+from routers.rag import controller as pdf_controller
+from routers.emotion_detection import controller as emotion_controller
 
 router = APIRouter(
     prefix="/api/chat",
     tags=["chat"]
 )
 
-controller = RAGChatController()
+# Reuse the emotion detector's all-MiniLM-L6-v2 embedder for the chat intent gate
+controller = RAGChatController(pdf_controller, emotion_controller.embedder)
+batch_runner = ChatBatchRunner(controller, admission_controller)
 
 
 class ChatRequest(BaseModel):
@@ -37,6 +46,7 @@ async def send_message(request: ChatRequest):
     - AI response based on documents and conversation history
     - Source documents used
     - Conversation length
+    - 429 with Retry-After when the organization is over its chat rate or the server is saturated
     """
     if not request.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
@@ -48,18 +58,108 @@ async def send_message(request: ChatRequest):
         raise HTTPException(status_code=400, detail="Organization ID is required")
     
     try:
-        result = controller.chat(
-            request.session_id,
-            request.organization_id,
-            request.query,
-            request.top_k,
-            request.score_threshold
-        )
+        async with admission_controller.admit("chat", request.organization_id):
+            result = await controller.achat(
+                request.session_id,
+                request.organization_id,
+                request.query,
+                request.top_k,
+                request.score_threshold
+            )
         return result
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/message/stream")
+async def stream_message(request: ChatRequest):
+    """
+    Send a message to the RAG chatbot and stream the answer as Server-Sent Events
+    
+    Takes the same fields as /message. Events:
+    - **sources**: documents retrieved for the answer (sent before generation starts)
+    - **token**: a piece of the cleaned response text
+    - **done**: the same payload /message returns, once history is updated
+    - **error**: generation failed; no history is recorded
+    
+    Returns 429 with Retry-After when the organization is over its chat rate or the server is saturated.
+    """
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    
+    if not request.session_id.strip():
+        raise HTTPException(status_code=400, detail="Session ID is required")
+    
+    if not request.organization_id.strip():
+        raise HTTPException(status_code=400, detail="Organization ID is required")
+    
+    # Admit before the 200 goes out so overload can still be answered with 429
+    try:
+        ticket = await admission_controller.acquire("chat", request.organization_id)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    async def event_stream():
+        try:
+            async for event in controller.astream_chat(
+                request.session_id,
+                request.organization_id,
+                request.query,
+                request.top_k,
+                request.score_threshold
+            ):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': f'Error in chat: {str(e)}'})}\n\n"
+        finally:
+            ticket.release()
+    
+    # The background task releases the slot if the client disconnects before the stream starts
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release)
+    )
+
+
+@router.post("/batch")
+async def batch_messages(
+    records_file: UploadFile = File(..., description="JSONL of {organization_id, session_id, query} records"),
+    concurrency: int = Form(8, ge=1, le=64, description="Maximum chat turns in flight (default: 8)")
+):
+    """
+    Replay a batch of chat messages for offline evaluation and benchmarking
+    
+    - **records_file**: one JSON object per line with organization_id, session_id and query
+      (optional id, top_k, score_threshold); turns of the same session run in file order
+    - **concurrency**: maximum number of turns processed at once
+    
+    Each turn goes through chat admission control for its organization; rejected
+    turns back off for Retry-After and are reported as errors if still rejected.
+    
+    Returns (streamed as JSON lines, in completion order):
+    - One result per record: response, sources, latency and per-stage timings, or an error
+    - A final summary line with throughput and latency percentiles
+    """
+    try:
+        content = (await records_file.read()).decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Records file must be UTF-8 encoded JSONL")
+    
+    records = parse_records(content.splitlines())
+    if not records:
+        raise HTTPException(status_code=400, detail="Records file contains no records")
+    
+    async def result_lines():
+        async for result in batch_runner.run(records, concurrency):
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+
 @router.post("/history")
 async def get_history(request: SessionRequest):
     """
@@ -130,3 +230,48 @@ async def delete_session(request: SessionRequest):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/session-stats")
+async def get_session_stats():
+    """
+    Chat session store metrics for monitoring
+    
+    Returns:
+    - Live sessions and estimated bytes held
+    - Evictions by reason (expired, max_sessions, max_bytes) and sweep count
+    """
+    try:
+        return controller.get_session_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/context-cache-stats")
+async def get_context_cache_stats():
+    """
+    Provider context cache metrics for the stable system prompt prefix
+    
+    Returns:
+    - Cache hits, misses, prefixes too small to cache and inline fallbacks
+    - Provider creates, TTL refreshes and failures
+    """
+    try:
+        return controller.get_context_cache_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/intent-stats")
+async def get_intent_stats():
+    """
+    Intent gate metrics for the chat endpoints
+    
+    Returns:
+    - Messages classified per intent, retrievals skipped and canned replies served
+    - Average retrieval latency and the estimated seconds saved by skipping
+    """
+    try:
+        return controller.get_intent_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,15 +1,25 @@
+import asyncio
+import json
 import shutil
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from controllers.emotion_sense_controller import emotion_sense_controller
+from controllers.emotion_sense_jobs import (
+    ACTIVE_STATUSES, EMOTION_SENSE_JOB_POLL_INTERVAL, MEDIA_MODES,
+    EmotionSenseJobManager, EmotionSenseJobQueueFull,
+)
+from controllers.emotion_sense_workers import EmotionSenseBusy
 
 router = APIRouter(
     prefix="/api/emotion-sense",
     tags=["emotion-sense"],
 )
 
+job_manager = EmotionSenseJobManager(emotion_sense_controller)
+
 
 class TextInput(BaseModel):
     text: str = Field(..., description="Plain text to analyse")
@@ -23,9 +33,22 @@ def health():
         "status": "ok",
         "model_loaded": emotion_sense_controller.is_loaded,
         "device": emotion_sense_controller.device,
+        "queue_depth": emotion_sense_controller.workers.queue_depth(),
     }
 
 
+@router.get("/batching")
+def batching_stats():
+    """Dynamic batching counters: queue depth, batch sizes, queue wait and batch latency."""
+    return emotion_sense_controller.get_batching_stats()
+
+
+@router.get("/workers")
+def worker_stats():
+    """Worker pool load: running and queued analyses, rejections, queue wait and run time."""
+    return emotion_sense_controller.get_worker_stats()
+
+
 @router.get("/metrics")
 def get_metrics():
     try:
@@ -38,34 +61,48 @@ def get_metrics():
 
 @router.post("/analyze")
 async def analyze_video(file: UploadFile = File(...)):
-    """Upload a video file; returns per-utterance emotion & sentiment predictions."""
+    """Upload a video file; returns per-utterance emotion & sentiment predictions (503 with Retry-After when the worker queue is full)."""
     if not emotion_sense_controller.is_loaded:
         raise HTTPException(status_code=503, detail="Model not loaded — check /api/emotion-sense/health")
+    # Reserve a worker before reading the upload so an overloaded pool sheds the request cheaply
+    try:
+        slot = emotion_sense_controller.workers.reserve("video")
+    except EmotionSenseBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     try:
         file_bytes = await file.read()
-        return emotion_sense_controller.analyze_video(file_bytes, file.filename or "upload.mp4")
+        return await slot.run(emotion_sense_controller.analyze_video, file_bytes, file.filename or "upload.mp4")
     except HTTPException:
         raise
     except Exception as e:
         import traceback; traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        slot.release()
 
 
 # ── Audio analysis ────────────────────────────────────────────────────────────
 
 @router.post("/analyze/audio")
 async def analyze_audio(file: UploadFile = File(...)):
-    """Upload an audio file; returns per-utterance emotion & sentiment predictions."""
+    """Upload an audio file; returns per-utterance emotion & sentiment predictions (503 with Retry-After when the worker queue is full)."""
     if not emotion_sense_controller.is_loaded:
         raise HTTPException(status_code=503, detail="Model not loaded — check /api/emotion-sense/health")
+    # Reserve a worker before reading the upload so an overloaded pool sheds the request cheaply
+    try:
+        slot = emotion_sense_controller.workers.reserve("audio")
+    except EmotionSenseBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     try:
         file_bytes = await file.read()
-        return emotion_sense_controller.analyze_audio(file_bytes, file.filename or "upload.mp3")
+        return await slot.run(emotion_sense_controller.analyze_audio, file_bytes, file.filename or "upload.mp3")
     except HTTPException:
         raise
     except Exception as e:
         import traceback; traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        slot.release()
 
 
 # ── Text analysis ─────────────────────────────────────────────────────────────
@@ -81,7 +118,123 @@ async def analyze_text(body: TextInput):
         raise HTTPException(status_code=422, detail="text field is empty.")
 
     try:
-        return emotion_sense_controller.analyze_text(text)
+        # Text needs no decoding: await the shared inference batcher directly instead of a worker thread
+        result = await emotion_sense_controller.workers.run_batched(
+            "text", lambda: emotion_sense_controller.submit_text(text)
+        )
+        return emotion_sense_controller.text_response(text, result)
+    except EmotionSenseBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         import traceback; traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# ── Long-media analysis jobs ──────────────────────────────────────────────────
+
+@router.post("/jobs")
+async def submit_analysis_job(
+    file: UploadFile = File(..., description="Video or audio recording to analyse"),
+    mode: str = Form("video", description="video or audio"),
+):
+    """
+    Queue a long recording for background analysis and return a job ID immediately (HTTP 202)
+
+    Follow **/api/emotion-sense/jobs/{job_id}/events** (Server-Sent Events) or poll
+    **/api/emotion-sense/jobs/{job_id}** to receive utterances as they are analysed.
+
+    - **file**: Video or audio recording
+    - **mode**: video (frames + audio + text) or audio (audio + text), default: video
+    """
+    if mode not in MEDIA_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(MEDIA_MODES)}")
+    if not emotion_sense_controller.is_loaded:
+        raise HTTPException(status_code=503, detail="Model not loaded — check /api/emotion-sense/health")
+    try:
+        job = await job_manager.submit(file, mode)
+        return JSONResponse(status_code=202, content=job)
+    except EmotionSenseJobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/jobs")
+def list_analysis_jobs(limit: int = 50):
+    """List recent analysis jobs, newest first."""
+    return {
+        "jobs": job_manager.list_jobs(max(1, min(limit, 500))),
+        "queue": job_manager.get_stats(),
+    }
+
+
+@router.get("/jobs/{job_id}")
+def get_analysis_job(job_id: str, after: int = 0):
+    """
+    Get a job's status, progress and the utterances analysed so far
+
+    - **after**: Only return utterances with a sequence number greater than this (default: 0)
+
+    Returns:
+    - Job status (queued, running, completed, failed, cancelled) and progress_percent
+    - Utterances in segment order, each with its sequence number ("seq")
+    - next_after: the value to pass as **after** on the next poll
+    """
+    job = job_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    utterances = job_manager.get_results(job_id, after)
+    return {**job, "utterances": utterances, "next_after": utterances[-1]["seq"] if utterances else after}
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_analysis_job(job_id: str, request: Request, after: int = 0):
+    """
+    Stream a job's utterances and progress as Server-Sent Events
+
+    Events: "utterance" (id = sequence number), "progress" and a final "done"
+    with the job record. Utterances already analysed are replayed first, so a
+    client that reconnects (EventSource sends Last-Event-ID) misses nothing.
+
+    - **after**: Resume after this sequence number (default: 0)
+    """
+    if job_manager.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after = max(after, int(last_event_id))
+
+    async def event_stream():
+        seq = after
+        last_progress = None
+        while True:
+            # Read the job before its results: a finished job has every result persisted
+            job = await asyncio.to_thread(job_manager.get_job, job_id)
+            utterances = await asyncio.to_thread(job_manager.get_results, job_id, seq)
+            for utterance in utterances:
+                seq = utterance["seq"]
+                yield f"id: {seq}\nevent: utterance\ndata: {json.dumps(utterance)}\n\n"
+            progress = (job["status"], job["stage"], job["processed_segments"], job["total_segments"])
+            if progress != last_progress:
+                last_progress = progress
+                yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+            if job["status"] not in ACTIVE_STATUSES and not utterances:
+                yield f"event: done\ndata: {json.dumps(job)}\n\n"
+                return
+            if not utterances:
+                await asyncio.sleep(EMOTION_SENSE_JOB_POLL_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_analysis_job(job_id: str):
+    """Cancel a queued or running analysis job; utterances analysed so far are kept."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
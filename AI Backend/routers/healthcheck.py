@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from controllers.healthcheck_controller import HealthCheckController
+from controllers.admission import admission_controller
 
 router = APIRouter(
     prefix="/api",
@@ -14,3 +15,16 @@ async def healthcheck():
     Healthcheck endpoint to verify the API is running
     """
     return controller.check_health()
+
+
+@router.get("/admin/admission-stats")
+async def admission_stats():
+    """
+    Admission control counters for dashboards
+    
+    Returns:
+    - Slots in flight, queue depth and queue wait histogram
+    - Admitted and rejected counts per endpoint and reason (rate_limited, queue_full, deadline, queue_timeout)
+    - Organizations rejected most often
+    """
+    return admission_controller.get_stats()
@@ -1,6 +1,10 @@
+from typing import List, Optional
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 from controllers.rag import PDFProcessingController
+from controllers.ingestion_jobs import IngestionJobManager, IngestionQueueFull
+from controllers.admission import admission_controller, AdmissionRejected
 
 router = APIRouter(
     prefix="/api/pdf",
@@ -8,6 +12,7 @@ router = APIRouter(
 )
 
 controller = PDFProcessingController()
+job_manager = IngestionJobManager(controller)
 
 
 class QueryRequest(BaseModel):
@@ -15,23 +20,32 @@ class QueryRequest(BaseModel):
     organization_id: str = Field(..., description="Organization ID to search within")
     top_k: int = Field(default=2, ge=1, le=10, description="Number of top results to return (default: 3)")
     score_threshold: float = Field(default=0.5, ge=0.0, le=1.0, description="Minimum similarity score (default: 0.5)")
+    mode: Optional[str] = Field(default=None, description="Retrieval mode: dense, hybrid or lexical (default: RETRIEVAL_MODE)")
 
 
 @router.post("/upload")
 async def upload_and_process_pdf(
     pdf_file: UploadFile = File(..., description="PDF file to process"),
-    organization_id: str = Form(..., description="Organization ID for namespace isolation")
+    organization_id: str = Form(..., description="Organization ID for namespace isolation"),
+    incremental: bool = Form(True, description="Only re-embed and upsert chunks that changed since the last upload"),
+    wait: bool = Form(False, description="Process inline and return the result instead of queueing a job")
 ):
     """
     Upload a PDF file, extract text, create embeddings, and store in Pinecone
     
+    The file is queued as a background ingestion job and a job ID is returned
+    immediately (HTTP 202); poll **/api/pdf/jobs/{job_id}** for progress.
+    
     - **pdf_file**: PDF file to be processed
     - **organization_id**: ID of the organization (used to create separate namespaces in Pinecone)
+    - **incremental**: Diff against the previous upload of this file and write only changed chunks (default: true)
+    - **wait**: Process synchronously within the request (default: false)
     
     Returns:
-    - Status of the operation
+    - Job ID and status (or, with wait=true, the processing result)
     - Number of chunks processed
     - Pinecone namespace used
+    - Re-index counts (added / updated / deleted / unchanged chunks)
     """
     # Validate file type
     if not pdf_file.filename.endswith('.pdf'):
@@ -41,12 +55,97 @@ async def upload_and_process_pdf(
         raise HTTPException(status_code=400, detail="Organization ID is required")
     
     try:
-        result = await controller.process_pdf(pdf_file, organization_id)
-        return result
+        if wait:
+            return await controller.process_pdf(pdf_file, organization_id, incremental)
+        job = await job_manager.submit(pdf_file, organization_id, incremental)
+        return JSONResponse(status_code=202, content=job)
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/upload/bulk")
+async def upload_bulk_pdfs(
+    organization_id: str = Form(..., description="Organization ID for namespace isolation"),
+    pdf_files: List[UploadFile] = File(default=[], description="PDF files to process"),
+    archive: Optional[UploadFile] = File(default=None, description="Zip archive of PDF files"),
+    incremental: bool = Form(True, description="Only re-embed and upsert chunks that changed since the last upload")
+):
+    """
+    Upload many PDFs at once (multiple files and/or a zip archive) as one background job
+    
+    Pages of all documents are extracted in parallel and their chunks share
+    embedding and upsert batches. Poll **/api/pdf/jobs/{job_id}** for progress;
+    the finished job's result lists per-file status and aggregate throughput.
+    
+    - **organization_id**: ID of the organization (used to create separate namespaces in Pinecone)
+    - **pdf_files**: One or more PDF files
+    - **archive**: A .zip containing PDF files (non-PDF members are ignored)
+    - **incremental**: Diff each file against its previous upload (default: true)
+    """
+    if not organization_id.strip():
+        raise HTTPException(status_code=400, detail="Organization ID is required")
+    
+    if not pdf_files and archive is None:
+        raise HTTPException(status_code=400, detail="Provide PDF files or a zip archive")
+    
+    if archive is not None and not archive.filename.lower().endswith('.zip'):
+        raise HTTPException(status_code=400, detail="Archive must be a .zip file")
+    
+    try:
+        job = await job_manager.submit_bulk(pdf_files, archive, organization_id, incremental)
+        return JSONResponse(status_code=202, content=job)
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/jobs")
+async def list_ingestion_jobs(organization_id: Optional[str] = None, limit: int = 50):
+    """
+    List recent ingestion jobs, newest first
+    
+    - **organization_id**: Only show jobs for this organization (optional)
+    - **limit**: Maximum number of jobs to return (default: 50)
+    """
+    return {
+        "status": "success",
+        "jobs": job_manager.list_jobs(organization_id, max(1, min(limit, 500))),
+        "queue": job_manager.get_stats()
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """
+    Get the status and stage-level progress of an ingestion job
+    
+    Returns:
+    - Job status (queued, running, completed, failed, cancelled)
+    - Progress: pages extracted, chunks embedded, vectors stored
+    - Processing result once completed
+    """
+    job = job_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_ingestion_job(job_id: str):
+    """
+    Cancel a queued or running ingestion job
+    """
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
 @router.post("/query")
 async def query_documents(request: QueryRequest):
     """
@@ -56,10 +155,12 @@ async def query_documents(request: QueryRequest):
     - **organization_id**: Organization ID (searches within org-specific namespace)
     - **top_k**: Number of results to return (1-10, default: 3)
     - **score_threshold**: Minimum similarity score (0.0-1.0, default: 0.5)
+    - **mode**: dense, hybrid (BM25 + vectors fused with reciprocal rank fusion) or lexical
     
     Returns:
     - List of relevant documents with scores and metadata
     - Source PDF filename and chunk information
+    - 429 with Retry-After when the organization is over its query rate or the server is saturated
     """
     if not request.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
@@ -68,12 +169,67 @@ async def query_documents(request: QueryRequest):
         raise HTTPException(status_code=400, detail="Organization ID is required")
     
     try:
-        result = controller.retrieve_documents(
-            request.query, 
-            request.organization_id, 
-            request.top_k, 
-            request.score_threshold
-        )
+        async with admission_controller.admit("query", request.organization_id):
+            result = await controller.aretrieve_documents(
+                request.query, 
+                request.organization_id, 
+                request.top_k, 
+                request.score_threshold,
+                request.mode
+            )
         return result
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/embedding-stats")
+async def get_embedding_stats():
+    """
+    Embedding throughput and cache counters for monitoring
+    
+    Returns:
+    - Texts embedded, batch counts, retries and chunks/sec
+    - Batch latency histogram
+    - Embedding cache hits, misses, evictions and size
+    """
+    try:
+        return controller.get_embedding_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.delete("/admin/embedding-cache")
+async def clear_embedding_cache():
+    """
+    Clear the persistent embedding cache
+    """
+    try:
+        return controller.clear_embedding_cache()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/retrieval-cache-stats")
+async def get_retrieval_cache_stats():
+    """
+    Query-embedding and semantic result cache counters for monitoring
+    """
+    try:
+        return controller.get_retrieval_cache_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/reranker-stats")
+async def get_reranker_stats():
+    """
+    Cross-encoder reranker counters: scored pairs, score cache hits, budget fallbacks and latency
+    """
+    try:
+        return controller.get_reranker_stats()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
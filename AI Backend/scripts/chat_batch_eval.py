@@ -0,0 +1,59 @@
+"""
+Offline replay of chat records through RAGChatController
+
+Reads a JSONL file of {"organization_id", "session_id", "query"} records and
+writes one JSON result per line (response, sources, latency and per-stage
+timings) followed by a summary line. Runs in-process, so no server is needed
+and all turns share the same embedding and retrieval caches. The controller is
+built like the server's, including the all-MiniLM-L6-v2 intent embedder:
+
+    python scripts/chat_batch_eval.py questions.jsonl --concurrency 16 --output results.jsonl
+
+Use --concurrency 1,8,32 to rerun the same records at several levels as a throughput benchmark.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sentence_transformers import SentenceTransformer  # noqa: E402
+from controllers.AI_Chat import RAGChatController  # noqa: E402
+from controllers.chat_batch import ChatBatchRunner, parse_records  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("records", help="JSONL file of chat records")
+    parser.add_argument("--concurrency", default="8", help="Comma-separated concurrency levels")
+    # The controllers log progress with print, so results go to a file rather than stdout
+    parser.add_argument("--output", default="chat_batch_results.jsonl", help="Results JSONL file")
+    args = parser.parse_args()
+
+    with open(args.records, encoding="utf-8") as f:
+        records = parse_records(f)
+    # Same intent gate embedder the server shares with the emotion detector
+    runner = ChatBatchRunner(RAGChatController(embedder=SentenceTransformer("all-MiniLM-L6-v2")))
+
+    summaries = []
+    with open(args.output, "w", encoding="utf-8") as out:
+        for level in (int(level) for level in args.concurrency.split(",")):
+            async for result in runner.run(records, level):
+                out.write(json.dumps(result) + "\n")
+                if "summary" in result:
+                    summaries.append(result["summary"])
+            out.flush()
+
+    print(f"\nResults written to {args.output}", file=sys.stderr)
+    print(f"{'conc':>6} {'ok':>6} {'err':>5} {'secs':>8} {'turn/s':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}",
+          file=sys.stderr)
+    for s in summaries:
+        print(f"{s['concurrency']:>6} {s['ok']:>6} {s['errors']:>5} {s['elapsed_seconds']:>8.2f} "
+              f"{s['turns_per_second']:>8.2f} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Concurrent load test for POST /api/chat/message
+
+Runs the same number of chat requests at each concurrency level and prints
+throughput and latency percentiles, so blocking and non-blocking chat paths
+can be compared on a single uvicorn worker:
+
+    python scripts/chat_load_test.py --organization-id acme --requests 200 --concurrency 1,10,50,200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+import httpx
+
+QUERIES = [
+    "What is your refund policy?",
+    "How long does shipping take?",
+    "How do I reset my password?",
+    "Can I change my order after placing it?",
+    "What payment methods do you accept?",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_level(client: httpx.AsyncClient, url: str, organization_id: str, total: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        payload = {
+            "session_id": f"load-{uuid.uuid4().hex[:12]}",
+            "organization_id": organization_id,
+            "query": QUERIES[i % len(QUERIES)],
+        }
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=payload)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+            except httpx.HTTPError as e:
+                errors += 1
+                print(f"  request {i} failed: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--organization-id", required=True)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,10,50", help="Comma-separated concurrency levels")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    url = f"{args.base_url.rstrip('/')}/api/chat/message"
+    levels = [int(level) for level in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+
+    print(f"{'conc':>6} {'ok':>6} {'err':>5} {'secs':>8} {'req/s':>8} {'p50':>7} {'p95':>7} {'p99':>7}")
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        for level in levels:
+            r = await run_level(client, url, args.organization_id, args.requests, level)
+            print(f"{r['concurrency']:>6} {r['ok']:>6} {r['errors']:>5} {r['elapsed']:>8.2f} {r['rps']:>8.2f} "
+                  f"{r['p50']:>7.2f} {r['p95']:>7.2f} {r['p99']:>7.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Utterances/sec of EmotionSense multimodal inference at several micro-batch sizes
+
+Loads the model as the API does and runs the same synthetic utterances
+(text plus random 30-frame clips and mel features) through
+_run_inference_batch at each batch size, on CPU unless CUDA is available:
+
+    python scripts/emotion_sense_batch_benchmark.py --utterances 64 --batch-sizes 1,8,32 --threads 8
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import torch  # noqa: E402
+from controllers.emotion_sense_controller import emotion_sense_controller  # noqa: E402
+
+TEXTS = [
+    "I have been waiting for my refund for three weeks and nobody answers.",
+    "Thanks so much, that fixed it!",
+    "Can you tell me when the new plan starts?",
+    "This is the third time the app crashed today.",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--utterances", type=int, default=64)
+    parser.add_argument("--batch-sizes", default="1,8,32", help="Comma-separated micro-batch sizes")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 keeps the default)")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs per batch size (best is reported)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    emotion_sense_controller.load()
+    print(f"device={emotion_sense_controller.device} threads={torch.get_num_threads()} "
+          f"default batch size={emotion_sense_controller._model_dict['batch_size']}")
+
+    generator = torch.Generator().manual_seed(0)
+    items = [
+        (
+            TEXTS[i % len(TEXTS)],
+            torch.rand(30, 3, 224, 224, generator=generator),
+            torch.randn(1, 64, 300, generator=generator),
+        )
+        for i in range(args.utterances)
+    ]
+
+    # Warm-up so lazy initialisation is not timed
+    emotion_sense_controller._run_inference_batch(items[:2], 2)
+
+    print(f"{'batch':>6} {'secs':>8} {'utt/s':>8} {'speedup':>8}")
+    baseline = None
+    for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+        best = None
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            emotion_sense_controller._run_inference_batch(items, batch_size)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        rate = args.utterances / best
+        baseline = baseline or rate
+        print(f"{batch_size:>6} {best:>8.2f} {rate:>8.2f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import time
+
+from controllers.context_cache import ContextCacheManager, LocalContextCacheBackend
+
+
+def _manager(monkeypatch):
+    # Renew the FAQ selection on every call so each step sees the current snippets
+    monkeypatch.setenv("CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", "0")
+    monkeypatch.delenv("CONTEXT_CACHE_MIN_TOKENS", raising=False)
+    return ContextCacheManager(LocalContextCacheBackend())
+
+
+def _wait_idle(manager):
+    deadline = time.time() + 5
+    while manager.get_stats()["pending"] and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def _prefix(faq):
+    return "You are a support assistant.\n" + "\n".join(text for _, text in faq)
+
+
+def test_generation_bump_drops_stale_snippets(monkeypatch):
+    manager = _manager(monkeypatch)
+    manager.note_retrieved("org", [{"vector_id": "refunds", "content": "Refunds take 5 days."}], generation=1)
+    assert manager.faq_for("org", generation=1) == [("refunds", "Refunds take 5 days.")]
+
+    # An upload moved the organization to generation 2: the old text must not be served
+    assert manager.faq_for("org", generation=2) == []
+
+    # A retrieval that started before the upload is counted but its text is not kept
+    manager.note_retrieved("org", [{"vector_id": "refunds", "content": "Refunds take 5 days."}], generation=1)
+    assert manager.faq_for("org", generation=2) == []
+
+    manager.note_retrieved("org", [{"vector_id": "refunds", "content": "Refunds take 10 days."}], generation=2)
+    assert manager.faq_for("org", generation=2) == [("refunds", "Refunds take 10 days.")]
+
+
+def test_generation_bump_replaces_cached_prefix(monkeypatch):
+    manager = _manager(monkeypatch)
+    backend = manager.backend
+    manager.note_retrieved("org", [{"vector_id": "refunds", "content": "Refunds take 5 days."}], generation=1)
+    old_prefix = _prefix(manager.faq_for("org", generation=1))
+
+    assert manager.lookup("org", "chat", old_prefix) is None
+    _wait_idle(manager)
+    old_name = manager.lookup("org", "chat", old_prefix)
+    assert old_name in backend.entries
+
+    manager.note_retrieved("org", [{"vector_id": "refunds", "content": "Refunds take 10 days."}], generation=2)
+    new_prefix = _prefix(manager.faq_for("org", generation=2))
+    assert "10 days" in new_prefix and "5 days" not in new_prefix
+
+    # The changed prefix misses, is recreated in the background and replaces the old cache
+    assert manager.lookup("org", "chat", new_prefix) is None
+    _wait_idle(manager)
+    new_name = manager.lookup("org", "chat", new_prefix)
+    assert new_name is not None and new_name != old_name
+    assert old_name not in backend.entries
+    assert backend.entries[new_name]["system_instruction"] == new_prefix
@@ -0,0 +1,23 @@
+import os
+
+from controllers.vector_store import LocalVectorStore, namespace_dirname
+
+
+def test_namespace_dirnames_do_not_collide():
+    names = ["a/b", "a_b", "a%2Fb", "", "~", ".", ".."]
+    dirnames = [namespace_dirname(name) for name in names]
+    assert len(set(dirnames)) == len(names)
+    for dirname in dirnames:
+        assert "/" not in dirname and dirname not in (".", "..")
+
+
+def test_slash_and_underscore_namespaces_stay_separate(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    store.upsert([{"id": "slash", "values": [1.0, 0.0], "metadata": {"ns": "a/b"}}], namespace="a/b")
+    store.upsert([{"id": "underscore", "values": [1.0, 0.0], "metadata": {"ns": "a_b"}}], namespace="a_b")
+    assert len(os.listdir(tmp_path)) == 2
+
+    # Reopen from disk so the directory mapping, not the in-memory cache, is what is tested
+    reopened = LocalVectorStore(str(tmp_path))
+    assert [m["id"] for m in reopened.query([1.0, 0.0], 5, namespace="a/b")["matches"]] == ["slash"]
+    assert [m["id"] for m in reopened.query([1.0, 0.0], 5, namespace="a_b")["matches"]] == ["underscore"]